@@ -2,12 +2,15 @@
 Description: Contains the implementation for a Bloom Filter
 """
 
-import mmh3
 import math
 import sys
+import numpy as np
+import hashing
+import serialization
 from bitarray import bitarray
+from kmers import KmerItems
 
-class BloomFilter:
+class BloomFilter(KmerItems, serialization.Serializable):
 
     def __init__(self, expected_num, fp_prob):
         """
@@ -24,25 +27,98 @@ class BloomFilter:
         self.filter = bitarray(self.size)
         self.filter.setall(0)
     
+    def get_state(self):
+        """
+        Returns the parameters and the raw bit table, see serialization.Serializable
+        """
+        params = {"expected_num": self.expected_num, "fp_prob": self.fp_prob, "size": self.size,
+                  "num_hashes": self.num_hashes, "endian": self.filter.endian, **self.get_kmer_params()}
+        return params, {"bits": serialization.bitarray_section(self.filter)}
+
+    @classmethod
+    def from_state(cls, params, sections):
+        bloom = cls.__new__(cls)
+        bloom.expected_num = params["expected_num"]
+        bloom.fp_prob = params["fp_prob"]
+        bloom.size = params["size"]
+        bloom.num_hashes = params["num_hashes"]
+        bloom.filter = serialization.bitarray_from_section(sections["bits"], bloom.size, params["endian"])
+        bloom.set_kmer_params(params)
+        return bloom
+
+    def get_positions(self, item):
+        """
+        Returns the num_hashes bit positions of an item, derived from one
+        hash evaluation by double hashing: (h1 + i * h2) mod size
+        """
+        h1, h2 = hashing.hash_pair(item)
+        return [((h1 + i * h2) & hashing.MASK64) % self.size for i in range(self.num_hashes)]
+
+    def get_positions_many(self, items):
+        """
+        Vectorized get_positions. Returns a (len(items), num_hashes) uint64 array.
+        """
+        return get_positions_array(items, self.size, self.num_hashes)
+
+    def get_bytes_view(self):
+        """
+        Returns a NumPy uint8 view over the bitarray buffer, without copying
+        """
+        return np.frombuffer(self.filter, dtype=np.uint8)
+
     def insert(self, item):
         """
         Insert the given item into the bloom filter
         """
-        for i in range(0, self.num_hashes):
-            index = mmh3.hash(item, i) % self.size
+        for index in self.get_positions(item):
             self.filter[index] = 1
         return True
-    
+
     def contains(self, item):
         """
         Check if item probably is in filter (True), and if definitely not (False)
         """
-        for i in range(0, self.num_hashes):
-            index = mmh3.hash(item, i) % self.size
+        for index in self.get_positions(item):
             if self.filter[index] == 0:
                 return False
         return True
 
+    def insert_many(self, items):
+        """
+        Insert a batch of items (strings or packed k-mers), setting all of
+        their bits with one NumPy operation
+        """
+        if len(items) == 0:
+            return True
+        positions = self.get_positions_many(items).ravel()
+        np.bitwise_or.at(self.get_bytes_view(), positions >> np.uint64(3), self.get_bit_masks(positions))
+        return True
+
+    def contains_many(self, items):
+        """
+        Query a batch of items. Returns a boolean array, True where the item
+        probably is in the filter.
+        """
+        if len(items) == 0:
+            return np.zeros(0, dtype=bool)
+        return self.test_positions(self.get_positions_many(items))
+
+    def test_positions(self, positions):
+        """
+        Tests an array of bit positions in bulk, reducing over the last axis
+        """
+        set_bits = (self.get_bytes_view()[positions >> np.uint64(3)] & self.get_bit_masks(positions)) != 0
+        return set_bits.all(axis=-1)
+
+    def get_bit_masks(self, positions):
+        """
+        Masks selecting each position inside its byte, following the bitarray endianness
+        """
+        offsets = (positions & np.uint64(7)).astype(np.uint8)
+        if self.filter.endian == "big":
+            offsets = np.uint8(7) - offsets
+        return np.left_shift(np.uint8(1), offsets)
+
     def get_filter_size(self):
         """
         Determine size of Bloom filter based on the desired false positive
@@ -71,3 +147,15 @@ class BloomFilter:
             sys.getsizeof(self.num_hashes) +
             sys.getsizeof(self.filter)
         )
+
+
+def get_positions_array(items, size, num_hashes):
+    """
+    Returns the (len(items), num_hashes) bit positions of items in any Bloom
+    filter of this size and hash count, see BloomFilter.get_positions
+    """
+    h1, h2 = hashing.hash_pair_array(items)
+    steps = np.arange(num_hashes, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        positions = h1[:, None] + steps[None, :] * h2[:, None]
+    return positions % np.uint64(size)
@@ -2,25 +2,35 @@ from typing import List, Optional, Deque
 from bloom_filter import BloomFilter
 from collections import deque
 from read import Read
+from fastq import dataset_name
+from kmers import kmerizer
 from copy import deepcopy
 from bitarray import bitarray
 from bitarray.util import count_xor
+import numpy as np
+import clustering
+import serialization
 import sys
 
 
-class BloomTree:
+class BloomTree(serialization.Serializable):
 
-    def __init__(self, theta, k, expected_num, fp_prob):
+    def __init__(self, theta, k, expected_num, fp_prob, packed=False, canonical=False):
         """
         Wrapper around the Node structure of tree for inserting, querying
         :param theta: Parameter to determine strictness of querying
         :param k: Size of kmer
         :param expected_num: Bloom Filter parameter
         :param fp_prob: Bloom Filter parameter
+        :param packed: Use 2-bit packed integer k-mers instead of string slices
+        :param canonical: Treat a k-mer and its reverse complement as the same item
         """
         self.root: Optional[Node] = None
         self.theta: float = theta
         self.k: int = k
+        self.packed = packed
+        self.canonical = canonical
+        self.kmerize = kmerizer(k, packed, canonical)
         self.expected_num = expected_num
         self.fp_prob = fp_prob
         self.aggregate_size = self.get_insternal_size()
@@ -30,7 +40,7 @@ class BloomTree:
         Creates a new node from this dataset and inserts it into the tree
         :return: None
         """
-        node_to_insert = Node(self.k, self.expected_num, self.fp_prob)
+        node_to_insert = self.new_node()
         node_to_insert.populate_dataset_info(dataset)
         self.aggregate_size += node_to_insert.get_size()
 
@@ -47,7 +57,7 @@ class BloomTree:
                 create a new parent that contains node_to_insert
                 and current as children
                 """
-                new_parent = Node(self.k, self.expected_num, self.fp_prob)
+                new_parent = self.new_node()
                 new_parent.parent = parent
                 self.aggregate_size += new_parent.get_size()
 
@@ -93,6 +103,39 @@ class BloomTree:
 
         raise Exception("Did not insert successfully!")
 
+    def build_bulk(self, datasets: List[List[Read]], workers: int = 1) -> None:
+        """
+        Builds the tree from a known batch of datasets at once instead of inserting them
+        one by one: the leaves are built first, then the most similar nodes (fewest
+        differing filter bits) are joined bottom-up, see clustering.build_bottom_up.
+        :param datasets: The reads of every dataset
+        :param workers: Number of processes building the leaves
+        :return: None
+        """
+        if self.root is not None:
+            raise ValueError("build_bulk builds a whole tree, this one already holds datasets")
+        leaves = clustering.build_leaves(self, datasets, workers)
+        for leaf in leaves:
+            self.aggregate_size += leaf.get_size()
+        self.root = clustering.build_bottom_up(leaves, lambda node: node, lambda node, other: node.score(other),
+                                               self.make_parent)
+
+    def new_node(self, node_filter=None) -> 'Node':
+        return Node(self.k, self.expected_num, self.fp_prob, self.packed, self.canonical, node_filter=node_filter)
+
+    def make_parent(self, left: 'Node', right: 'Node') -> 'Node':
+        """
+        Returns a new internal node over left and right, holding the k-mers of both
+        """
+        parent = self.new_node()
+        self.aggregate_size += parent.get_size()
+        parent.filter.filter = bitarray(left.filter.filter)
+        parent.add_node_kmers(right)
+        for child in (left, right):
+            child.parent = parent
+            parent.children.append(child)
+        return parent
+
     def query(self, query: str) -> List[str]:
         """
         Perform a DFS of the tree and collects reads that
@@ -100,31 +143,96 @@ class BloomTree:
         :param query: The query string to be broken into kmers
         :return: The list of read_ids that "match"
         """
-        nodes_to_explore: Deque[Node] = deque()
-        nodes_to_explore.append(self.root)
+        # Every node filter has the same size and hash count, so the bit
+        # positions of the query k-mers are computed once for the whole tree
+        positions = self.get_query_positions(query)
+        kmers_needed = self.theta * len(positions)
+
+        # Each node comes with the k-mers its parent holds: the parent's bits are
+        # the union of its children's, so a k-mer it lacks is in none of them
+        nodes_to_explore: Deque = deque()
+        nodes_to_explore.append((self.root, np.arange(len(positions))))
 
         out: List[str] = []
         while nodes_to_explore:
-            current = nodes_to_explore.popleft()
-            total_kmers_found = 0
-            total_kmers = 0
-            for kmer in kmers_in_string(query, self.k):
-                if current.filter.contains(kmer):
-                    total_kmers_found += 1
-                total_kmers += 1
-            if total_kmers_found >= self.theta * total_kmers:
+            current, alive = nodes_to_explore.popleft()
+            if len(alive) < kmers_needed:
+                continue
+            present = alive[serialization.resolve_filter(current.filter).test_positions(positions[alive])]
+            if len(present) >= kmers_needed:
                 for child in current.children:
-                    nodes_to_explore.append(child)
+                    nodes_to_explore.append((child, present))
                 if current.num_children() == 0:
                     out.append(current.dataset_id)
         return out
 
+    def get_query_positions(self, query: str):
+        """
+        Returns the (num_kmers, num_hashes) bit positions of the query k-mers, valid in every node filter
+        """
+        return self.root.filter.get_positions_many(list(self.kmerize(query)))
+
+    def query_many(self, queries: List[str]) -> List[List[str]]:
+        """
+        Queries a batch together in one pass over the tree. The k-mers of every query
+        are hashed once, then each visited node probes, in one vectorized lookup, the
+        alive k-mers of all queries that passed its parent.
+        :param queries: The query strings to be broken into kmers
+        :return: For every query, the list of read_ids that "match", as query() returns them
+        """
+        kmers, owners = [], []
+        for query_index, query in enumerate(queries):
+            query_kmers = list(self.kmerize(query))
+            kmers.extend(query_kmers)
+            owners.extend([query_index] * len(query_kmers))
+        owners = np.array(owners, dtype=np.intp)
+        kmers_needed = self.theta * np.bincount(owners, minlength=len(queries))
+        positions = self.root.filter.get_positions_many(kmers)
+
+        out: List[List[str]] = [[] for _ in queries]
+        nodes_to_explore: Deque = deque()
+        nodes_to_explore.append((self.root, np.arange(len(queries)), np.arange(len(kmers))))
+        while nodes_to_explore:
+            current, alive_queries, alive = nodes_to_explore.popleft()
+            present = alive[serialization.resolve_filter(current.filter).test_positions(positions[alive])]
+            found = np.bincount(owners[present], minlength=len(queries))
+            passed = alive_queries[found[alive_queries] >= kmers_needed[alive_queries]]
+            if len(passed) == 0:
+                continue
+            if current.num_children() == 0:
+                for query_index in passed.tolist():
+                    out[query_index].append(current.dataset_id)
+            else:
+                present = present[np.isin(owners[present], passed)]
+                for child in current.children:
+                    nodes_to_explore.append((child, passed, present))
+        return out
+
     def contains(self, query):
         """
         A wrapper for backward comptibility with other data structure implementations
         """
         return self.query(query)
 
+    def get_state(self):
+        """
+        Returns the tree parameters, the topology and every node filter, see serialization.tree_state
+        """
+        params = {"theta": self.theta, "k": self.k, "packed": self.packed, "canonical": self.canonical,
+                  "expected_num": self.expected_num, "fp_prob": self.fp_prob, "aggregate_size": self.aggregate_size}
+        return serialization.tree_state(self.root, params)
+
+    @classmethod
+    def from_state(cls, params, sections):
+        tree = cls(params["theta"], params["k"], params["expected_num"], params["fp_prob"], params["packed"],
+                   params["canonical"])
+        tree.aggregate_size = params["aggregate_size"]
+        tree.root = serialization.tree_root_from_state(params, sections, tree.load_node)
+        return tree
+
+    def load_node(self, node_params, node_sections):
+        return self.new_node(BloomFilter.from_state(node_params["filter"], node_sections))
+
     def get_insternal_size(self):
         """
         Returns the total number of bytes occupied by the filter object
@@ -140,26 +248,28 @@ class BloomTree:
 
 class Node:
 
-    def __init__(self, k, expected_num, fp_prob):
+    def __init__(self, k, expected_num, fp_prob, packed=False, canonical=False, node_filter=None):
         """
         Represents a single node of Bloom Tree
-
+        :param node_filter: Existing filter to wrap (e.g. loaded from disk) instead of a new empty one
         """
         self.children: List[Node] = []
         self.parent: Optional[Node] = None
-        self.filter = BloomFilter(expected_num, fp_prob)
+        if node_filter is None:
+            node_filter = BloomFilter(expected_num, fp_prob)
+        self.filter = node_filter
 
         self.dataset_id: Optional[str] = None
         self.k = k
+        self.kmerize = kmerizer(k, packed, canonical)
 
     def populate_dataset_info(self, dataset: List[Read]) -> None:
-        self.dataset_id = dataset[0].filename
+        self.dataset_id = dataset_name(dataset)
         self.insert_kmers_from_dataset(dataset)
 
     def insert_kmers_from_dataset(self, dataset: List[Read]) -> None:
         for read in dataset:
-            for kmer in read.kmers(self.k):
-                self.filter.insert(kmer)
+            self.filter.insert_many(list(self.kmerize(read.line)))
 
     def add_node_kmers(self, other: 'Node') -> None:
         self.filter.filter |= other.filter.filter
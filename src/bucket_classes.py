@@ -4,7 +4,11 @@ Description: Contains the basic implementation for a Bucket in Cuckoo Filter
 import random
 import sys
 from sys import getsizeof
+import numpy as np
 from bitarray import bitarray
+from bitarray.util import ba2int, int2ba
+from itertools import combinations_with_replacement
+import serialization
 
 class Bucket:
 
@@ -63,180 +67,176 @@ class Bucket:
 
 class bitBucketArray:
 
-    def __init__(self, buckets, num_entries, fp_size):
+    def __init__(self, buckets, num_entries, fp_size, state=None):
         """
         Creates a bucket array implemented with bitarrays.
 
             buckets --> how many buckets are in this array
             num_entries --> number of fingerprints in each bucket
             fp_size --> size in bits of fingerprints
+            state --> tables saved by get_state to use instead of allocating empty ones
+
+        Each bucket is read and written as one integer word, with entry j in
+        bits [j * fp_size, (j + 1) * fp_size), so lookups compare every entry
+        at once with shifts and masks instead of walking single bits.
         """
         self.num_buckets = buckets
         self.fp_size = fp_size
         self.num_entries = num_entries
-        self.curr_entries_per_bucket = [0 for i in range(self.num_buckets)]
-        self.filter = bitarray(self.fp_size * self.num_buckets * self.num_entries)
-        self.filter.setall(0)
-    
+        self.bucket_bits = self.fp_size * self.num_entries
+        if state is None:
+            self.curr_entries_per_bucket = [0 for i in range(self.num_buckets)]
+            self.filter = bitarray(self.bucket_bits * self.num_buckets, endian='little')
+            self.filter.setall(0)
+        else:
+            self.set_state(state)
+        self.fp_mask = (1 << self.fp_size) - 1
+        # low_bits[c] has the lowest bit of each of the first c entries set, high_bits[c] the highest
+        self.low_bits = [sum(1 << (j * self.fp_size) for j in range(c)) for c in range(self.num_entries + 1)]
+        self.high_bits = [low << (self.fp_size - 1) for low in self.low_bits]
+
+    def get_state(self):
+        """
+        Returns the raw bucket tables as a dict of NumPy arrays, for saving
+        """
+        return {"bits": serialization.bitarray_section(self.filter),
+                "counts": np.array(self.curr_entries_per_bucket, dtype=np.uint16)}
+
+    def set_state(self, sections):
+        """
+        Takes over the tables saved by get_state. Read-only (memory-mapped)
+        sections are used in place, so the array is then read-only too.
+        """
+        self.filter = serialization.bitarray_from_section(sections["bits"], self.bucket_bits * self.num_buckets, "little")
+        counts = sections["counts"]
+        self.curr_entries_per_bucket = counts.tolist() if counts.flags.writeable else counts
+
     @staticmethod
     def get_binary_string(fp_size, fp):
         format_str = "{0:0" + str(fp_size) + "b}"
         return format_str.format(fp)
-    
+
+    def get_bucket_word(self, bucket_num):
+        start_pos = bucket_num * self.bucket_bits
+        return ba2int(self.filter[start_pos:start_pos + self.bucket_bits])
+
+    def set_bucket_word(self, bucket_num, word):
+        start_pos = bucket_num * self.bucket_bits
+        self.filter[start_pos:start_pos + self.bucket_bits] = int2ba(word, self.bucket_bits, endian='little')
+
+    def get_match_bits(self, bucket_num, fp):
+        """
+        Word-parallel match test: XOR the bucket with fp copied into every
+        occupied entry, then flag the entries that became zero. Returns a word
+        whose lowest set bit lies in the first matching entry, 0 if none match.
+        """
+        count = self.curr_entries_per_bucket[bucket_num]
+        if count == 0:
+            return 0
+        x = self.get_bucket_word(bucket_num) ^ (fp * self.low_bits[count])
+        return (x - self.low_bits[count]) & ~x & self.high_bits[count]
+
     def get_inner_bucket_position(self, bucket_num, fp):
-        start_pos = bucket_num * self.fp_size * self.num_entries
-        end_pos = (bucket_num * self.fp_size * self.num_entries) + (self.curr_entries_per_bucket[bucket_num] * self.fp_size)
-        bit_str = ""
-        entry_pos = 0
-        for bit_pos in range(start_pos, end_pos):
-            if self.filter[bit_pos]: #Put together the fingerprint
-                bit_str += "1"
-            else:
-                bit_str += "0"
-            
-            if (bit_pos+1) % self.fp_size == 0: #Check if fingerprint matches
-                curr_fp = int(bit_str, 2)
-                if curr_fp == fp:
-                    return entry_pos
-                entry_pos += 1
-                bit_str = ""
+        match_bits = self.get_match_bits(bucket_num, fp)
+        if match_bits:
+            return ((match_bits & -match_bits).bit_length() - 1) // self.fp_size
 
     def isFull(self, bucket_num):
         if self.curr_entries_per_bucket[bucket_num] >= self.num_entries:
             return True
         return False
-    
+
     def contains(self, bucket_num, fp):
-        start_pos = bucket_num * self.fp_size * self.num_entries
-        end_pos = (bucket_num * self.fp_size * self.num_entries) + (self.curr_entries_per_bucket[bucket_num] * self.fp_size)
-        bit_str = ""
-        for bit_pos in range(start_pos, end_pos):
-            if self.filter[bit_pos]: #Put together the fingerprint
-                bit_str += "1"
-            else:
-                bit_str += "0"
-            
-            if (bit_pos+1) % self.fp_size == 0: #Check if fingerprint matches
-                curr_fp = int(bit_str, 2)
-                if curr_fp == fp:
-                    return True
-                bit_str = ""
-        return False
-    
+        return self.get_match_bits(bucket_num, fp) != 0
+
+    def contains_many(self, bucket_nums, fps):
+        """
+        Tests fps[i] against bucket bucket_nums[i] for every i at once. Returns a boolean array.
+        """
+        if self.fp_size > 57:
+            return np.fromiter((self.contains(bucket_num, fp) for bucket_num, fp in
+                                zip(np.asarray(bucket_nums).tolist(), np.asarray(fps).tolist())),
+                               dtype=bool, count=len(bucket_nums))
+        entries, occupied = self.gather_buckets(bucket_nums)
+        return ((entries == np.asarray(fps, dtype=np.uint64)[:, None]) & occupied).any(axis=1)
+
+    def gather_buckets(self, bucket_nums):
+        """
+        Reads whole buckets at once: every entry is gathered from the bytes of the
+        bitarray and shifted into place (fp_size up to 57 bits, so an entry and its
+        bit offset fit in one 64-bit word). Returns a (len(bucket_nums), num_entries)
+        uint64 array of entries and a boolean array marking the occupied ones.
+        """
+        data = np.frombuffer(self.filter, dtype=np.uint8)
+        bit_starts = (np.asarray(bucket_nums, dtype=np.uint64)[:, None] * np.uint64(self.bucket_bits) +
+                      np.arange(self.num_entries, dtype=np.uint64)[None, :] * np.uint64(self.fp_size))
+        byte_starts = (bit_starts >> np.uint64(3)).astype(np.intp)
+        words = np.zeros(bit_starts.shape, dtype=np.uint64)
+        for byte in range((self.fp_size + 14) // 8):
+            # Bytes past the end of the buffer only ever land above the entry, where they are masked off
+            gathered = data[np.minimum(byte_starts + byte, len(data) - 1)].astype(np.uint64)
+            words |= gathered << np.uint64(8 * byte)
+        entries = (words >> (bit_starts & np.uint64(7))) & np.uint64(self.fp_mask)
+        counts = np.asarray(self.curr_entries_per_bucket)[np.asarray(bucket_nums, dtype=np.intp)]
+        return entries, np.arange(self.num_entries) < counts[:, None]
+
+    def get_entries(self):
+        """
+        Returns every stored fingerprint and the bucket holding it, as two uint64 arrays
+        """
+        if self.fp_size > 57:
+            return get_entries_from_lists(self)
+        entries, occupied = self.gather_buckets(np.arange(self.num_buckets))
+        return entries[occupied], np.nonzero(occupied)[0].astype(np.uint64)
+
+    def set_entry(self, bucket_num, entry, fp):
+        start_pos = bucket_num * self.bucket_bits + entry * self.fp_size
+        self.filter[start_pos:start_pos + self.fp_size] = int2ba(int(fp), self.fp_size, endian='little')
+
     def insert(self, bucket_num, fp):
         if not self.isFull(bucket_num):
-
-            binary_str = bitBucketArray.get_binary_string(self.fp_size, fp)
-            
-            start_pos = (bucket_num * self.fp_size * self.num_entries) + (self.curr_entries_per_bucket[bucket_num] * self.fp_size)
-            end_pos = (bucket_num * self.fp_size * self.num_entries) + ((self.curr_entries_per_bucket[bucket_num]+1) * self.fp_size)
-
-            for pos in range(start_pos, end_pos): #Place fp in that bucket
-                if binary_str[pos - start_pos] == "1":
-                    self.filter[pos] = True
-                else:
-                    self.filter[pos] = False
-            
+            self.set_entry(bucket_num, self.curr_entries_per_bucket[bucket_num], fp)
             self.curr_entries_per_bucket[bucket_num] += 1
             return True
 
         return False
-    
+
     def insert_no_duplicates(self, bucket_num, fp):
         if not self.isFull(bucket_num):
 
             if self.contains(bucket_num, fp): #Checks for duplicates
                 return False
 
-            binary_str = bitBucketArray.get_binary_string(self.fp_size, fp)
-            
-            start_pos = (bucket_num * self.fp_size * self.num_entries) + (self.curr_entries_per_bucket[bucket_num] * self.fp_size)
-            end_pos = (bucket_num * self.fp_size * self.num_entries) + ((self.curr_entries_per_bucket[bucket_num]+1) * self.fp_size)
-
-            for pos in range(start_pos, end_pos): #Place fp in that bucket
-                if binary_str[pos - start_pos] == "1":
-                    self.filter[pos] = True
-                else:
-                    self.filter[pos] = False
-            
-            self.curr_entries_per_bucket[bucket_num] += 1
-            return True
+            return self.insert(bucket_num, fp)
+
+        return False
 
-        return False    
-    
     def remove(self, bucket_num, fp):
+        entry = self.get_inner_bucket_position(bucket_num, fp)
+        if entry is None:
+            return False
+
+        # Move the last entry into the freed slot so occupied entries stay packed
+        last = self.curr_entries_per_bucket[bucket_num] - 1
+        word = self.get_bucket_word(bucket_num)
+        last_fp = (word >> (last * self.fp_size)) & self.fp_mask
+        word &= ~(self.fp_mask << (entry * self.fp_size))
+        word |= last_fp << (entry * self.fp_size)
+        word &= ~(self.fp_mask << (last * self.fp_size))
+        self.set_bucket_word(bucket_num, word)
+
+        self.curr_entries_per_bucket[bucket_num] -= 1
+        return True
 
-        if self.contains(bucket_num, fp):
-            inner_bucket_pos = self.get_inner_bucket_position(bucket_num, fp)
-
-            #Zero out that fingerprint in bucket
-            start_pos = (bucket_num * self.fp_size * self.num_entries) + (inner_bucket_pos * self.fp_size)
-            end_pos = (bucket_num * self.fp_size * self.num_entries) + ((inner_bucket_pos+1) * self.fp_size)
-
-            for pos in range(start_pos, end_pos):
-                self.filter[pos] = False
-            
-            #Shift entries down if not the last one
-            if inner_bucket_pos < (self.curr_entries_per_bucket[bucket_num]-1):
-
-                start_pos = (bucket_num * self.fp_size * self.num_entries) + ((inner_bucket_pos+1) * self.fp_size)
-                end_pos = (bucket_num * self.fp_size * self.num_entries) + (self.curr_entries_per_bucket[bucket_num] * self.fp_size)
-
-                shift_str = ""
-                for pos in range(start_pos, end_pos): #Get the fingerprints that will be shifted
-                    if self.filter[pos]:
-                        shift_str += "1"
-                    else:
-                        shift_str += "0"
-
-                    self.filter[pos] = False
-            
-                #Now take shift_str and shift it down
-                start_pos = (bucket_num * self.fp_size * self.num_entries) + (inner_bucket_pos * self.fp_size)
-                end_pos = (bucket_num * self.fp_size * self.num_entries) + ((self.curr_entries_per_bucket[bucket_num]-1) * self.fp_size)
-
-                for pos in range(start_pos, end_pos):
-                    if shift_str[pos - start_pos] == "1":
-                        self.filter[pos] = True
-                    else:
-                        self.filter[pos - start_pos] = False
-            
-
-            self.curr_entries_per_bucket[bucket_num] -= 1
-            return True
-        
-        return False
-    
     def get_bucket_list(self, bucket_num):
-        
-        start_pos = (bucket_num * self.fp_size * self.num_entries) 
-        end_pos = (bucket_num * self.fp_size * self.num_entries) + (self.curr_entries_per_bucket[bucket_num] * self.fp_size)
-
-        bucket_list = []
-
-        bit_str = ""
-        for pos in range(start_pos, end_pos):
-            if self.filter[pos]: #Put together the fingerprint
-                bit_str += "1"
-            else:
-                bit_str += "0"
-            
-            if (pos+1) % self.fp_size == 0: #Check if fingerprint matches
-                bucket_list.append(bit_str)
-                bit_str = ""
-        
-        return bucket_list
+        word = self.get_bucket_word(bucket_num)
+        return [(word >> (j * self.fp_size)) & self.fp_mask for j in range(self.curr_entries_per_bucket[bucket_num])]
 
     def swap_with_random_entry(self, bucket_num, fp_to_insert):
-
-        bucket_list = self.get_bucket_list(bucket_num)
-        chosen_fp_str = random.choice(bucket_list)
-        chosen_fp_int = int(chosen_fp_str, 2)
-        
-        self.remove(bucket_num, chosen_fp_int)
-        self.insert(bucket_num, fp_to_insert)
-        
-        return chosen_fp_int
+        entry = random.randrange(self.curr_entries_per_bucket[bucket_num])
+        chosen_fp = (self.get_bucket_word(bucket_num) >> (entry * self.fp_size)) & self.fp_mask
+        self.set_entry(bucket_num, entry, fp_to_insert)
+        return chosen_fp
     
     def get_size(self):
         return (sys.getsizeof(self.num_buckets) +
@@ -246,7 +246,231 @@ class bitBucketArray:
                 sys.getsizeof(self.filter))
 
 
-    
+class numpyBucketArray:
 
+    def __init__(self, buckets, num_entries, fp_size, state=None):
+        """
+        Creates a bucket array stored as one 2-D NumPy table plus an occupancy array.
 
-    
+            buckets --> how many buckets are in this array
+            num_entries --> number of fingerprints in each bucket
+            fp_size --> size in bits of fingerprints
+            state --> tables saved by get_state to use instead of allocating empty ones
+            table --> (buckets x num_entries) unsigned array, occupied entries are packed at the front of each row
+            counts --> number of occupied entries of every bucket
+        """
+        self.num_buckets = buckets
+        self.fp_size = fp_size
+        self.num_entries = num_entries
+        if state is None:
+            self.table = np.zeros((buckets, num_entries), dtype=numpyBucketArray.get_fp_dtype(fp_size))
+            self.counts = np.zeros(buckets, dtype=np.uint8 if num_entries < 256 else np.uint16)
+        else:
+            self.set_state(state)
+
+    def get_state(self):
+        return {"table": self.table, "counts": self.counts}
+
+    def set_state(self, sections):
+        """
+        Takes over the tables saved by get_state, in place when they are memory-mapped
+        """
+        self.table = sections["table"]
+        self.counts = sections["counts"]
+
+    @staticmethod
+    def get_fp_dtype(fp_size):
+        for dtype in (np.uint8, np.uint16, np.uint32):
+            if fp_size <= np.iinfo(dtype).bits:
+                return dtype
+        return np.uint64
+
+    def isFull(self, bucket_num):
+        return self.counts[bucket_num] >= self.num_entries
+
+    def get_bucket_list(self, bucket_num):
+        return self.table[bucket_num, :self.counts[bucket_num]].tolist()
+
+    def contains(self, bucket_num, fp):
+        return fp in self.get_bucket_list(bucket_num)
+
+    def contains_many(self, bucket_nums, fps):
+        """
+        Tests fps[i] against bucket bucket_nums[i] for every i at once. Returns a boolean array.
+        """
+        rows = self.table[bucket_nums]
+        occupied = np.arange(self.num_entries) < self.counts[bucket_nums][:, None]
+        return ((rows == np.asarray(fps, dtype=rows.dtype)[:, None]) & occupied).any(axis=1)
+
+    def get_entries(self):
+        """
+        Returns every stored fingerprint and the bucket holding it, as two uint64 arrays
+        """
+        occupied = np.arange(self.num_entries) < self.counts[:, None]
+        return self.table[occupied].astype(np.uint64), np.nonzero(occupied)[0].astype(np.uint64)
+
+    def insert(self, bucket_num, fp):
+        count = self.counts[bucket_num]
+        if count < self.num_entries:
+            self.table[bucket_num, count] = fp
+            self.counts[bucket_num] = count + 1
+            return True
+        return False
+
+    def insert_no_duplicates(self, bucket_num, fp):
+        if self.contains(bucket_num, fp):
+            return False
+        return self.insert(bucket_num, fp)
+
+    def remove(self, bucket_num, fp):
+        entries = self.get_bucket_list(bucket_num)
+        if fp not in entries:
+            return False
+        # Move the last occupied entry into the freed slot to keep the row packed
+        last = len(entries) - 1
+        self.table[bucket_num, entries.index(fp)] = entries[last]
+        self.table[bucket_num, last] = 0
+        self.counts[bucket_num] = last
+        return True
+
+    def swap_with_random_entry(self, bucket_num, fp_to_insert):
+        entry = random.randrange(self.counts[bucket_num])
+        chosen_fp = int(self.table[bucket_num, entry])
+        self.table[bucket_num, entry] = fp_to_insert
+        return chosen_fp
+
+    def get_size(self):
+        return (sys.getsizeof(self.num_buckets) +
+                sys.getsizeof(self.fp_size) +
+                sys.getsizeof(self.num_entries) +
+                self.counts.nbytes +
+                self.table.nbytes)
+
+
+class semiSortedBucketArray(bitBucketArray):
+
+    PREFIX_BITS = 4
+    INDEX_BITS = 12
+    # Every non-decreasing sequence of four 4-bit prefixes: 3876 of them, so an index fits in 12 bits
+    prefix_combinations = list(combinations_with_replacement(range(1 << PREFIX_BITS), 4))
+    combination_index = {combination: i for i, combination in enumerate(prefix_combinations)}
+
+    def __init__(self, buckets, num_entries, fp_size, state=None):
+        """
+        Creates a bit-level bucket array with semi-sorting (Fan et al, 2014).
+
+            buckets --> how many buckets are in this array
+            num_entries --> number of fingerprints in each bucket, must be 4
+            fp_size --> size in bits of fingerprints, at least 4
+            state --> tables saved by get_state to use instead of allocating empty ones
+
+        Entries of a bucket are kept sorted, so the four 4-bit prefixes form a
+        non-decreasing sequence that is stored as a 12-bit index into
+        prefix_combinations, followed by the four (fp_size - 4)-bit suffixes.
+        That is 4 * fp_size - 4 bits per bucket, one bit per entry less than
+        bitBucketArray.
+        """
+        if num_entries != 4 or fp_size < self.PREFIX_BITS:
+            raise ValueError("Semi-sorting needs 4 entries per bucket and fingerprints of at least 4 bits")
+        self.num_buckets = buckets
+        self.fp_size = fp_size
+        self.num_entries = num_entries
+        self.suffix_bits = self.fp_size - self.PREFIX_BITS
+        self.suffix_mask = (1 << self.suffix_bits) - 1
+        self.bucket_bits = self.INDEX_BITS + self.num_entries * self.suffix_bits
+        if state is None:
+            self.curr_entries_per_bucket = [0 for i in range(self.num_buckets)]
+            self.filter = bitarray(self.bucket_bits * self.num_buckets, endian='little')
+            self.filter.setall(0)
+        else:
+            self.set_state(state)
+
+    def get_bucket_list(self, bucket_num):
+        word = self.get_bucket_word(bucket_num)
+        prefixes = self.prefix_combinations[word & ((1 << self.INDEX_BITS) - 1)]
+        word >>= self.INDEX_BITS
+        fps = []
+        for prefix in prefixes:
+            fps.append((prefix << self.suffix_bits) | (word & self.suffix_mask))
+            word >>= self.suffix_bits
+        # Empty slots are encoded as zero fingerprints, which sort to the front
+        return fps[self.num_entries - self.curr_entries_per_bucket[bucket_num]:]
+
+    def set_bucket_list(self, bucket_num, fps):
+        fps = sorted([0] * (self.num_entries - len(fps)) + [int(fp) for fp in fps])
+        word = 0
+        for fp in reversed(fps):
+            word = (word << self.suffix_bits) | (fp & self.suffix_mask)
+        prefixes = tuple(fp >> self.suffix_bits for fp in fps)
+        word = (word << self.INDEX_BITS) | self.combination_index[prefixes]
+        self.set_bucket_word(bucket_num, word)
+
+    def get_inner_bucket_position(self, bucket_num, fp):
+        fps = self.get_bucket_list(bucket_num)
+        if fp in fps:
+            return fps.index(fp)
+
+    def contains(self, bucket_num, fp):
+        count = self.curr_entries_per_bucket[bucket_num]
+        if count == 0:
+            return False
+        word = self.get_bucket_word(bucket_num)
+        prefixes = self.prefix_combinations[word & ((1 << self.INDEX_BITS) - 1)]
+        prefix = fp >> self.suffix_bits
+        # Only decode the suffixes of entries whose prefix matches
+        for entry in range(self.num_entries - count, self.num_entries):
+            if prefixes[entry] == prefix:
+                shift = self.INDEX_BITS + entry * self.suffix_bits
+                if (word >> shift) & self.suffix_mask == fp & self.suffix_mask:
+                    return True
+        return False
+
+    def contains_many(self, bucket_nums, fps):
+        """
+        Entries are not at fixed offsets here, so every bucket is decoded by contains
+        """
+        return np.fromiter((self.contains(bucket_num, fp) for bucket_num, fp in
+                            zip(np.asarray(bucket_nums).tolist(), np.asarray(fps).tolist())),
+                           dtype=bool, count=len(bucket_nums))
+
+    def get_entries(self):
+        return get_entries_from_lists(self)
+
+    def insert(self, bucket_num, fp):
+        if not self.isFull(bucket_num):
+            fps = self.get_bucket_list(bucket_num)
+            fps.append(fp)
+            self.set_bucket_list(bucket_num, fps)
+            self.curr_entries_per_bucket[bucket_num] += 1
+            return True
+        return False
+
+    def remove(self, bucket_num, fp):
+        fps = self.get_bucket_list(bucket_num)
+        if fp not in fps:
+            return False
+        fps.remove(fp)
+        self.set_bucket_list(bucket_num, fps)
+        self.curr_entries_per_bucket[bucket_num] -= 1
+        return True
+
+    def swap_with_random_entry(self, bucket_num, fp_to_insert):
+        fps = self.get_bucket_list(bucket_num)
+        entry = random.randrange(len(fps))
+        chosen_fp = fps[entry]
+        fps[entry] = fp_to_insert
+        self.set_bucket_list(bucket_num, fps)
+        return chosen_fp
+
+
+def get_entries_from_lists(bucket_array):
+    """
+    get_entries for bucket arrays that can only decode one bucket at a time
+    """
+    fingerprints, bucket_nums = [], []
+    for bucket_num in range(bucket_array.num_buckets):
+        if bucket_array.curr_entries_per_bucket[bucket_num]:
+            bucket = bucket_array.get_bucket_list(bucket_num)
+            fingerprints.extend(bucket)
+            bucket_nums.extend([bucket_num] * len(bucket))
+    return np.array(fingerprints, dtype=np.uint64), np.array(bucket_nums, dtype=np.uint64)
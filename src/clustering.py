@@ -0,0 +1,70 @@
+"""
+Description: Contains the bottom-up bulk construction shared by the sequence trees (build_bulk)
+
+All leaves are built first, possibly by several processes, then the two most similar
+nodes are repeatedly given a new parent holding the union of both, the parent taking
+their place among the candidates. The shape follows the similarity of the datasets,
+not their input order. A parent holds more k-mers than either child, so it is farther
+from the remaining nodes than they were, which keeps unrelated datasets from piling
+onto one long branch.
+"""
+import numpy as np
+from multiprocessing import Pool
+
+
+def build_leaf(args):
+    tree, dataset = args
+    node = tree.new_node()
+    node.populate_dataset_info(dataset)
+    return node
+
+
+def build_leaves(tree, datasets, workers=1):
+    """
+    Returns one populated leaf node of tree per dataset, in input order
+    """
+    tasks = [(tree, dataset) for dataset in datasets]
+    if workers <= 1 or len(tasks) <= 1:
+        return [build_leaf(task) for task in tasks]
+    with Pool(min(workers, len(tasks))) as pool:
+        return pool.map(build_leaf, tasks)
+
+
+def build_bottom_up(leaves, get_signature, distance, make_parent):
+    """
+    Joins the leaves into a binary tree by merging the two closest nodes, leaves or
+    parents built so far, until one is left. Returns the root, None without leaves.
+
+        get_signature --> maps a node to what distance compares, computed once per node
+        make_parent --> returns the new parent of two nodes
+    """
+    nodes = list(leaves)
+    if not nodes:
+        return None
+    signatures = [get_signature(node) for node in nodes]
+    distances = np.full((len(nodes), len(nodes)), np.inf)
+    for i in range(len(nodes)):
+        for j in range(i + 1, len(nodes)):
+            distances[i, j] = distances[j, i] = distance(signatures[i], signatures[j])
+
+    # The parent takes the slot of its first child, the slot of the second one is retired
+    merged = 0
+    while merged < len(nodes) - 1:
+        i, j = np.unravel_index(np.argmin(distances), distances.shape)
+        nodes[i] = make_parent(nodes[i], nodes[j])
+        signatures[i] = get_signature(nodes[i])
+        nodes[j] = signatures[j] = None
+        distances[j, :] = distances[:, j] = np.inf
+        for other in range(len(nodes)):
+            if other != i and nodes[other] is not None:
+                distances[i, other] = distances[other, i] = distance(signatures[i], signatures[other])
+        merged += 1
+    return next(node for node in nodes if node is not None)
+
+
+def count_key_difference(keys, other_keys):
+    """
+    Size of the symmetric difference of two sorted arrays of unique keys
+    """
+    common = len(np.intersect1d(keys, other_keys, assume_unique=True))
+    return len(keys) + len(other_keys) - 2 * common
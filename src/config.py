@@ -1,5 +1,6 @@
 class SketchConfig:
-    def __init__(self, b, f, s, i, k, stash, e, fp_prob, auto, t, bit=False) -> None:
+    def __init__(self, b, f, s, i, k, stash, e, fp_prob, auto, t, variant="list", canonical=False, hash_family="murmur",
+                 bfs_depth=0, workers=1, bulk=False) -> None:
         self.k = k
         self.num_buckets = b
         self.fp_size = f
@@ -10,4 +11,9 @@ class SketchConfig:
         self.fp_prob = fp_prob
         self.auto = auto
         self.theta = t
-        self.bitarray_variant = bit
\ No newline at end of file
+        self.variant = variant
+        self.canonical = canonical
+        self.hash_family = hash_family
+        self.bfs_depth = bfs_depth
+        self.workers = workers
+        self.bulk = bulk
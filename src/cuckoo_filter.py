@@ -2,16 +2,181 @@
 Description: Contains the implementation for a Cuckoo Filter with and without Stash
 """
 import bucket_classes
-import hashlib
+import hashing
+import serialization
 import sys
 import random
 import math
+import numpy as np
 from bitarray import bitarray
+from collections import Counter
+from kmers import KmerItems
 
 
-class CuckooFilter:
+class CuckooHashing:
+    """
+    Fingerprint and bucket index derivation shared by the cuckoo filter variants.
+    """
+
+    def init_hashing(self, num_buckets, fp_size, hash_family):
+        """
+            hash_family --> name of the hashing.HASH_FAMILIES entry used for items and fingerprints
+            alt_offset_table --> h(fp) mod num_buckets for every fingerprint, None when fp_size is too wide
+        """
+        self.hash_name = hash_family
+        self.hash_family = hashing.get_hash_family(hash_family)
+        self.fp_mask = (1 << fp_size) - 1
+        self.index_buckets = num_buckets
+        self.pow2_buckets = num_buckets & (num_buckets - 1) == 0
+        self.alt_offset_table = hashing.get_alt_offset_table(hash_family, fp_size, num_buckets)
+        self.alt_offsets = memoryview(self.alt_offset_table) if self.alt_offset_table is not None else None
+
+    def __getstate__(self):
+        # The hash family and offset table are shared, rebuild them instead of copying
+        state = self.__dict__.copy()
+        for name in ("hash_family", "alt_offset_table", "alt_offsets"):
+            state.pop(name, None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.init_hashing(self.index_buckets, self.fp_mask.bit_length(), self.hash_name)
+
+    def get_fp_and_index_positions(self, item):
+        """
+            Derives the fingerprint and both candidate buckets of an item from a
+            single hash evaluation.
+        """
+        hash_value = self.hash_family.hash_item(item)
+        fingerprint, index_one = self.hash_family.split(hash_value, self.fp_mask, self.index_buckets)
+        index_two = self.get_alt_index(index_one, fingerprint)
+        return [fingerprint, index_one, index_two]
+
+    def get_fp_and_index_arrays(self, items):
+        """
+            Vectorized get_fp_and_index_positions. Returns three uint64 arrays
+            holding the fingerprints and both candidate buckets of every item.
+        """
+        fingerprints, index_one = self.hash_family.split_array(items, self.fp_mask, self.index_buckets)
+        return fingerprints, index_one, self.get_alt_index_array(index_one, fingerprints)
+
+    def get_alt_index_array(self, indices, fingerprints):
+        if self.alt_offset_table is not None:
+            offsets = self.alt_offset_table[fingerprints.astype(np.intp)]
+        else:
+            offsets = self.hash_family.hash_fingerprints_mod(fingerprints, self.index_buckets)
+        if self.pow2_buckets:
+            return indices ^ offsets
+        return (offsets + np.uint64(self.index_buckets) - indices) % np.uint64(self.index_buckets)
+
+    def get_alt_index(self, index, fingerprint):
+        """
+            Uses the precomputed fingerprint-to-offset table when the fingerprint
+            is narrow enough, and hashes the fingerprint otherwise.
+        """
+        if self.alt_offsets is None:
+            return hashing.alt_index(index, self.hash_family.hash_fingerprint(fingerprint), self.index_buckets)
+        if self.pow2_buckets:
+            return index ^ self.alt_offsets[fingerprint]
+        return (self.alt_offsets[fingerprint] - index) % self.index_buckets
+
+
+class CuckooEviction:
+    """
+    Eviction bookkeeping and merging shared by the cuckoo filter variants. Subclasses
+    provide the bucket accessors get_bucket_entries, is_bucket_full, move_fingerprint,
+    insert_into_bucket and get_entries.
+    """
 
-    def __init__(self, num_buckets, fp_size, bucket_size, max_iter):
+    def init_eviction(self, bfs_depth):
+        """
+            bfs_depth --> maximum length of the eviction path searched breadth-first, 0 keeps the random walk
+            eviction_path_lengths --> Counter of successful inserts by number of fingerprints moved
+            failed_inserts --> number of inserts that found no free slot
+        """
+        self.bfs_depth = bfs_depth
+        self.eviction_path_lengths = Counter()
+        self.failed_inserts = 0
+
+    def record_insert(self, path_length):
+        self.num_items_in_filter += 1
+        self.eviction_path_lengths[path_length] += 1
+        return True
+
+    def record_failure(self):
+        self.failed_inserts += 1
+        return False
+
+    def merge(self, other):
+        """
+            Inserts every fingerprint stored in other, a filter with the same buckets,
+            fingerprint size and hash family, skipping those already here. Fingerprints
+            are moved as they are, without hashing the items again. Returns False when
+            an insert failed.
+        """
+        if (other.index_buckets, other.fp_mask, other.hash_name) != (self.index_buckets, self.fp_mask, self.hash_name):
+            raise ValueError("Only filters with the same buckets, fingerprint size and hash family can be merged")
+        fingerprints, index_one = other.get_entries()
+        index_two = self.get_alt_index_array(index_one, fingerprints)
+        merged = True
+        for fingerprint, i1, i2 in zip(fingerprints.tolist(), index_one.tolist(), index_two.tolist()):
+            if not self.contains_fingerprint(fingerprint, i1, i2):
+                merged = self.insert_fingerprint(fingerprint, i1, i2) and merged
+        return merged
+
+    def find_eviction_path(self, index_one, index_two):
+        """
+            Breadth-first search from both (full) candidate buckets for a bucket
+            with a free slot, at most bfs_depth moves away. Every bucket is visited
+            once and at most max_iter buckets are expanded. Returns the list of
+            (from_bucket, to_bucket, fingerprint) moves ordered from the free slot
+            back to a candidate bucket, or None if no path was found.
+        """
+        # Each node is (bucket, parent node, fingerprint moved from the parent, depth)
+        nodes = [(index_one, -1, None, 0), (index_two, -1, None, 0)]
+        visited = {index_one, index_two}
+        head = 0
+        while head < len(nodes) and head < self.max_iter:
+            bucket, _, _, depth = nodes[head]
+            if depth < self.bfs_depth:
+                for fingerprint in self.get_bucket_entries(bucket):
+                    alt_bucket = self.get_alt_index(bucket, fingerprint)
+                    if alt_bucket in visited:
+                        continue
+                    visited.add(alt_bucket)
+                    nodes.append((alt_bucket, head, fingerprint, depth + 1))
+                    if not self.is_bucket_full(alt_bucket):
+                        return self.trace_eviction_path(nodes, len(nodes) - 1)
+            head += 1
+        return None
+
+    @staticmethod
+    def trace_eviction_path(nodes, node):
+        path = []
+        bucket, parent, fingerprint, _ = nodes[node]
+        while parent != -1:
+            path.append((nodes[parent][0], bucket, fingerprint))
+            bucket, parent, fingerprint, _ = nodes[parent]
+        return path
+
+    def insert_along_eviction_path(self, fingerprint, index_one, index_two):
+        """
+            Moves the fingerprints along the shortest eviction path found, starting
+            at the free slot, then stores the new fingerprint in the candidate bucket
+            that was freed. Nothing is moved when no path exists.
+        """
+        path = self.find_eviction_path(index_one, index_two)
+        if path is None:
+            return self.record_failure()
+        for from_bucket, to_bucket, moved_fp in path:
+            self.move_fingerprint(from_bucket, to_bucket, moved_fp)
+        self.insert_into_bucket(path[-1][0], fingerprint)
+        return self.record_insert(len(path))
+
+
+class CuckooFilter(CuckooHashing, CuckooEviction, KmerItems, serialization.Serializable):
+
+    def __init__(self, num_buckets, fp_size, bucket_size, max_iter, hash_family=hashing.DEFAULT_HASH, bfs_depth=0):
         """
         Creates a standard Cuckoo Filter.
 
@@ -19,6 +184,8 @@ class CuckooFilter:
             fp_size --> the size of the fingerprint in bits that will stored in buckets
             bucket_size --> how many fingerprints can be stored in each bucket
             max_iter --> maximum number of displacements before giving up on that item
+            hash_family --> "murmur" (default) or "sha256" to reproduce the paper numbers
+            bfs_depth --> when above 0, inserts search breadth-first for an eviction path of at most this many moves
         """
         self.num_buckets = num_buckets
         self.fp_size = fp_size
@@ -27,13 +194,44 @@ class CuckooFilter:
         self.filter = [bucket_classes.Bucket(self.bucket_size) for i in range(num_buckets)]
         self.num_items_in_filter = 0
         self.total_capacity = self.bucket_size * self.num_buckets
+        self.init_hashing(num_buckets, fp_size, hash_family)
+        self.init_eviction(bfs_depth)
+
+    def get_state(self):
+        """
+        Returns the parameters and the buckets as a (num_buckets x bucket_size)
+        slot table plus per-bucket counts, see serialization.Serializable
+        """
+        params = {"num_buckets": self.num_buckets, "fp_size": self.fp_size, "bucket_size": self.bucket_size,
+                  "max_iter": self.max_iter, "hash_family": self.hash_name, "bfs_depth": self.bfs_depth,
+                  "num_items_in_filter": self.num_items_in_filter, **self.get_kmer_params()}
+        table = np.zeros((self.num_buckets, self.bucket_size), dtype=bucket_classes.numpyBucketArray.get_fp_dtype(self.fp_size))
+        counts = np.zeros(self.num_buckets, dtype=np.uint16)
+        for i, b in enumerate(self.filter):
+            counts[i] = len(b.bucket)
+            table[i, :len(b.bucket)] = b.bucket
+        return params, {"table": table, "counts": counts}
+
+    @classmethod
+    def from_params(cls, params):
+        return cls(params["num_buckets"], params["fp_size"], params["bucket_size"], params["max_iter"],
+                   hash_family=params["hash_family"], bfs_depth=params["bfs_depth"])
+
+    @classmethod
+    def from_state(cls, params, sections):
+        if not sections["table"].flags.writeable:
+            raise ValueError("{} keeps its buckets in Python lists and cannot be memory-mapped, "
+                             "save a CuckooFilterBit or CuckooFilterArray instead".format(cls.__name__))
+        cuckoo = cls.from_params(params)
+        for b, row, count in zip(cuckoo.filter, sections["table"].tolist(), sections["counts"].tolist()):
+            b.bucket = row[:count]
+        cuckoo.num_items_in_filter = params["num_items_in_filter"]
+        cuckoo.set_kmer_params(params)
+        return cuckoo
 
     @staticmethod
     def get_hash_value(item):
-        hash_sha256 = hashlib.sha256(str(item).encode('utf-8'))
-        hash_result = hash_sha256.digest()
-        hash_result_int = int.from_bytes(hash_result, byteorder='big')
-        return hash_result_int
+        return hashing.Sha256HashFamily.hash_item(item)
 
     @staticmethod
     def get_fingerprint(item, fp_size):
@@ -41,62 +239,65 @@ class CuckooFilter:
             Gets a fingerprint for item trying to be inserted by hashing
             and taking the fp.size least significant bits. Returns an integer.
         """
+        return CuckooFilter.get_hash_value(item) & ((1 << fp_size) - 1)
 
-        #Create a bit mask of self.fp_size bits
-        mask_bits_int = int(("1" * fp_size), 2)
-        mask_bytes = mask_bits_int.to_bytes((mask_bits_int.bit_length() // 8) + 1, byteorder='big')
-
-        #Get hash value for the item trying to be inserted
-        hash_result_int = CuckooFilter.get_hash_value(item)
+    def get_bucket_entries(self, index):
+        return self.filter[index].bucket
 
-        #Get fingerprint with bitwise-AND
-        fp = hash_result_int & mask_bits_int
-        return fp
-
-    def get_fp_and_index_positions(self, item):
-        fingerprint = CuckooFilter.get_fingerprint(item, self.fp_size)
+    def get_entries(self):
+        """
+            Returns every stored fingerprint and the bucket holding it, as two uint64 arrays
+        """
+        fingerprints = [fingerprint for b in self.filter for fingerprint in b.bucket]
+        indices = [index for index, b in enumerate(self.filter) for _ in b.bucket]
+        return np.array(fingerprints, dtype=np.uint64), np.array(indices, dtype=np.uint64)
 
-        hash_x = CuckooFilter.get_hash_value(item)
-        hash_fp = CuckooFilter.get_hash_value(fingerprint)
+    def is_bucket_full(self, index):
+        return self.filter[index].isFull()
 
-        index_one = hash_x % self.num_buckets
-        index_two = (index_one ^ hash_fp) % self.num_buckets
+    def move_fingerprint(self, from_index, to_index, fingerprint):
+        self.filter[from_index].remove(fingerprint)
+        self.filter[to_index].insert(fingerprint)
 
-        return [fingerprint, index_one, index_two]
+    def insert_into_bucket(self, index, fingerprint):
+        self.filter[index].insert(fingerprint)
 
     def insert(self, item):
         """
             Attempts to insert a new value and return True when it does
             and False when it cannot and that means the filter is full.
         """
-
         fingerprint, index_one, index_two = self.get_fp_and_index_positions(item)
+        return self.insert_fingerprint(fingerprint, index_one, index_two)
 
+    def insert_fingerprint(self, fingerprint, index_one, index_two):
+        """
+            Inserts an already hashed item, given its fingerprint and both buckets
+        """
         #Try to insert into one of those two buckets
         if not self.filter[index_one].isFull():
             self.filter[index_one].insert(fingerprint)
-            self.num_items_in_filter += 1
-            return True
+            return self.record_insert(0)
         elif not self.filter[index_two].isFull():
             self.filter[index_two].insert(fingerprint)
-            self.num_items_in_filter += 1
-            return True
+            return self.record_insert(0)
+
+        if self.bfs_depth > 0:
+            return self.insert_along_eviction_path(fingerprint, index_one, index_two)
 
         #Try to relocate some of the items in bucket
         index = random.choice([index_one, index_two])
         for n in range(0, self.max_iter):
             fingerprint = self.filter[index].swap_with_random_entry(fingerprint)
 
-            hash_fp = CuckooFilter.get_hash_value(fingerprint)
-            index = (index ^ hash_fp) % self.num_buckets
+            index = self.get_alt_index(index, fingerprint)
 
             if not self.filter[index].isFull():
                 self.filter[index].insert(fingerprint)
-                self.num_items_in_filter += 1
-                return True
+                return self.record_insert(n + 1)
 
         #We have failed to insert, filter is full
-        return False
+        return self.record_failure()
 
     def insert_no_duplicates(self, item):
         """
@@ -114,41 +315,51 @@ class CuckooFilter:
         if not self.filter[index_one].isFull():
             result = self.filter[index_one].insert_no_duplicates(fingerprint)
             if result:
-                self.num_items_in_filter += 1
-                return True
+                return self.record_insert(0)
             return False
         elif not self.filter[index_two].isFull():
             result = self.filter[index_two].insert_no_duplicates(fingerprint)
             if result:
-                self.num_items_in_filter += 1
-                return True
+                return self.record_insert(0)
             return False
 
+        if self.bfs_depth > 0:
+            return self.insert_along_eviction_path(fingerprint, index_one, index_two)
+
         #Try to relocate some of the items in bucket
         index = random.choice([index_one, index_two])
         for n in range(0, self.max_iter):
             fingerprint = self.filter[index].swap_with_random_entry(fingerprint)
 
-            hash_fp = CuckooFilter.get_hash_value(fingerprint)
-            index = (index ^ hash_fp) % self.num_buckets
+            index = self.get_alt_index(index, fingerprint)
 
             if not self.filter[index].isFull():
                 result = self.filter[index].insert_no_duplicates(fingerprint)
                 if result:
-                    self.num_items_in_filter += 1
-                    return True
+                    return self.record_insert(n + 1)
                 return False
 
         #We have failed to insert, filter is full
-        return False
+        return self.record_failure()
 
     def contains(self, item):
         fingerprint, index_one, index_two = self.get_fp_and_index_positions(item)
+        return self.contains_fingerprint(fingerprint, index_one, index_two)
 
+    def contains_fingerprint(self, fingerprint, index_one, index_two):
         if self.filter[index_one].contains(fingerprint) or self.filter[index_two].contains(fingerprint):
             return True
         return False
 
+    def contains_fingerprint_many(self, fingerprints, index_one, index_two):
+        """
+            contains_fingerprint over the arrays of get_fp_and_index_arrays. The buckets
+            are Python lists, so they are probed one by one. Returns a boolean array.
+        """
+        return np.fromiter((self.contains_fingerprint(fp, i1, i2) for fp, i1, i2 in
+                            zip(fingerprints.tolist(), index_one.tolist(), index_two.tolist())),
+                           dtype=bool, count=len(fingerprints))
+
     def delete(self, item):
         fingerprint, index_one, index_two = self.get_fp_and_index_positions(item)
 
@@ -179,34 +390,64 @@ class CuckooFilter:
 
 class CuckooFilterStash(CuckooFilter):
 
-    def __init__(self, num_buckets, fp_size, bucket_size, max_iter, stash_size):
+    def __init__(self, num_buckets, fp_size, bucket_size, max_iter, stash_size, hash_family=hashing.DEFAULT_HASH,
+                 bfs_depth=0):
         """
         Creates a Cuckoo Filter with Stash. 
             
             stash_size --> size of the stash list
         """
-        super().__init__(num_buckets, fp_size, bucket_size, max_iter)
+        super().__init__(num_buckets, fp_size, bucket_size, max_iter, hash_family, bfs_depth)
         self.stash_size = stash_size
         self.stash = bucket_classes.Bucket(self.stash_size)
         self.total_capacity += self.stash_size
     
+    def get_state(self):
+        params, sections = super().get_state()
+        params["stash_size"] = self.stash_size
+        sections["stash"] = np.array(self.stash.bucket, dtype=sections["table"].dtype)
+        return params, sections
+
+    @classmethod
+    def from_params(cls, params):
+        return cls(params["num_buckets"], params["fp_size"], params["bucket_size"], params["max_iter"],
+                   params["stash_size"], hash_family=params["hash_family"], bfs_depth=params["bfs_depth"])
+
+    @classmethod
+    def from_state(cls, params, sections):
+        cuckoo = super().from_state(params, sections)
+        cuckoo.stash.bucket = sections["stash"].tolist()
+        return cuckoo
+
     def insert(self, item):
         insert_result = super().insert(item)
         if not insert_result and not self.stash.isFull():
             self.num_items_in_filter += 1
-            return self.stash.insert(item)
+            return self.stash.insert(self.get_fp_and_index_positions(item)[0])
         return insert_result
 
     def insert_no_duplicates(self, item):
         insert_result = super().insert_no_duplicates(item)
         if not insert_result and not self.stash.isFull():
             self.num_items_in_filter += 1
-            return self.stash.insert_no_duplicates(item)
+            return self.stash.insert_no_duplicates(self.get_fp_and_index_positions(item)[0])
         return insert_result
 
-    def contains(self, item):
-        fingerprint, index_one, index_two = super().get_fp_and_index_positions(item)
-        return (super.contains(item) or self.stash.contains(fingerprint))
+    def contains_fingerprint(self, fingerprint, index_one, index_two):
+        return (super().contains_fingerprint(fingerprint, index_one, index_two) or self.stash.contains(fingerprint))
+
+    def merge(self, other):
+        """
+            Merges the buckets of other, then the fingerprints of its stash into this stash
+        """
+        merged = super().merge(other)
+        for fingerprint in getattr(other, "stash", bucket_classes.Bucket(0)).bucket:
+            if not self.stash.contains(fingerprint):
+                if not self.stash.insert(fingerprint):
+                    merged = False
+                    continue
+                self.num_items_in_filter += 1
+        return merged
     
     def delete(self, item):
         delete_result = super().delete(item)
@@ -236,62 +477,95 @@ class CuckooFilterStash(CuckooFilter):
             agg
         )
 
-class CuckooFilterBit:
+class CuckooFilterBit(CuckooHashing, CuckooEviction, KmerItems, serialization.Serializable):
 
-    def __init__(self, num_buckets, fp_size, bucket_size, max_iter):
+    bucket_array_class = bucket_classes.bitBucketArray
+
+    def __init__(self, num_buckets, fp_size, bucket_size, max_iter, hash_family=hashing.DEFAULT_HASH, bfs_depth=0,
+                 bucket_state=None):
         """
         Creates a Cuckoo Filter implemented with Python bitarrays.
 
             filter --> bitBucketArray object, basically a bitarray with insert, contains, remove ops for specific buckets
             max_iter --> maximum number of displacements before giving up on that item
+            hash_family --> "murmur" (default) or "sha256" to reproduce the paper numbers
+            bfs_depth --> when above 0, inserts search breadth-first for an eviction path of at most this many moves
+            bucket_state --> saved bucket tables to start from, see get_state
         """
-        self.filter = bucket_classes.bitBucketArray(num_buckets, bucket_size, fp_size)
+        self.filter = self.bucket_array_class(num_buckets, bucket_size, fp_size, bucket_state)
         self.max_iter = max_iter
         self.num_items_in_filter = 0
         self.num_buckets = num_buckets
         self.bucket_size = bucket_size
         self.total_capacity = bucket_size * num_buckets
+        self.init_hashing(num_buckets, fp_size, hash_family)
+        self.init_eviction(bfs_depth)
 
-    def get_fp_and_index_positions(self, item):
-        fingerprint = CuckooFilter.get_fingerprint(item, self.filter.fp_size)
+    def get_state(self):
+        """
+        Returns the parameters and the tables of the bucket array, see serialization.Serializable
+        """
+        params = {"num_buckets": self.num_buckets, "fp_size": self.filter.fp_size, "bucket_size": self.bucket_size,
+                  "max_iter": self.max_iter, "hash_family": self.hash_name, "bfs_depth": self.bfs_depth,
+                  "num_items_in_filter": self.num_items_in_filter, **self.get_kmer_params()}
+        return params, self.filter.get_state()
 
-        hash_x = CuckooFilter.get_hash_value(item)
-        hash_fp = CuckooFilter.get_hash_value(fingerprint)
+    @classmethod
+    def from_state(cls, params, sections):
+        cuckoo = cls(params["num_buckets"], params["fp_size"], params["bucket_size"], params["max_iter"],
+                     hash_family=params["hash_family"], bfs_depth=params["bfs_depth"], bucket_state=sections)
+        cuckoo.num_items_in_filter = params["num_items_in_filter"]
+        cuckoo.set_kmer_params(params)
+        return cuckoo
 
-        index_one = hash_x % self.filter.num_buckets
-        index_two = (index_one ^ hash_fp) % self.filter.num_buckets
+    def get_bucket_entries(self, index):
+        return self.filter.get_bucket_list(index)
 
-        return [fingerprint, index_one, index_two]
-    
-    def insert(self, item):
+    def get_entries(self):
+        return self.filter.get_entries()
+
+    def is_bucket_full(self, index):
+        return self.filter.isFull(index)
+
+    def move_fingerprint(self, from_index, to_index, fingerprint):
+        self.filter.remove(from_index, fingerprint)
+        self.filter.insert(to_index, fingerprint)
 
+    def insert_into_bucket(self, index, fingerprint):
+        self.filter.insert(index, fingerprint)
+
+    def insert(self, item):
         fingerprint, index_one, index_two = self.get_fp_and_index_positions(item)
+        return self.insert_fingerprint(fingerprint, index_one, index_two)
 
+    def insert_fingerprint(self, fingerprint, index_one, index_two):
+        """
+            Inserts an already hashed item, given its fingerprint and both buckets
+        """
         #Try to insert into one of those two buckets
         if not self.filter.isFull(index_one):
             self.filter.insert(index_one, fingerprint)
-            self.num_items_in_filter += 1
-            return True
+            return self.record_insert(0)
         elif not self.filter.isFull(index_two):
             self.filter.insert(index_two, fingerprint)
-            self.num_items_in_filter += 1
-            return True
+            return self.record_insert(0)
+
+        if self.bfs_depth > 0:
+            return self.insert_along_eviction_path(fingerprint, index_one, index_two)
 
         #Try to relocate some of the items in bucket
         index = random.choice([index_one, index_two])
         for n in range(0, self.max_iter):
             fingerprint = self.filter.swap_with_random_entry(index, fingerprint)
 
-            hash_fp = CuckooFilter.get_hash_value(fingerprint)
-            index = (index ^ hash_fp) % self.filter.num_buckets
+            index = self.get_alt_index(index, fingerprint)
 
             if not self.filter.isFull(index):
                 self.filter.insert(index, fingerprint)
-                self.num_items_in_filter += 1
-                return True
+                return self.record_insert(n + 1)
 
         #We have failed to insert, filter is full
-        return False
+        return self.record_failure()
 
     def insert_no_duplicates(self, item):
 
@@ -305,41 +579,59 @@ class CuckooFilterBit:
         if not self.filter.isFull(index_one):
             result = self.filter.insert_no_duplicates(index_one, fingerprint)
             if result:
-                self.num_items_in_filter += 1
-                return True
+                return self.record_insert(0)
             return False
         elif not self.filter.isFull(index_two):
             result = self.filter.insert_no_duplicates(index_two, fingerprint)
             if result:
-                self.num_items_in_filter += 1
-                return True
+                return self.record_insert(0)
             return False
 
+        if self.bfs_depth > 0:
+            return self.insert_along_eviction_path(fingerprint, index_one, index_two)
+
         #Try to relocate some of the items in bucket
         index = random.choice([index_one, index_two])
         for n in range(0, self.max_iter):
             fingerprint = self.filter.swap_with_random_entry(index, fingerprint)
 
-            hash_fp = CuckooFilter.get_hash_value(fingerprint)
-            index = (index ^ hash_fp) % self.filter.num_buckets
+            index = self.get_alt_index(index, fingerprint)
 
             if not self.filter.isFull(index):
                 result = self.filter.insert_no_duplicates(index, fingerprint)
                 if result:
-                    self.num_items_in_filter += 1
-                    return True
+                    return self.record_insert(n + 1)
                 return False
 
         #We have failed to insert, filter is full
-        return False   
+        return self.record_failure()
  
     def contains(self, item):
         fingerprint, index_one, index_two = self.get_fp_and_index_positions(item)
+        return self.contains_fingerprint(fingerprint, index_one, index_two)
 
+    def contains_fingerprint(self, fingerprint, index_one, index_two):
         if self.filter.contains(index_one, fingerprint) or self.filter.contains(index_two, fingerprint):
             return True
         return False
 
+    def contains_many(self, items):
+        """
+            Queries a batch of items, hashing them in one vectorized pass.
+            Returns a boolean array, True where the item probably is in the filter.
+        """
+        if len(items) == 0:
+            return np.zeros(0, dtype=bool)
+        return self.contains_fingerprint_many(*self.get_fp_and_index_arrays(items))
+
+    def contains_fingerprint_many(self, fingerprints, index_one, index_two):
+        """
+            Tests the arrays of get_fp_and_index_arrays against the bucket array in bulk.
+            Returns a boolean array.
+        """
+        return (self.filter.contains_many(index_one.astype(np.intp), fingerprints) |
+                self.filter.contains_many(index_two.astype(np.intp), fingerprints))
+
     def delete(self, item):
         fingerprint, index_one, index_two = self.get_fp_and_index_positions(item)
 
@@ -359,7 +651,132 @@ class CuckooFilterBit:
                 sys.getsizeof(self.num_items_in_filter) + 
                 sys.getsizeof(self.total_capacity) +
                 self.filter.get_size())
-    
+
+
+class CuckooFilterArray(CuckooFilterBit):
+    """
+    Cuckoo Filter whose buckets are rows of a single NumPy table.
+
+        filter --> numpyBucketArray object, a 2-D fingerprint table plus an occupancy array
+    """
+
+    bucket_array_class = bucket_classes.numpyBucketArray
+
+
+class CuckooFilterSemiSorted(CuckooFilterBit):
+    """
+    Bit-level Cuckoo Filter with semi-sorted buckets, saving one bit per entry.
+    Needs a bucket size of 4 and fingerprints of at least 4 bits.
+
+        filter --> semiSortedBucketArray object
+    """
+
+    bucket_array_class = bucket_classes.semiSortedBucketArray
+
+
+class ShardedCuckooFilter(KmerItems, serialization.Serializable):
+
+    def __init__(self, num_shards, num_buckets, fp_size, bucket_size, max_iter, hash_family=hashing.DEFAULT_HASH,
+                 bfs_depth=0, shard_class=CuckooFilterBit, shards=None):
+        """
+        Creates a Cuckoo Filter split into num_shards independent filters. An item
+        belongs to the shard picked by a prefix of its hash and both of its buckets
+        lie inside that shard, so each shard can be filled by a different process.
+
+            num_buckets --> total number of buckets, split evenly between the shards
+            shard_class --> cuckoo filter class of every shard, CuckooFilterBit by default
+            shards --> already filled shards to use instead of empty ones
+        """
+        self.num_shards = num_shards
+        self.shard_class = shard_class
+        self.shard_buckets = math.ceil(num_buckets / num_shards)
+        self.num_buckets = self.shard_buckets * num_shards
+        self.fp_size = fp_size
+        self.bucket_size = bucket_size
+        self.max_iter = max_iter
+        self.bfs_depth = bfs_depth
+        self.hash_name = hash_family
+        self.hash_family = hashing.get_hash_family(hash_family)
+        self.fp_mask = (1 << fp_size) - 1
+        if shards is None:
+            shards = [self.new_shard() for i in range(num_shards)]
+        self.shards = shards
+        self.total_capacity = self.bucket_size * self.num_buckets
+
+    def new_shard(self):
+        return self.shard_class(self.shard_buckets, self.fp_size, self.bucket_size, self.max_iter, self.hash_name,
+                                self.bfs_depth)
+
+    @property
+    def num_items_in_filter(self):
+        return sum(shard.num_items_in_filter for shard in self.shards)
+
+    @property
+    def eviction_path_lengths(self):
+        return sum((shard.eviction_path_lengths for shard in self.shards), Counter())
+
+    @property
+    def failed_inserts(self):
+        return sum(shard.failed_inserts for shard in self.shards)
+
+    def get_shard_and_positions(self, item):
+        """
+            Returns the shard of an item, its fingerprint and both of its buckets in that shard
+        """
+        hash_value = self.hash_family.hash_item(item)
+        shard = self.shards[self.hash_family.shard(hash_value, self.num_shards)]
+        fingerprint, index_one = self.hash_family.split(hash_value, self.fp_mask, self.shard_buckets)
+        return shard, fingerprint, index_one, shard.get_alt_index(index_one, fingerprint)
+
+    def insert(self, item):
+        shard, fingerprint, index_one, index_two = self.get_shard_and_positions(item)
+        return shard.insert_fingerprint(fingerprint, index_one, index_two)
+
+    def insert_no_duplicates(self, item):
+        shard, fingerprint, index_one, index_two = self.get_shard_and_positions(item)
+        if shard.contains_fingerprint(fingerprint, index_one, index_two):
+            return False
+        return shard.insert_fingerprint(fingerprint, index_one, index_two)
+
+    def contains(self, item):
+        shard, fingerprint, index_one, index_two = self.get_shard_and_positions(item)
+        return shard.contains_fingerprint(fingerprint, index_one, index_two)
+
+    def delete(self, item):
+        return self.get_shard_and_positions(item)[0].delete(item)
+
+    def get_state(self):
+        """
+        Returns the parameters of every shard, with the shard sections prefixed by "shard<index>."
+        """
+        params = {"num_shards": self.num_shards, "num_buckets": self.num_buckets, "fp_size": self.fp_size,
+                  "bucket_size": self.bucket_size, "max_iter": self.max_iter, "hash_family": self.hash_name,
+                  "bfs_depth": self.bfs_depth, "shard_class": self.shard_class.__name__, "shards": [],
+                  **self.get_kmer_params()}
+        sections = {}
+        for i, shard in enumerate(self.shards):
+            shard_params, shard_sections = shard.get_state()
+            params["shards"].append(shard_params)
+            sections.update(serialization.prefix_sections("shard{}.".format(i), shard_sections))
+        return params, sections
+
+    @classmethod
+    def from_state(cls, params, sections):
+        shard_class = serialization.SKETCH_TYPES[params["shard_class"]]
+        groups = serialization.group_sections(sections)
+        shards = [shard_class.from_state(shard_params, groups.get("shard{}".format(i), {}))
+                  for i, shard_params in enumerate(params["shards"])]
+        sharded = cls(params["num_shards"], params["num_buckets"], params["fp_size"], params["bucket_size"],
+                      params["max_iter"], params["hash_family"], params["bfs_depth"], shard_class, shards)
+        sharded.set_kmer_params(params)
+        return sharded
+
+    def get_size(self):
+        """
+        Returns the total number of bytes occupied by the shards
+        """
+        return sys.getsizeof(self.shards) + sum(shard.get_size() for shard in self.shards)
+
 
 """
 The following methods are helper methods that allow you get cuckoo
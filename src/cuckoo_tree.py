@@ -2,13 +2,19 @@ from typing import List, Optional, Deque
 from cuckoo_filter import CuckooFilter
 from collections import deque
 from read import Read
-from copy import deepcopy
+from fastq import dataset_name
+from kmers import kmerizer
+import hashing
+import clustering
+import numpy as np
+import serialization
 import sys
 
 
-class CuckooTree:
+class CuckooTree(serialization.Serializable):
 
-    def __init__(self, theta, k, num_buckets, fp_size, bucket_size, max_iter):
+    def __init__(self, theta, k, num_buckets, fp_size, bucket_size, max_iter, packed=False, canonical=False,
+                 hash_family=hashing.DEFAULT_HASH):
         """
         Wrapper around the Node structure of tree for inserting, querying
         :param theta: Parameter to determine strictness of querying
@@ -17,14 +23,21 @@ class CuckooTree:
         :param fp_size: Parameter for CuckooFilter
         :param bucket_size: Parameter for CuckooFilter
         :param max_iter: Parameter for CuckooFilter
+        :param packed: Use 2-bit packed integer k-mers instead of string slices
+        :param canonical: Treat a k-mer and its reverse complement as the same item
+        :param hash_family: Hash family of the node filters, see hashing.HASH_FAMILIES
         """
         self.root: Optional[Node] = None
         self.theta: float = theta
         self.k: int = k
+        self.packed = packed
+        self.canonical = canonical
+        self.kmerize = kmerizer(k, packed, canonical)
         self.num_buckets = num_buckets
         self.fp_size = fp_size
         self.bucket_size = bucket_size
         self.max_iter = max_iter
+        self.hash_family = hash_family
         self.aggregate_size = self.get_insternal_size()
 
     def insert(self, dataset: List[Read]) -> bool:
@@ -33,8 +46,8 @@ class CuckooTree:
         :param dataset: the dataset reads
         :return: None
         """
-        node_to_insert = Node(self.k, self.num_buckets, self.fp_size, self.bucket_size, self.max_iter)
-        node_to_insert.populate_dataset_info(dataset)
+        node_to_insert = self.new_node()
+        dataset_hashes = node_to_insert.populate_dataset_info(dataset)
         self.aggregate_size += node_to_insert.get_size()
 
         if self.root is None:
@@ -50,13 +63,13 @@ class CuckooTree:
                 create a new parent that contains node_to_insert
                 and current as children
                 """
-                new_parent = Node(self.k, self.num_buckets, self.fp_size, self.bucket_size, self.max_iter)
+                new_parent = self.new_node()
                 self.aggregate_size += new_parent.get_size()
                 new_parent.parent = parent
 
                 # Kmers from existing and new leaf
-                new_parent.filter = deepcopy(current.filter)
-                new_parent.insert_kmers_from_dataset(dataset)
+                new_parent.filter = current.filter.clone()
+                new_parent.add_node_kmers(node_to_insert)
 
                 # Set appropriate parent/child pointers
                 current.parent = new_parent
@@ -76,18 +89,18 @@ class CuckooTree:
                 return True
             elif current.num_children() == 1:
                 # insert kmers
-                current.insert_kmers_from_dataset(dataset)
+                current.add_node_kmers(node_to_insert)
 
                 # we found an empty slot to insert into
                 current.children.append(node_to_insert)
                 return True
             elif current.num_children() == 2:
                 # insert kmers
-                current.insert_kmers_from_dataset(dataset)
+                current.add_node_kmers(node_to_insert)
 
-                # select "best" child
-                score_0 = current.children[0].score(dataset)
-                score_1 = current.children[1].score(dataset)
+                # select "best" child, the dataset was hashed once by populate_dataset_info
+                score_0 = current.children[0].score(dataset_hashes)
+                score_1 = current.children[1].score(dataset_hashes)
                 best_child = 0 if score_0 < score_1 else 1
 
                 # recur
@@ -96,6 +109,40 @@ class CuckooTree:
 
         raise Exception("Did not insert successfully!")
 
+    def build_bulk(self, datasets: List[List[Read]], workers: int = 1) -> None:
+        """
+        Builds the tree from a known batch of datasets at once instead of inserting them
+        one by one: the leaves are built first, then the most similar nodes (fewest
+        fingerprints not shared) are joined bottom-up, see clustering.build_bottom_up.
+        :param datasets: The reads of every dataset
+        :param workers: Number of processes building the leaves
+        :return: None
+        """
+        if self.root is not None:
+            raise ValueError("build_bulk builds a whole tree, this one already holds datasets")
+        leaves = clustering.build_leaves(self, datasets, workers)
+        for leaf in leaves:
+            self.aggregate_size += leaf.get_size()
+        self.root = clustering.build_bottom_up(leaves, Node.get_entry_keys, clustering.count_key_difference,
+                                               self.make_parent)
+
+    def new_node(self, node_filter=None) -> 'Node':
+        return Node(self.k, self.num_buckets, self.fp_size, self.bucket_size, self.max_iter, self.packed, self.canonical,
+                    self.hash_family, node_filter)
+
+    def make_parent(self, left: 'Node', right: 'Node') -> 'Node':
+        """
+        Returns a new internal node over left and right, holding the k-mers of both
+        """
+        parent = self.new_node()
+        self.aggregate_size += parent.get_size()
+        parent.filter = left.filter.clone()
+        parent.add_node_kmers(right)
+        for child in (left, right):
+            child.parent = parent
+            parent.children.append(child)
+        return parent
+
     def query(self, query: str) -> List[str]:
         """
         Perform a DFS of the tree and collects reads that
@@ -103,31 +150,61 @@ class CuckooTree:
         :param query: The query string to be broken into kmers
         :return: The list of read_ids that "match"
         """
-        nodes_to_explore: Deque[Node] = deque()
-        nodes_to_explore.append(self.root)
+        kmers = list(self.kmerize(query))
+        kmers_needed = self.theta * len(kmers)
+
+        # Each node comes with the k-mers its parent may hold: a k-mer missing
+        # from the parent's union filter cannot be in any of its children
+        nodes_to_explore: Deque = deque()
+        nodes_to_explore.append((self.root, list(range(len(kmers)))))
 
         out: List[str] = []
         while nodes_to_explore:
-            current = nodes_to_explore.popleft()
-            total_kmers_found = 0
-            total_kmers = 0
-            for kmer in kmers_in_string(query, self.k):
-                if current.filter.contains(kmer):
-                    total_kmers_found += 1
-                total_kmers += 1
-            if total_kmers_found >= self.theta * total_kmers:
+            current, alive = nodes_to_explore.popleft()
+            present, passed = current.find_present_kmers(kmers, alive, kmers_needed)
+            if passed:
                 for child in current.children:
-                    nodes_to_explore.append(child)
+                    nodes_to_explore.append((child, present))
                 if current.num_children() == 0:
                     out.append(current.dataset_id)
         return out
 
+    def query_many(self, queries: List[str]) -> List[List[str]]:
+        """
+        Batch counterpart of query, for a uniform API with the other trees. Buckets of
+        CuckooFilter are Python lists that cannot be probed in bulk, so each query
+        walks the tree on its own, keeping the early stopping of query.
+        :param queries: The query strings to be broken into kmers
+        :return: For every query, the list of read_ids that "match"
+        """
+        return [self.query(query) for query in queries]
+
     def contains(self, query):
         """
         A wrapper for backward comptibility with other data structure implementations
         """
         return self.query(query)
     
+    def get_state(self):
+        """
+        Returns the tree parameters, the topology and every node filter, see serialization.tree_state
+        """
+        params = {"theta": self.theta, "k": self.k, "packed": self.packed, "canonical": self.canonical,
+                  "num_buckets": self.num_buckets, "fp_size": self.fp_size, "bucket_size": self.bucket_size,
+                  "max_iter": self.max_iter, "hash_family": self.hash_family, "aggregate_size": self.aggregate_size}
+        return serialization.tree_state(self.root, params)
+
+    @classmethod
+    def from_state(cls, params, sections):
+        tree = cls(params["theta"], params["k"], params["num_buckets"], params["fp_size"], params["bucket_size"],
+                   params["max_iter"], params["packed"], params["canonical"], params["hash_family"])
+        tree.aggregate_size = params["aggregate_size"]
+        tree.root = serialization.tree_root_from_state(params, sections, tree.load_node)
+        return tree
+
+    def load_node(self, node_params, node_sections):
+        return self.new_node(CuckooFilter.from_state(node_params["filter"], node_sections))
+
     def get_insternal_size(self):
         """
         Returns the total number of bytes occupied by the filter object
@@ -144,41 +221,96 @@ class CuckooTree:
 
 class Node:
 
-    def __init__(self, k, num_buckets, fp_size, bucket_size, max_iter):
+    def __init__(self, k, num_buckets, fp_size, bucket_size, max_iter, packed=False, canonical=False,
+                 hash_family=hashing.DEFAULT_HASH, node_filter=None):
         """
         Represents a single node of Cuckoo Tree.
-
+        :param node_filter: Existing filter to wrap (e.g. loaded from disk) instead of a new empty one
         """
         self.children: List[Node] = []
         self.parent: Optional[Node] = None
-        self.filter = CuckooFilter(num_buckets, fp_size, bucket_size, max_iter)
+        if node_filter is None:
+            node_filter = CuckooFilter(num_buckets, fp_size, bucket_size, max_iter, hash_family)
+        self.filter = node_filter
 
         self.dataset_id: Optional[str] = None
         self.k = k
+        self.kmerize = kmerizer(k, packed, canonical)
 
-    def populate_dataset_info(self, dataset: List[Read]) -> None:
-        self.dataset_id = dataset[0].filename
-        self.insert_kmers_from_dataset(dataset)
+    def populate_dataset_info(self, dataset: List[Read]):
+        """
+        Names the node after the dataset and inserts its k-mers
+        :param dataset: the dataset reads
+        :return: The hashed k-mers of the dataset, see hash_dataset
+        """
+        self.dataset_id = dataset_name(dataset)
+        dataset_hashes = self.hash_dataset(dataset)
+        self.insert_dataset_hashes(dataset_hashes)
+        return dataset_hashes
+
+    def hash_dataset(self, dataset: List[Read]):
+        """
+        K-merizes and hashes a dataset in one pass. All node filters of a tree share
+        their buckets, fingerprint size and hash family, so the result is valid for every node.
+        :param dataset: the dataset reads
+        :return: The fingerprint, first bucket and second bucket arrays of every k-mer occurrence
+        """
+        kmers = [kmer for read in dataset for kmer in self.kmerize(read.line)]
+        return self.filter.get_fp_and_index_arrays(kmers)
+
+    def insert_dataset_hashes(self, dataset_hashes) -> None:
+        fingerprints, index_one, index_two = dataset_hashes
+        for fingerprint, i1, i2 in zip(fingerprints.tolist(), index_one.tolist(), index_two.tolist()):
+            if not self.filter.contains_fingerprint(fingerprint, i1, i2):
+                self.filter.insert_fingerprint(fingerprint, i1, i2)
 
     def insert_kmers_from_dataset(self, dataset: List[Read]) -> None:
-        for read in dataset:
-            for kmer in read.kmers(self.k):
-                self.filter.insert_no_duplicates(kmer)
+        self.insert_dataset_hashes(self.hash_dataset(dataset))
+
+    def find_present_kmers(self, kmers, alive, kmers_needed):
+        """
+        Probes the filter for the alive k-mers until kmers_needed is met or out of reach
+        :param kmers: The k-mers of the query
+        :param alive: Indices of the k-mers that may be present in this node
+        :param kmers_needed: Number of present k-mers for this node to pass
+        :return: The indices that may be present in the children (k-mers left unprobed stay in) and whether the node passed
+        """
+        node_filter = serialization.resolve_filter(self.filter)
+        present = []
+        for probed, kmer_index in enumerate(alive):
+            if len(present) >= kmers_needed:
+                return present + alive[probed:], True
+            if len(present) + len(alive) - probed < kmers_needed:
+                return present, False
+            if node_filter.contains(kmers[kmer_index]):
+                present.append(kmer_index)
+        return present, len(present) >= kmers_needed
+
+    def add_node_kmers(self, other: 'Node') -> None:
+        """
+        Adds the k-mers of another node by merging its fingerprints, without k-merizing its reads again
+        """
+        self.filter.merge(other.filter)
+
+    def get_entry_keys(self):
+        """
+        Returns the stored fingerprints as sorted unique keys that compare equal across nodes.
+        A fingerprint may sit in either of its two buckets, so the key takes the lower one.
+        """
+        fingerprints, index_one = self.filter.get_entries()
+        buckets = np.minimum(index_one, self.filter.get_alt_index_array(index_one, fingerprints))
+        return np.unique((buckets << np.uint64(self.filter.fp_mask.bit_length())) | fingerprints)
 
     def num_children(self) -> int:
         return len(self.children)
 
-    def score(self, dataset: List[Read]) -> int:
+    def score(self, dataset_hashes) -> int:
         """
         "Hamming distance" score where lower is better
-        :param dataset: The dataset to compare against
+        :param dataset_hashes: The hashed k-mers of the dataset to compare against, see hash_dataset
         :return:
         """
-        kmers_in_common = 0
-        for read in dataset:
-            for kmer in read.kmers(self.k):
-                if self.filter.contains(kmer):
-                    kmers_in_common += 1
+        kmers_in_common = int(np.count_nonzero(self.filter.contains_fingerprint_many(*dataset_hashes)))
         return self.filter.num_items_in_filter - kmers_in_common
 
     def get_size(self):
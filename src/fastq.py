@@ -0,0 +1,174 @@
+"""
+Description: Contains the streaming FASTQ parser used to feed reads into the sketches
+"""
+import os
+from itertools import islice
+from read import Read, ReadBatch
+
+DEFAULT_BUFFER_SIZE = 1 << 20
+
+
+def stream_reads(filename, buffer_size=DEFAULT_BUFFER_SIZE):
+    """
+    Lazily yields the records of a FASTQ file as Read objects, one at a time.
+
+        filename --> path of the FASTQ file
+        buffer_size --> size in bytes of the read buffer used for the file
+    """
+    line_ptr = 0
+    with open(filename, "r", buffering=buffer_size) as f:
+        while True:
+            read_id = f.readline()[1:-1]
+            if read_id == "":
+                break
+            read_line = f.readline().strip()
+            f.readline()
+            read_quality = f.readline().strip()
+            yield Read(filename, read_id, line_ptr, read_line, read_quality)
+            line_ptr += 1
+
+
+def stream_sequences(filenames, buffer_size=DEFAULT_BUFFER_SIZE, limit=None):
+    """
+    Lazily yields only the sequence line of every record in the given FASTQ files.
+    This skips building Read objects for callers that never look at ids or qualities.
+
+        filenames --> a single path or a list of paths, read in order
+        limit --> stop after this many records per file (None reads everything)
+    """
+    if isinstance(filenames, str):
+        filenames = [filenames]
+    for filename in filenames:
+        with open(filename, "r", buffering=buffer_size) as f:
+            # Every record is four lines, the sequence is the second one
+            sequences = islice(f, 1, None, 4)
+            if limit is not None:
+                sequences = islice(sequences, limit)
+            for read_line in sequences:
+                yield read_line.strip()
+
+
+def find_record_start(f, offset):
+    """
+    Moves the binary file f to the first record that starts at or after the byte
+    offset and returns its position. A record starts on a header line ('@' or '>')
+    whose third line starts with '+'; a quality line may also start with '@', but
+    two lines below it there is a sequence, never a '+'.
+    """
+    if offset <= 0:
+        f.seek(0)
+        return 0
+    f.seek(offset - 1)
+    f.readline()
+    while True:
+        position = f.tell()
+        header = f.readline()
+        f.readline()
+        separator = f.readline()
+        if header == b"" or (header[:1] in (b"@", b">") and separator[:1] == b"+"):
+            f.seek(position)
+            return position
+        f.seek(position)
+        f.readline()
+
+
+def stream_sequence_range(filename, start, end, buffer_size=DEFAULT_BUFFER_SIZE):
+    """
+    Lazily yields the sequences of the records whose header starts in the byte
+    range [start, end) of a FASTQ file. Consecutive ranges cover every record
+    exactly once, so a file can be split between several processes.
+    """
+    with open(filename, "rb", buffering=buffer_size) as f:
+        position = find_record_start(f, start)
+        while position < end:
+            header = f.readline()
+            if header == b"":
+                break
+            read_line = f.readline()
+            f.readline()
+            f.readline()
+            position = f.tell()
+            yield read_line.strip().decode("ascii")
+
+
+def split_byte_ranges(filename, num_ranges):
+    """
+    Splits a file into num_ranges contiguous (start, end) byte ranges of about the same size
+    """
+    size = os.path.getsize(filename)
+    bounds = [size * i // num_ranges for i in range(num_ranges + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def stream_read_batches(filename, batch_size=4096, keep_ids=False, keep_quality=False,
+                        buffer_size=DEFAULT_BUFFER_SIZE):
+    """
+    Lazily yields the records of a FASTQ file packed into ReadBatch chunks.
+
+        batch_size --> maximum number of reads per batch, None for a single batch
+        keep_ids, keep_quality --> whether the optional columns are stored
+    """
+    batch = ReadBatch(filename, keep_ids, keep_quality)
+    with open(filename, "r", buffering=buffer_size) as f:
+        while True:
+            read_id = f.readline()[1:-1]
+            if read_id == "":
+                break
+            read_line = f.readline().strip()
+            f.readline()
+            read_quality = f.readline().strip()
+            batch.append(read_line, read_id, read_quality)
+            if batch_size is not None and len(batch) >= batch_size:
+                yield batch
+                batch = ReadBatch(filename, keep_ids, keep_quality)
+    if len(batch) > 0:
+        yield batch
+
+
+def load_read_batch(filename, keep_ids=False, keep_quality=False, buffer_size=DEFAULT_BUFFER_SIZE):
+    """
+    Reads a whole FASTQ file into one compact ReadBatch
+    """
+    for batch in stream_read_batches(filename, None, keep_ids, keep_quality, buffer_size):
+        return batch
+    return ReadBatch(filename, keep_ids, keep_quality)
+
+
+class FastqDataset:
+
+    def __init__(self, filename, buffer_size=DEFAULT_BUFFER_SIZE):
+        """
+        A re-iterable view over a FASTQ file. Every iteration streams the
+        file again from disk, so the tree builders can make several passes
+        over one dataset without keeping its reads in memory.
+
+            filename --> path of the FASTQ file
+            num_reads --> number of records seen by the last complete pass
+        """
+        self.filename = filename
+        self.buffer_size = buffer_size
+        self.num_reads = 0
+
+    def __iter__(self):
+        count = 0
+        for read in stream_reads(self.filename, self.buffer_size):
+            count += 1
+            yield read
+        self.num_reads = count
+
+    def __len__(self):
+        if self.num_reads == 0:
+            for _ in self:
+                pass
+        return self.num_reads
+
+
+def dataset_name(dataset):
+    """
+    Returns the filename identifying a dataset, which is either a FastqDataset
+    or any iterable of Read objects coming from the same file.
+    """
+    name = getattr(dataset, "filename", None)
+    if name is None:
+        name = next(iter(dataset)).filename
+    return name
@@ -0,0 +1,200 @@
+"""
+Description: Contains the hash functions shared by the sketches, with scalar and NumPy forms
+"""
+import hashlib
+import mmh3
+import numpy as np
+from functools import lru_cache
+
+MASK64 = (1 << 64) - 1
+SECOND_SEED = 0x9E3779B97F4A7C15
+ALT_TABLE_MAX_FP_SIZE = 20
+
+
+def mix64(x):
+    """
+    SplitMix64 finalizer, a cheap bijective mixer for 64-bit integers
+    """
+    x = ((x ^ (x >> 30)) * 0xBF58476D1CE4E5B9) & MASK64
+    x = ((x ^ (x >> 27)) * 0x94D049BB133111EB) & MASK64
+    return x ^ (x >> 31)
+
+
+def mix64_array(x):
+    """
+    NumPy form of mix64, element-wise over a uint64 array
+    """
+    x = np.asarray(x, dtype=np.uint64)
+    with np.errstate(over="ignore"):
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return x ^ (x >> np.uint64(31))
+
+
+def int_to_bytes(item):
+    return item.to_bytes((item.bit_length() + 7) // 8 or 1, byteorder="little")
+
+
+def hash_pair(item):
+    """
+    Returns two independent 64-bit hashes of an item. Packed k-mers that fit
+    in 64 bits go through mix64, so the same values can be computed in bulk
+    by hash_pair_array; strings, bytes and wider integers go through MurmurHash3.
+    """
+    if isinstance(item, (int, np.integer)):
+        item = int(item)
+        if item <= MASK64:
+            return mix64(item), mix64(item ^ SECOND_SEED)
+        item = int_to_bytes(item)
+    return mmh3.hash64(item, 0, signed=False)
+
+
+def hash_pair_array(items):
+    """
+    Vectorized hash_pair. Returns two uint64 arrays, one entry per item.
+    """
+    if isinstance(items, np.ndarray) and items.dtype != object:
+        words = items.astype(np.uint64, copy=False)
+    elif len(items) > 0 and all(isinstance(x, (int, np.integer)) and 0 <= x <= MASK64 for x in items):
+        words = np.array(items, dtype=np.uint64)
+    else:
+        pairs = [hash_pair(x) for x in items]
+        h1 = np.fromiter((p[0] for p in pairs), dtype=np.uint64, count=len(pairs))
+        h2 = np.fromiter((p[1] for p in pairs), dtype=np.uint64, count=len(pairs))
+        return h1, h2
+    return mix64_array(words), mix64_array(words ^ np.uint64(SECOND_SEED))
+
+
+class MurmurHashFamily:
+    """
+    Non-cryptographic 128-bit hash family: MurmurHash3 for strings and wide
+    integers, SplitMix64 for packed k-mers. The fingerprint is taken from the
+    low 64 bits and the bucket index from the high 64 bits.
+    """
+    name = "murmur"
+
+    @staticmethod
+    def hash_item(item):
+        h1, h2 = hash_pair(item)
+        return (h2 << 64) | h1
+
+    @staticmethod
+    def split(hash_value, fp_mask, num_buckets):
+        return hash_value & fp_mask, (hash_value >> 64) % num_buckets
+
+    @staticmethod
+    def split_array(items, fp_mask, num_buckets):
+        """
+        Vectorized hash_item followed by split. Returns fingerprint and index arrays.
+        """
+        h1, h2 = hash_pair_array(items)
+        return h1 & np.uint64(fp_mask), h2 % np.uint64(num_buckets)
+
+    @staticmethod
+    def shard(hash_value, num_shards):
+        """
+        Maps the top 32 bits of the index half onto num_shards contiguous ranges
+        """
+        return ((hash_value >> 96) * num_shards) >> 32
+
+    @staticmethod
+    def split_shards_array(items, fp_mask, num_buckets, num_shards):
+        """
+        Vectorized split plus shard. Returns fingerprint, index and shard arrays.
+        """
+        h1, h2 = hash_pair_array(items)
+        shards = ((h2 >> np.uint64(32)) * np.uint64(num_shards)) >> np.uint64(32)
+        return h1 & np.uint64(fp_mask), h2 % np.uint64(num_buckets), shards
+
+    @staticmethod
+    def hash_fingerprint(fp):
+        return mix64(fp ^ SECOND_SEED)
+
+    @staticmethod
+    def hash_fingerprints_mod(fps, num_buckets):
+        return mix64_array(np.asarray(fps, dtype=np.uint64) ^ np.uint64(SECOND_SEED)) % np.uint64(num_buckets)
+
+
+class Sha256HashFamily:
+    """
+    SHA-256 over str(item), as used for the numbers reported in the paper.
+    Both the fingerprint and the bucket index come from the same digest.
+    """
+    name = "sha256"
+
+    @staticmethod
+    def hash_item(item):
+        if isinstance(item, np.integer):
+            item = int(item)
+        return int.from_bytes(hashlib.sha256(str(item).encode('utf-8')).digest(), byteorder='big')
+
+    @staticmethod
+    def split(hash_value, fp_mask, num_buckets):
+        return hash_value & fp_mask, hash_value % num_buckets
+
+    @staticmethod
+    def split_array(items, fp_mask, num_buckets):
+        pairs = [Sha256HashFamily.split(Sha256HashFamily.hash_item(x), fp_mask, num_buckets) for x in items]
+        fps = np.fromiter((p[0] for p in pairs), dtype=np.uint64, count=len(pairs))
+        indices = np.fromiter((p[1] for p in pairs), dtype=np.uint64, count=len(pairs))
+        return fps, indices
+
+    @staticmethod
+    def shard(hash_value, num_shards):
+        return ((hash_value >> 224) * num_shards) >> 32
+
+    @staticmethod
+    def split_shards_array(items, fp_mask, num_buckets, num_shards):
+        hashes = [Sha256HashFamily.hash_item(x) for x in items]
+        fps = np.fromiter((h & fp_mask for h in hashes), dtype=np.uint64, count=len(hashes))
+        indices = np.fromiter((h % num_buckets for h in hashes), dtype=np.uint64, count=len(hashes))
+        shards = np.fromiter((Sha256HashFamily.shard(h, num_shards) for h in hashes), dtype=np.uint64, count=len(hashes))
+        return fps, indices, shards
+
+    @staticmethod
+    def hash_fingerprint(fp):
+        return Sha256HashFamily.hash_item(fp)
+
+    @staticmethod
+    def hash_fingerprints_mod(fps, num_buckets):
+        return np.fromiter((Sha256HashFamily.hash_item(fp) % num_buckets for fp in fps), dtype=np.uint64, count=len(fps))
+
+
+HASH_FAMILIES = {
+    MurmurHashFamily.name: MurmurHashFamily,
+    Sha256HashFamily.name: Sha256HashFamily,
+}
+DEFAULT_HASH = MurmurHashFamily.name
+
+
+def get_hash_family(name):
+    if name not in HASH_FAMILIES:
+        raise ValueError("Unknown hash family {}, expected one of {}".format(name, ", ".join(HASH_FAMILIES)))
+    return HASH_FAMILIES[name]()
+
+
+def alt_index(index, fp_hash, num_buckets):
+    """
+    Partial-key cuckoo hashing: the other bucket of a fingerprint. XOR is only
+    its own inverse modulo a power of two, so other table sizes use
+    (fp_hash - index) mod num_buckets, which maps the two buckets onto each other.
+    """
+    if num_buckets & (num_buckets - 1) == 0:
+        return (index ^ fp_hash) % num_buckets
+    return (fp_hash - index) % num_buckets
+
+
+@lru_cache(maxsize=16)
+def get_alt_offset_table(hash_name, fp_size, num_buckets):
+    """
+    Precomputes h(fp) mod num_buckets for every fingerprint of fp_size bits,
+    which is all alt_index needs, so kicks do no hashing at all. Returns None
+    for fingerprints wider than ALT_TABLE_MAX_FP_SIZE bits. Tables are cached
+    and shared by every filter with the same parameters, e.g. the tree nodes.
+    """
+    if fp_size > ALT_TABLE_MAX_FP_SIZE:
+        return None
+    family = get_hash_family(hash_name)
+    table = family.hash_fingerprints_mod(np.arange(1 << fp_size, dtype=np.uint64), num_buckets)
+    table.setflags(write=False)
+    return table
@@ -0,0 +1,167 @@
+"""
+Description: Contains the 2-bit k-mer encoder shared by the filters and the trees
+"""
+from functools import partial
+import numpy as np
+
+BASE_CODES = {"A": 0, "C": 1, "G": 2, "T": 3, "a": 0, "c": 1, "g": 2, "t": 3}
+INVALID_CODE = 255
+MAX_WORD_K = 32
+
+# Lookup table from an ASCII byte to its 2-bit code, INVALID_CODE for non-ACGT bases
+CODE_TABLE = np.full(256, INVALID_CODE, dtype=np.uint8)
+for base, code in BASE_CODES.items():
+    CODE_TABLE[ord(base)] = code
+
+
+def encode_sequence(sequence):
+    """
+    Encodes a read once into an array of 2-bit base codes (one code per byte),
+    with INVALID_CODE marking ambiguous bases such as N.
+    """
+    if isinstance(sequence, str):
+        sequence = sequence.encode("ascii")
+    return CODE_TABLE[np.frombuffer(sequence, dtype=np.uint8)]
+
+
+def packed_kmers(sequence, k, canonical=False):
+    """
+    Yields every k-mer of the sequence as an integer holding 2 bits per base,
+    computed by rolling shift-and-mask over the read. Windows that contain a
+    non-ACGT base are skipped. Integers grow past 64 bits when k > 32.
+
+    With canonical set, the reverse complement is rolled alongside the forward
+    k-mer (shifting in the complemented base from the top) and the smaller of
+    the two is yielded, so both strands map to the same item.
+    """
+    mask = (1 << (2 * k)) - 1
+    top_shift = 2 * (k - 1)
+    value = 0
+    rc_value = 0
+    valid = 0
+    for base in sequence:
+        code = BASE_CODES.get(base)
+        if code is None:
+            value = 0
+            rc_value = 0
+            valid = 0
+            continue
+        value = ((value << 2) | code) & mask
+        valid += 1
+        if canonical:
+            rc_value = (rc_value >> 2) | ((3 - code) << top_shift)
+            if valid >= k:
+                yield value if value < rc_value else rc_value
+        elif valid >= k:
+            yield value
+
+
+def packed_kmer_array(sequence, k, canonical=False):
+    """
+    Vectorized form of packed_kmers for k <= 32. Returns the k-mers of the
+    sequence as a NumPy uint64 array, in the same order packed_kmers yields them.
+    """
+    if k > MAX_WORD_K:
+        return np.fromiter(packed_kmers(sequence, k, canonical), dtype=object)
+    codes = encode_sequence(sequence)
+    num_kmers = len(codes) - k + 1
+    if num_kmers <= 0:
+        return np.empty(0, dtype=np.uint64)
+    invalid = codes == INVALID_CODE
+    values = np.zeros(num_kmers, dtype=np.uint64)
+    for j in range(k):
+        values <<= np.uint64(2)
+        values |= codes[j:j + num_kmers].astype(np.uint64) & np.uint64(3)
+    if canonical:
+        complements = np.uint64(3) - (codes.astype(np.uint64) & np.uint64(3))
+        rc_values = np.zeros(num_kmers, dtype=np.uint64)
+        for j in range(k - 1, -1, -1):
+            rc_values <<= np.uint64(2)
+            rc_values |= complements[j:j + num_kmers]
+        values = np.minimum(values, rc_values)
+    if invalid.any():
+        bad_windows = np.convolve(invalid, np.ones(k, dtype=np.uint8), mode="valid") > 0
+        values = values[~bad_windows]
+    return values
+
+
+def encode_query(query, k, canonical=False):
+    """
+    Encodes a query string the way the -k builds of the flat filters encode their
+    items: a string of exactly k ACGT bases becomes its packed k-mer, canonical if
+    set. Any other query, and every query when k is 0, is returned unchanged.
+    """
+    if k == 0 or not isinstance(query, str) or len(query) != k:
+        return query
+    return next(packed_kmers(query, k, canonical), query)
+
+
+def encode_queries(queries, k, canonical=False):
+    """
+    Returns the list of queries encoded with encode_query
+    """
+    if k == 0:
+        return list(queries)
+    return [encode_query(query, k, canonical) for query in queries]
+
+
+class KmerItems:
+    """
+    K-mer mode of the items held by a flat filter, saved with its parameters so queries
+    can be encoded the same way (see encode_query): k = 0 for whole reads, otherwise the
+    packed k-mers of the -k builds, canonical or not.
+    """
+
+    k = 0
+    canonical = False
+
+    def set_kmer_mode(self, k, canonical=False):
+        self.k = k
+        self.canonical = canonical
+
+    def get_kmer_params(self):
+        return {"k": self.k, "canonical": self.canonical}
+
+    def set_kmer_params(self, params):
+        # Sketches saved without a k-mer mode hold whole reads
+        self.set_kmer_mode(params.get("k", 0), params.get("canonical", False))
+
+
+def reverse_complement(value, k):
+    """
+    Returns the packed reverse complement of a packed k-mer
+    """
+    rc_value = 0
+    for _ in range(k):
+        rc_value = (rc_value << 2) | (3 - (value & 3))
+        value >>= 2
+    return rc_value
+
+
+def decode_kmer(value, k):
+    """
+    Turns a packed k-mer back into its string of bases
+    """
+    bases = []
+    for _ in range(k):
+        bases.append("ACGT"[value & 3])
+        value >>= 2
+    return "".join(reversed(bases))
+
+
+def string_kmers(sequence, k):
+    """
+    Yields every k-mer of the sequence as a string slice
+    """
+    for i in range(len(sequence) - k + 1):
+        yield sequence[i:i + k]
+
+
+def kmerizer(k, packed=False, canonical=False):
+    """
+    Returns a function that maps a sequence to its k-mers, either as string
+    slices or as packed integers. Canonical k-mers are always packed.
+    """
+    if packed or canonical:
+        return partial(packed_kmers, k=k, canonical=canonical)
+    return partial(string_kmers, k=k)
@@ -4,16 +4,31 @@ from sys import getsizeof
 
 import cuckoo_filter
 import bloom_filter
+import xor_filter
 import bloom_tree
+import split_bloom_tree
 import cuckoo_tree
 import cuckoo_bit_tree
-from read import Read
+import hashing
+import serialization
+import parallel
+import server
+from fastq import stream_sequences, load_read_batch
+from kmers import packed_kmers, packed_kmer_array, encode_query, KmerItems
 from config import *
+import numpy as np
 
-read_list = []
-tree_read_list = []
+CUCKOO_VARIANTS = {
+    "list": cuckoo_filter.CuckooFilter,
+    "bit": cuckoo_filter.CuckooFilterBit,
+    "array": cuckoo_filter.CuckooFilterArray,
+    "semisort": cuckoo_filter.CuckooFilterSemiSorted,
+}
+
+datafiles = []
 cuckooFilter = None
 bloomFilter = None
+xorFilter = None
 
 def print_stats(filter_stats, sketch_config, verbose=False):
     if verbose:
@@ -31,10 +46,13 @@ def create_bloom_filter(sketch_config, filter_stats):
     load_factor_step_size = bloomFilter.expected_num / 10
     step = 1
     start = time.time()
-    if sketch_config.k == 0:
+    if sketch_config.workers > 1:
+        bloomFilter, items = parallel.build_bloom_filter(datafiles, sketch_config.expected_items, sketch_config.fp_prob,
+            sketch_config.k, sketch_config.canonical, sketch_config.workers)
+    elif sketch_config.k == 0:
         t1 = time.time()
-        for read in read_list:
-            if bloomFilter.insert(read.line) == False:
+        for read_line in stream_sequences(datafiles):
+            if bloomFilter.insert(read_line) == False:
                 break
             items+=1
             if items >= load_factor_step_size*step:
@@ -42,21 +60,17 @@ def create_bloom_filter(sketch_config, filter_stats):
                     step +=1
                     t1 = time.time()
     else:
-        failed = False
-        r = 0
         t1 = time.time()
-        while not failed and r < len(read_list):
-            for i in range(len(read_list[r].line) - sketch_config.k):
-                if bloomFilter.insert(read_list[r].line[i:i+sketch_config.k]) == False:
-                    failed = True
-                    break
-                items+=1
-                if items >= load_factor_step_size*step:
-                    insertion_tput_records.append(load_factor_step_size/(time.time() - t1))
-                    step +=1
-                    t1 = time.time()
-            r+=1
+        for read_line in stream_sequences(datafiles):
+            kmers = packed_kmer_array(read_line, sketch_config.k, sketch_config.canonical)
+            bloomFilter.insert_many(kmers)
+            items+=len(kmers)
+            if items >= load_factor_step_size*step:
+                insertion_tput_records.append(load_factor_step_size/(time.time() - t1))
+                step +=1
+                t1 = time.time()
     end = time.time()
+    bloomFilter.set_kmer_mode(sketch_config.k, sketch_config.canonical)
     filter_stats["items"] = items
     filter_stats["constr_speed"] = items / (end-start)
     filter_stats["load_factor"] = items / bloomFilter.expected_num
@@ -64,6 +78,32 @@ def create_bloom_filter(sketch_config, filter_stats):
     filter_stats["bpi"] = (filter_stats["total_size"] / items) * 8
     filter_stats["insertion_tput"] = insertion_tput_records
 
+def create_xor_filter(sketch_config, filter_stats):
+    """
+    Builds the static XOR filter from all the items of the datafiles at once. With --auto
+    the fingerprint size is derived from the false positive probability.
+    """
+    global xorFilter
+    if sketch_config.auto:
+        sketch_config.fp_size = xor_filter.get_fingerprint_size(sketch_config.fp_prob)
+    start = time.time()
+    if sketch_config.k == 0:
+        items = list(stream_sequences(datafiles))
+    else:
+        batches = [packed_kmer_array(read_line, sketch_config.k, sketch_config.canonical)
+                   for read_line in stream_sequences(datafiles)]
+        items = np.concatenate(batches) if batches else np.zeros(0, dtype=np.uint64)
+    xorFilter = xor_filter.XorFilter(items, sketch_config.fp_size)
+    end = time.time()
+    xorFilter.set_kmer_mode(sketch_config.k, sketch_config.canonical)
+    sketch_config.num_buckets, sketch_config.bucket_size = len(xorFilter.table), 1
+    filter_stats["items"] = len(items)
+    filter_stats["constr_speed"] = len(items) / (end-start)
+    filter_stats["load_factor"] = xorFilter.num_items_in_filter / len(xorFilter.table)
+    filter_stats["total_size"] = xorFilter.get_size()
+    filter_stats["bpi"] = (filter_stats["total_size"] / len(items)) * 8
+    filter_stats["insertion_tput"] = []
+
 def create_cuckoo_filter(sketch_config, filter_stats):
     global cuckooFilter
     insertion_tput_records = []
@@ -71,23 +111,23 @@ def create_cuckoo_filter(sketch_config, filter_stats):
     if sketch_config.auto:
         sketch_config.num_buckets, sketch_config.fp_size, sketch_config.bucket_size = cuckoo_filter.get_cuckoo_filter_params(sketch_config.expected_items,
             sketch_config.fp_prob)
+    if sketch_config.workers > 1:
+        return create_sharded_cuckoo_filter(sketch_config, filter_stats)
     if sketch_config.stash != 0:
         cuckooFilter = cuckoo_filter.CuckooFilterStash(sketch_config.num_buckets, 
-            sketch_config.fp_size, sketch_config.bucket_size, sketch_config.max_iter, sketch_config.stash)
-    if sketch_config.bitarray_variant:
-        cuckooFilter = cuckoo_filter.CuckooFilterBit(sketch_config.num_buckets, sketch_config.fp_size, 
-            sketch_config.bucket_size, sketch_config.max_iter)
+            sketch_config.fp_size, sketch_config.bucket_size, sketch_config.max_iter, sketch_config.stash, sketch_config.hash_family,
+            sketch_config.bfs_depth)
     else:
-        cuckooFilter = cuckoo_filter.CuckooFilter(sketch_config.num_buckets, sketch_config.fp_size, 
-            sketch_config.bucket_size, sketch_config.max_iter)
+        cuckooFilter = CUCKOO_VARIANTS[sketch_config.variant](sketch_config.num_buckets, sketch_config.fp_size, 
+            sketch_config.bucket_size, sketch_config.max_iter, sketch_config.hash_family, sketch_config.bfs_depth)
     items = 0
     load_factor_step_size = (cuckooFilter.num_buckets * cuckooFilter.bucket_size) / 10
     step = 1
     start = time.time()
     if sketch_config.k == 0:
         t1 = time.time()
-        for read in read_list:
-            if cuckooFilter.insert(read.line) == False:
+        for read_line in stream_sequences(datafiles):
+            if cuckooFilter.insert(read_line) == False:
                 break
             items+=1
             if items >= load_factor_step_size*step:
@@ -97,11 +137,10 @@ def create_cuckoo_filter(sketch_config, filter_stats):
 
     else:
         failed = False
-        r = 0
         t1 = time.time()
-        while not failed and r < len(read_list):
-            for i in range(len(read_list[r].line) - sketch_config.k):
-                if cuckooFilter.insert(read_list[r].line[i:i+sketch_config.k]) == False:
+        for read_line in stream_sequences(datafiles):
+            for kmer in packed_kmers(read_line, sketch_config.k, sketch_config.canonical):
+                if cuckooFilter.insert(kmer) == False:
                     failed = True
                     break
                 items+=1
@@ -109,27 +148,54 @@ def create_cuckoo_filter(sketch_config, filter_stats):
                     insertion_tput_records.append(load_factor_step_size/(time.time() - t1))
                     step +=1
                     t1 = time.time()
-            r+=1
+            if failed:
+                break
+    end = time.time()
+    cuckooFilter.set_kmer_mode(sketch_config.k, sketch_config.canonical)
+    record_cuckoo_filter_stats(filter_stats, items, start, end, insertion_tput_records)
+
+def create_sharded_cuckoo_filter(sketch_config, filter_stats):
+    """
+    Builds the filter with sketch_config.workers processes, one shard per worker
+    """
+    global cuckooFilter
+    start = time.time()
+    cuckooFilter = parallel.build_cuckoo_filter(datafiles, CUCKOO_VARIANTS[sketch_config.variant], sketch_config.num_buckets,
+        sketch_config.fp_size, sketch_config.bucket_size, sketch_config.max_iter, sketch_config.hash_family,
+        sketch_config.bfs_depth, sketch_config.k, sketch_config.canonical, sketch_config.workers)
     end = time.time()
+    cuckooFilter.set_kmer_mode(sketch_config.k, sketch_config.canonical)
+    record_cuckoo_filter_stats(filter_stats, cuckooFilter.num_items_in_filter, start, end, [])
+
+def record_cuckoo_filter_stats(filter_stats, items, start, end, insertion_tput_records):
     filter_stats["items"] = items
     filter_stats["constr_speed"] = items / (end-start)
     filter_stats["load_factor"] = items / (cuckooFilter.num_buckets * cuckooFilter.bucket_size)
     filter_stats["total_size"] = cuckooFilter.get_size()
     filter_stats["bpi"] = (filter_stats["total_size"] / items) * 8
     filter_stats["insertion_tput"] = insertion_tput_records
+    filter_stats["eviction_path_lengths"] = cuckooFilter.eviction_path_lengths
+    filter_stats["failed_inserts"] = cuckooFilter.failed_inserts
 
 
 def create_bloom_tree(sketch_config, filter_stats):
     global bloomFilter
     insertion_tput_records = []
     # print("Creating the sketch. This might take a while ...")
-    bloomFilter = bloom_tree.BloomTree(sketch_config.theta, sketch_config.k, sketch_config.expected_items, sketch_config.fp_prob)
+    bloomFilter = bloom_tree.BloomTree(sketch_config.theta, sketch_config.k, sketch_config.expected_items, sketch_config.fp_prob,
+        packed=True, canonical=sketch_config.canonical)
     items = 0
 
     start = time.time()
-    for dataset in tree_read_list:
-        bloomFilter.insert(dataset)
-        items+=len(dataset)
+    if sketch_config.bulk:
+        datasets = [load_read_batch(filename) for filename in datafiles]
+        bloomFilter.build_bulk(datasets, sketch_config.workers)
+        items = sum(len(dataset) for dataset in datasets)
+    else:
+        for filename in datafiles:
+            dataset = load_read_batch(filename)
+            bloomFilter.insert(dataset)
+            items+=len(dataset)
 
     end = time.time()
     filter_stats["items"] = items
@@ -139,6 +205,32 @@ def create_bloom_tree(sketch_config, filter_stats):
     filter_stats["bpi"] = (filter_stats["total_size"] / items) * 8
     filter_stats["insertion_tput"] = insertion_tput_records
 
+def create_split_bloom_tree(sketch_config, filter_stats):
+    global bloomFilter
+    bloomFilter = split_bloom_tree.SplitBloomTree(sketch_config.theta, sketch_config.k, sketch_config.expected_items,
+        sketch_config.fp_prob, packed=True, canonical=sketch_config.canonical)
+    items = 0
+
+    start = time.time()
+    if sketch_config.bulk:
+        datasets = [load_read_batch(filename) for filename in datafiles]
+        bloomFilter.build_bulk(datasets, sketch_config.workers)
+        items = sum(len(dataset) for dataset in datasets)
+    else:
+        for filename in datafiles:
+            dataset = load_read_batch(filename)
+            bloomFilter.insert(dataset)
+            items+=len(dataset)
+    bloomFilter.build()
+
+    end = time.time()
+    filter_stats["items"] = items
+    filter_stats["constr_speed"] = items / (end-start)
+    filter_stats["load_factor"] = items / bloomFilter.expected_num
+    filter_stats["total_size"] = bloomFilter.aggregate_size
+    filter_stats["bpi"] = (filter_stats["total_size"] / items) * 8
+    filter_stats["insertion_tput"] = []
+
 def create_cuckoo_tree(sketch_config, filter_stats):
     global cuckooFilter
     insertion_tput_records = []
@@ -146,13 +238,19 @@ def create_cuckoo_tree(sketch_config, filter_stats):
     sketch_config.num_buckets, sketch_config.fp_size, sketch_config.bucket_size = cuckoo_filter.get_cuckoo_filter_params(sketch_config.expected_items,
             sketch_config.fp_prob)
     cuckooFilter = cuckoo_bit_tree.CuckooBitTree(sketch_config.theta, sketch_config.k, sketch_config.num_buckets, sketch_config.fp_size, 
-            sketch_config.bucket_size, sketch_config.max_iter)
+            sketch_config.bucket_size, sketch_config.max_iter, packed=True, canonical=sketch_config.canonical,
+            hash_family=sketch_config.hash_family)
     items = 0
     start = time.time()
-    print(len(tree_read_list), len(tree_read_list[0]))
-    for dataset in tree_read_list:
-        cuckooFilter.insert(dataset)
-        items+=len(dataset)
+    if sketch_config.bulk:
+        datasets = [load_read_batch(filename) for filename in datafiles]
+        cuckooFilter.build_bulk(datasets, sketch_config.workers)
+        items = sum(len(dataset) for dataset in datasets)
+    else:
+        for filename in datafiles:
+            dataset = load_read_batch(filename)
+            cuckooFilter.insert(dataset)
+            items+=len(dataset)
 
     end = time.time()
     filter_stats["items"] = items
@@ -162,59 +260,76 @@ def create_cuckoo_tree(sketch_config, filter_stats):
     filter_stats["bpi"] = (filter_stats["total_size"] / items) * 8
     filter_stats["insertion_tput"] = insertion_tput_records
 
+def get_query_kmer_mode(filter):
+    """
+    Returns the (k, canonical) pair queries of filter are encoded with, see kmers.encode_query.
+    Flat filters built with -k hold packed k-mers, trees k-merize their queries themselves.
+    """
+    if isinstance(filter, KmerItems):
+        return filter.k, filter.canonical
+    return 0, False
+
 def query(q):
     global cuckooFilter
     if cuckooFilter == None:
         print("cuckoo filter is empty.")
         return -1
-    if cuckooFilter.contains(q):
+    if cuckooFilter.contains(encode_query(q, *get_query_kmer_mode(cuckooFilter))):
         print("POSITIVE")
         return 1
     else:
         print("NEGATIVE")
         return 0
 
-def perform_fp_query(query_file, filter_stats, filter):
+def perform_parallel_query(query_file, filter_stats, filter, query_workers):
+    """
+    Answers the queries with a pool of query_workers processes sharing the filter tables.
+    Returns the results in query order and records the aggregate and per-worker throughput.
+    The workers encode the queries with the k-mer mode of the filter.
+    """
+    queries = list(stream_sequences(query_file, limit=100000))
+    with parallel.ParallelQueryExecutor(filter, query_workers) as executor:
+        results = executor.query(queries)
+    filter_stats["query_throughput"] = executor.get_throughput()
+    filter_stats["worker_query_throughput"] = executor.get_worker_throughput()
+    return results
+
+def perform_fp_query(query_file, filter_stats, filter, query_workers=1):
+    if query_workers > 1:
+        results = perform_parallel_query(query_file, filter_stats, filter, query_workers)
+        if not results:
+            print("WARNING! empty query file!")
+            return
+        filter_stats["fp_rate"] = sum(1 for result in results if result) / len(results)
+        return
     line_ptr = 0.0
     positives = 0.0
-    with open(query_file, "r") as f:
-        start = time.time()
-        while True:
-            read_id = f.readline()[1:-1]
-            if read_id == "":
-                break
-            read_line = f.readline().strip()
-            temp = f.readline()
-            read_quality = f.readline()
-            if filter.contains(read_line):
-                positives+=1
-            line_ptr+=1
-            if line_ptr == 100000:
-                break
-        end = time.time()
+    start = time.time()
+    k, canonical = get_query_kmer_mode(filter)
+    for read_line in stream_sequences(query_file, limit=100000):
+        if filter.contains(encode_query(read_line, k, canonical)):
+            positives+=1
+        line_ptr+=1
+    end = time.time()
     if line_ptr == 0.0:
         print("WARNING! empty query file!")
         return
     filter_stats["fp_rate"] = positives/line_ptr
 
-def perform_query_throughput_measurements(query_file, filter_stats, filter):
+def perform_query_throughput_measurements(query_file, filter_stats, filter, query_workers=1):
+    if query_workers > 1:
+        if not perform_parallel_query(query_file, filter_stats, filter, query_workers):
+            print("WARNING! empty query file!")
+        return
     line_ptr = 0.0
     positives = 0.0
-    with open(query_file, "r") as f:
-        start = time.time()
-        while True:
-            read_id = f.readline()[1:-1]
-            if read_id == "":
-                break
-            read_line = f.readline().strip()
-            temp = f.readline()
-            read_quality = f.readline()
-            if filter.contains(read_line):
-                positives+=1
-            line_ptr+=1
-            if line_ptr == 100000:
-                break
-        end = time.time()
+    start = time.time()
+    k, canonical = get_query_kmer_mode(filter)
+    for read_line in stream_sequences(query_file, limit=100000):
+        if filter.contains(encode_query(read_line, k, canonical)):
+            positives+=1
+        line_ptr+=1
+    end = time.time()
     if line_ptr == 0.0:
         print("WARNING! empty query file!")
         return
@@ -233,41 +348,38 @@ def cli(args, sketch_config, filter_stats):
     elif command == "4":
         query(input("Enter the query phrase: "))
     elif command == "5":
-        
-        sketch_config["bitarray_variant"] = True
+        sketch_config.variant = "bit"
     elif command == "6":
         exit(0)
     cli(args, sketch_config, filter_stats)
 
 
+def load_sketch(path, sketch_config, filter_stats, mapped=False, tree_dir=False, node_cache=serialization.NODE_CACHE_SIZE):
+    """
+    Loads a sketch saved with --save, so queries run without rebuilding it from the datafiles.
+    A mapped sketch is query-only and shares its pages with every process mapping the same file.
+    A tree saved with --tree-dir reads its node filters on demand, at most node_cache at a time.
+    The k-mer mode the sketch was built with replaces -k and --canonical.
+    """
+    start = time.time()
+    if tree_dir:
+        sketch = serialization.load_tree_directory(path, node_cache, mapped)
+    else:
+        sketch = serialization.load_sketch(path, mapped)
+    sketch_config.k = getattr(sketch, "k", 0)
+    sketch_config.canonical = getattr(sketch, "canonical", False)
+    filter_stats["items"] = getattr(sketch, "num_items_in_filter", 0)
+    filter_stats["total_size"] = getattr(sketch, "aggregate_size", None) or sketch.get_size()
+    filter_stats["load_time"] = time.time() - start
+    return sketch
+
 def initiate(args):
     global bloomFilter
     global cuckooFilter
-    temp_list = []
-    separate_reads_per_dataset = False
-    if args.create_cuckoo_tree or args.create_bloom_tree:
-        separate_reads_per_dataset = True
-    for filename in args.datafiles:
-        line_ptr = 0
-        if separate_reads_per_dataset:
-            temp_list = []
-        with open(filename, "r") as f:
-            while True:
-                read_id = f.readline()[1:-1]
-                if read_id == "":
-                    break
-                read_line = f.readline().strip()
-                temp = f.readline()
-                read_quality = f.readline()
-                temp_list.append(Read(filename, read_id, line_ptr, read_line, read_quality))
-                line_ptr+=1
-        if separate_reads_per_dataset:
-            tree_read_list.append(temp_list)
-    if not separate_reads_per_dataset:
-        for i in temp_list:
-            read_list.append(i)
-
-    sketch_config = SketchConfig(args.b, args.f, args.s, args.i, args.k, args.stash, args.e, args.p, args.t, args.auto)
+    datafiles.extend(args.datafiles)
+
+    sketch_config = SketchConfig(args.b, args.f, args.s, args.i, args.k, args.stash, args.e, args.p, args.auto, args.t,
+        canonical=args.canonical, hash_family=args.hash, bfs_depth=args.bfs_depth, workers=args.workers, bulk=args.bulk)
     filter_stats = {
         "items" : 0,
         "constr_speed" : 0.0,
@@ -276,10 +388,16 @@ def initiate(args):
         "bpi": 0,
         "fp_rate" : 0,
         "query_throughput" : 0,
-        "insertion_tput": []
+        "worker_query_throughput": [],
+        "insertion_tput": [],
+        "eviction_path_lengths": {},
+        "failed_inserts": 0
     }
     filter = None
-    if args.interactive:
+    if args.load:
+        filter = load_sketch(args.load, sketch_config, filter_stats, args.mmap, args.tree_dir, args.node_cache)
+        print("Loaded {} from {} in {:.4f}s".format(type(filter).__name__, args.load, filter_stats["load_time"]))
+    elif args.interactive:
         cli(args, sketch_config, filter_stats)
     elif args.create_bloom_filter:
         create_bloom_filter(sketch_config, filter_stats)
@@ -288,41 +406,73 @@ def initiate(args):
         create_cuckoo_filter(sketch_config, filter_stats)
         filter = cuckooFilter
     elif args.create_cuckoo_filter_bit:
-        sketch_config.bitarray_variant = True
+        sketch_config.variant = "bit"
+        create_cuckoo_filter(sketch_config, filter_stats)
+        filter = cuckooFilter
+    elif args.create_cuckoo_filter_array:
+        sketch_config.variant = "array"
         create_cuckoo_filter(sketch_config, filter_stats)
         filter = cuckooFilter
+    elif args.create_cuckoo_filter_semisort:
+        sketch_config.variant = "semisort"
+        create_cuckoo_filter(sketch_config, filter_stats)
+        filter = cuckooFilter
+    elif args.create_xor_filter:
+        create_xor_filter(sketch_config, filter_stats)
+        filter = xorFilter
     elif args.create_bloom_tree:
         create_bloom_tree(sketch_config, filter_stats)
         filter = bloomFilter
+    elif args.create_split_bloom_tree:
+        create_split_bloom_tree(sketch_config, filter_stats)
+        filter = bloomFilter
     elif args.create_cuckoo_tree:
         create_cuckoo_tree(sketch_config, filter_stats)
         filter = cuckooFilter
+    if args.save and filter is not None:
+        if args.tree_dir:
+            serialization.save_tree_directory(filter, args.save)
+        else:
+            filter.save(args.save)
     if args.fp_query:
-        perform_fp_query(args.q, filter_stats, filter)
+        perform_fp_query(args.q, filter_stats, filter, args.query_workers)
     if args.query_tput:
-        perform_query_throughput_measurements(args.q, filter_stats, filter)
+        perform_query_throughput_measurements(args.q, filter_stats, filter, args.query_workers)
         print("Query Throuput : {}".format(filter_stats["query_throughput"]))
+        if args.query_workers > 1:
+            print("Query Throuput per worker : {}".format(
+                ", ".join("{:.1f}".format(tput) for tput in filter_stats["worker_query_throughput"])))
     if args.insert_tput:
         print("Insertion Throuput at 0.1 increments of load factor: ", end=" ")
         for item in filter_stats["insertion_tput"]:
             print(item, sep=", ")
+    if args.eviction_hist:
+        print("Eviction path lengths (moves: inserts): ", end=" ")
+        for moves in sorted(filter_stats["eviction_path_lengths"]):
+            print("{}: {}".format(moves, filter_stats["eviction_path_lengths"][moves]), end=", ")
+        print("failed: {}".format(filter_stats["failed_inserts"]))
     print_stats(filter_stats, sketch_config, args.verbose)
+    if args.serve and filter is not None:
+        print("Serving {} on {}".format(type(filter).__name__, args.serve), flush=True)
+        server.serve(filter, args.serve)
 
 
 
 def arguments():
     usg = '''
-        main.py [-h] [--datafiles DATAFILE1.FASTQ DATAFILE2.FASTQ ...] [--interactive | --create-cuckoo-filter | --create-cuckoo-filter-bit |
-            --create-bloom-filter | --create-bloom-tree | --create-cuckoo-tree] [-q QUERY_FILE] [--fp-query] [--query-tput]
-            [-b buckets] [-f fp_size] [-s bucket_size] [-i iterations] [-k Kmer_size] [-e expected_#_items] [-p false_positive_probability]
-            [--stash STASH_SIZE] [--auto] [-v]
+        main.py [-h] [--datafiles DATAFILE1.FASTQ DATAFILE2.FASTQ ...] [--interactive | --create-cuckoo-filter | --create-cuckoo-filter-bit | --create-cuckoo-filter-array |
+            --create-cuckoo-filter-semisort | --create-bloom-filter | --create-xor-filter | --create-bloom-tree | --create-split-bloom-tree | --create-cuckoo-tree] [-q QUERY_FILE] [--fp-query] [--query-tput]
+            [-b buckets] [-f fp_size] [-s bucket_size] [-i iterations] [-k Kmer_size] [--canonical] [-e expected_#_items] [-p false_positive_probability]
+            [--save SKETCH_FILE | --load SKETCH_FILE [--mmap]] [--tree-dir [--node-cache N]] [--serve ADDRESS] [--stash STASH_SIZE] [--hash {murmur,sha256}]
+            [--bfs-depth DEPTH] [--workers N] [--bulk] [--query-workers N] [--eviction-hist] [--auto] [-v]
     '''
     parser = argparse.ArgumentParser(description='Cuckoo/Bloom Filter variants Implementation', usage=usg)
-    parser.add_argument('--datafiles', dest='datafiles', nargs="+", required=True,
+    parser.add_argument('--datafiles', dest='datafiles', nargs="+", default=[],
                         help='The input file to populate the data structures')
     parser.add_argument("--interactive", help="Start CLI after reading files", action='store_true')
     parser.add_argument("-v", help="Verbose: Prints the labels for output stats.", dest="verbose", action='store_true')
     parser.add_argument("-k", help="k-mer size, omit to disable kmer processing.", default=0, type=int)
+    parser.add_argument("--canonical", help="Insert and query canonical k-mers, min(kmer, reverse complement). Requires -k.", action='store_true')
     parser.add_argument("-b", help="CuckooFilter; Number of buckets. Default=6500", default=6500, type=int)
     parser.add_argument("-f", help="CuckooFilter; Fingerprint size. Default=16", default=16, type=int)
     parser.add_argument("-s", help="CuckooFilter; Bucket size. Default=64", default=64, type=int)
@@ -331,18 +481,49 @@ def arguments():
     parser.add_argument("-p", help="CuckooFilterAuto&BloomFilter; False positive probability. Default=0.001", default=0.001, type=float)
     parser.add_argument("-t", help="BloomTree; Strictness of querying. Default=0.5", default=0.5, type=float)
     parser.add_argument("-q", help="Query file", default="")
+    parser.add_argument("--hash", help="CuckooFilter; Hash family, sha256 reproduces the paper numbers. Default=murmur",
+                        default=hashing.DEFAULT_HASH, choices=sorted(hashing.HASH_FAMILIES))
     parser.add_argument("--stash", help="CuckooFilter; Stash size. Default=0", default=0, type=int)
+    parser.add_argument("--bfs-depth", help="CuckooFilter; Search breadth-first for an eviction path of at most this many moves instead of the random walk. Default=0 (random walk)", default=0, type=int)
+    parser.add_argument("--eviction-hist", help="CuckooFilter; Report the histogram of eviction path lengths after construction.", action='store_true')
+    parser.add_argument("--workers", help="CuckooFilter&BloomFilter; Number of processes building the filter, or the tree leaves with --bulk. Default=1", default=1, type=int)
+    parser.add_argument("--bulk", help="BloomTree&SplitBloomTree&CuckooTree; Build all leaves first, then pair the most similar nodes bottom-up, instead of inserting the datasets one by one.", action='store_true')
+    parser.add_argument("--serve", help="Keep the built or loaded sketch and answer queries, one per line, on ADDRESS (a Unix socket path or HOST:PORT). Send STATS for the latency and throughput counters.", metavar="ADDRESS", default="")
+    parser.add_argument("--query-workers", help="Number of processes answering --fp-query and --query-tput queries, sharing the filter tables. Default=1", default=1, type=int)
     parser.add_argument("--auto", help="CuckooFilter; Automatically derive the fp_size, bucket_size and num of buckets from fp_probability and expected items.", dest="auto", action='store_true')
     parser.add_argument("--create-cuckoo-filter", help="Create the cuckoo filter, measure and report the statistics, then exit.", action='store_true')
     parser.add_argument("--create-cuckoo-filter-bit", help="Create the bitarray variant of cuckoo filter, measure and report the statistics, then exit.", action='store_true')
+    parser.add_argument("--create-cuckoo-filter-array", help="Create the NumPy table variant of cuckoo filter, measure and report the statistics, then exit.", action='store_true')
+    parser.add_argument("--create-cuckoo-filter-semisort", help="Create the semi-sorted bitarray variant of cuckoo filter (needs -s 4), measure and report the statistics, then exit.", action='store_true')
     parser.add_argument("--create-bloom-filter", help="Create the Bloom filter, measure and report the statistics, then exit.", action='store_true')
+    parser.add_argument("--create-xor-filter", help="Create the static XOR filter from all the items at once (-f fingerprint bits, or derived from -p with --auto), measure and report the statistics, then exit.", action='store_true')
     parser.add_argument("--create-bloom-tree", help="Create the Bloom tree, measure and report the statistics, then exit.", action='store_true')
+    parser.add_argument("--create-split-bloom-tree", help="Create the split Bloom tree (nodes keep only the bits determined below them), measure and report the statistics, then exit.", action='store_true')
     parser.add_argument("--create-cuckoo-tree", help="Create the Bloom cuckoo, measure and report the statistics, then exit.", action='store_true')
+    parser.add_argument("--save", help="Save the created sketch to this file.", default="")
+    parser.add_argument("--load", help="Load a sketch saved with --save instead of creating one from the datafiles.", default="")
+    parser.add_argument("--mmap", help="With --load, memory-map the saved tables read-only instead of reading them (query-only).", action='store_true')
+    parser.add_argument("--tree-dir", help="Trees; With --save or --load, store the tree as a directory with a manifest and one file per node. A tree loaded this way reads its node filters when queries reach them (query-only).", action='store_true')
+    parser.add_argument("--node-cache", help="Trees; With --load --tree-dir, most node filters kept in memory. Default={}".format(serialization.NODE_CACHE_SIZE), default=serialization.NODE_CACHE_SIZE, type=int)
     parser.add_argument("--fp-query", help="Perform false positive queries after creating the sketch, report FP rate then exit.", action='store_true')
     parser.add_argument("--query-tput", help="Perform queries after creating the sketch, report query throughput then exit.", action='store_true')
     parser.add_argument("--insert-tput", help="Perform insertion throughput measurements.", action='store_true')
 
     args = parser.parse_args()
+    if not args.datafiles and not args.load:
+        parser.error("--datafiles is required unless a sketch is given with --load")
+    if args.canonical and args.k == 0:
+        parser.error("--canonical requires -k")
+    if args.create_cuckoo_filter_semisort and not args.auto and (args.s != 4 or args.f < 4):
+        parser.error("--create-cuckoo-filter-semisort needs -s 4 and -f of at least 4, or --auto")
+    builds_cuckoo_filter = (args.interactive or args.create_cuckoo_filter or args.create_cuckoo_filter_bit or
+                            args.create_cuckoo_filter_array or args.create_cuckoo_filter_semisort)
+    if builds_cuckoo_filter and args.stash != 0 and args.workers > 1:
+        parser.error("--workers builds a sharded cuckoo filter, which has no stash")
+    builds_filter = (args.create_cuckoo_filter or args.create_cuckoo_filter_bit or args.create_cuckoo_filter_array or
+                     args.create_cuckoo_filter_semisort or args.create_bloom_filter or args.create_xor_filter)
+    if args.tree_dir and builds_filter:
+        parser.error("--tree-dir saves trees only, use --save alone for a filter")
     return args
 
 if __name__ == "__main__":
@@ -0,0 +1,275 @@
+"""
+Description: Contains the multi-process construction of the Bloom and Cuckoo filters
+
+Both builders split every input file into byte ranges, one per worker (see
+fastq.split_byte_ranges), so each worker parses and hashes its own part of the data:
+
+    Bloom --> every worker fills a full-size filter from its ranges and the
+              filters are OR-merged into the result
+    Cuckoo --> the filter is a ShardedCuckooFilter with one shard per worker.
+               Workers first hash their ranges and write the (fingerprint, bucket)
+               pairs of every shard to a temporary file, then each worker fills
+               one shard from the pairs written for it.
+
+Queries run the other way around: ParallelQueryExecutor copies the tables of a
+built sketch once into shared memory, every worker rebuilds a read-only sketch
+around them, and batches of queries are spread over the workers.
+"""
+import os
+import time
+import tempfile
+import numpy as np
+from multiprocessing import Pool, shared_memory
+import serialization
+from bloom_filter import BloomFilter
+from cuckoo_filter import ShardedCuckooFilter
+from fastq import split_byte_ranges, stream_sequence_range
+from kmers import KmerItems, packed_kmer_array, encode_queries
+
+BATCH_SIZE = 1 << 16
+
+
+def get_worker_ranges(filenames, workers):
+    """
+    Returns, for every worker, the list of (filename, start, end) ranges it reads
+    """
+    ranges = [[] for i in range(workers)]
+    for filename in filenames:
+        for worker, (start, end) in enumerate(split_byte_ranges(filename, workers)):
+            ranges[worker].append((filename, start, end))
+    return ranges
+
+
+def stream_item_batches(ranges, k, canonical):
+    """
+    Yields the items of some byte ranges in batches of about BATCH_SIZE items:
+    packed k-mer arrays when k > 0, lists of whole reads otherwise
+    """
+    batch = []
+    batch_items = 0
+    for filename, start, end in ranges:
+        for read_line in stream_sequence_range(filename, start, end):
+            if k == 0:
+                batch.append(read_line)
+                batch_items += 1
+            else:
+                kmers = packed_kmer_array(read_line, k, canonical)
+                batch.append(kmers)
+                batch_items += len(kmers)
+            if batch_items >= BATCH_SIZE:
+                yield join_batch(batch, k)
+                batch = []
+                batch_items = 0
+    if batch:
+        yield join_batch(batch, k)
+
+
+def join_batch(batch, k):
+    # The k-mer arrays of a batch of reads become one array
+    return batch if k == 0 else np.concatenate(batch)
+
+
+def build_bloom_part(args):
+    ranges, expected_num, fp_prob, k, canonical = args
+    bloom = BloomFilter(expected_num, fp_prob)
+    items = 0
+    for batch in stream_item_batches(ranges, k, canonical):
+        bloom.insert_many(batch)
+        items += len(batch)
+    return bloom.filter.tobytes(), items
+
+
+def build_bloom_filter(filenames, expected_num, fp_prob, k=0, canonical=False, workers=2):
+    """
+    Builds a BloomFilter with several processes. Returns the filter and the number of items inserted.
+    """
+    bloom = BloomFilter(expected_num, fp_prob)
+    bits = bloom.get_bytes_view()
+    items = 0
+    tasks = [(ranges, expected_num, fp_prob, k, canonical) for ranges in get_worker_ranges(filenames, workers)]
+    with Pool(workers) as pool:
+        for part, part_items in pool.imap_unordered(build_bloom_part, tasks):
+            np.bitwise_or(bits, np.frombuffer(part, dtype=np.uint8), out=bits)
+            items += part_items
+    return bloom, items
+
+
+def get_pairs_path(directory, worker, shard):
+    return os.path.join(directory, "worker{}.shard{}.bin".format(worker, shard))
+
+
+def hash_cuckoo_part(args):
+    """
+    First pass of build_cuckoo_filter: hashes the items of one worker's ranges and
+    appends their (fingerprint, index) pairs to one file per shard
+    """
+    worker, ranges, template, k, canonical, directory = args
+    files = [open(get_pairs_path(directory, worker, shard), "wb") for shard in range(template.num_shards)]
+    try:
+        for batch in stream_item_batches(ranges, k, canonical):
+            if len(batch) == 0:
+                continue
+            fingerprints, indices, shards = template.hash_family.split_shards_array(
+                batch, template.fp_mask, template.shard_buckets, template.num_shards)
+            pairs = np.stack([fingerprints, indices], axis=1)
+            for shard in np.unique(shards).tolist():
+                pairs[shards == shard].tofile(files[shard])
+    finally:
+        for f in files:
+            f.close()
+
+
+def fill_cuckoo_shard(args):
+    """
+    Second pass of build_cuckoo_filter: fills one shard from the pairs every worker
+    wrote for it. Like the single process build, it stops at the first failed insert.
+    """
+    shard_number, template, workers, directory = args
+    shard = template.new_shard()
+    for worker in range(workers):
+        pairs = np.fromfile(get_pairs_path(directory, worker, shard_number), dtype=np.uint64).reshape(-1, 2)
+        fingerprints, index_one = pairs[:, 0], pairs[:, 1]
+        index_two = shard.get_alt_index_array(index_one, fingerprints)
+        for fingerprint, i1, i2 in zip(fingerprints.tolist(), index_one.tolist(), index_two.tolist()):
+            if not shard.insert_fingerprint(fingerprint, i1, i2):
+                return shard
+    return shard
+
+
+def build_cuckoo_filter(filenames, shard_class, num_buckets, fp_size, bucket_size, max_iter, hash_family,
+                        bfs_depth=0, k=0, canonical=False, workers=2):
+    """
+    Builds a ShardedCuckooFilter of shard_class shards with several processes, one
+    shard per worker. A shard that fills up stops taking items, see fill_cuckoo_shard.
+    """
+    template = ShardedCuckooFilter(workers, num_buckets, fp_size, bucket_size, max_iter, hash_family, bfs_depth,
+                                   shard_class, shards=[])
+    with tempfile.TemporaryDirectory() as directory, Pool(workers) as pool:
+        pool.map(hash_cuckoo_part, [(worker, ranges, template, k, canonical, directory)
+                                    for worker, ranges in enumerate(get_worker_ranges(filenames, workers))])
+        shards = pool.map(fill_cuckoo_shard, [(shard, template, workers, directory) for shard in range(workers)])
+    return ShardedCuckooFilter(workers, num_buckets, fp_size, bucket_size, max_iter, hash_family, bfs_depth,
+                               shard_class, shards)
+
+
+class SharedSketch:
+
+    def __init__(self, sketch):
+        """
+        Copies the tables of a sketch (see serialization.Serializable.get_state)
+        into one shared memory block.
+
+            descriptor --> what a worker needs to attach, see attach_shared_sketch
+        """
+        params, sections = sketch.get_state()
+        sections = {name: np.ascontiguousarray(array) for name, array in sections.items()}
+        layout, size = serialization.get_layout(sections)
+        self.memory = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        for entry, array in zip(layout, sections.values()):
+            self.memory.buf[entry["offset"]:entry["offset"] + array.nbytes] = memoryview(array).cast("B")
+        self.descriptor = (type(sketch).__name__, params, layout, self.memory.name)
+
+    def close(self):
+        self.memory.close()
+        self.memory.unlink()
+
+
+def attach_shared_sketch(descriptor):
+    """
+    Rebuilds a sketch on top of the tables of a SharedSketch, without copying them.
+    Returns the shared memory handle, which must stay open, and the sketch.
+    """
+    kind, params, layout, name = descriptor
+    memory = shared_memory.SharedMemory(name=name)
+    sections = serialization.sections_from_buffer(memory.buf, layout)
+    sketch_class = serialization.SKETCH_TYPES[kind]
+    try:
+        sketch = sketch_class.from_state(params, sections)
+    except ValueError:
+        # Filters made of Python lists of buckets cannot use shared tables, they parse their own copy
+        sketch = sketch_class.from_state(params, {name: array.copy() for name, array in sections.items()})
+    return memory, sketch
+
+
+# The sketch of a query worker process, set by init_query_worker
+worker_sketch = None
+
+
+def init_query_worker(descriptor):
+    global worker_sketch
+    worker_sketch = attach_shared_sketch(descriptor)
+
+
+def query_batch(queries):
+    """
+    Answers one batch in a worker. Returns the worker pid, the results and the time spent.
+    """
+    sketch = worker_sketch[1]
+    start = time.perf_counter()
+    if isinstance(sketch, KmerItems):
+        queries = encode_queries(queries, sketch.k, sketch.canonical)
+    if hasattr(sketch, "query_many"):
+        results = sketch.query_many(queries)
+    elif hasattr(sketch, "contains_many"):
+        results = sketch.contains_many(queries).tolist()
+    else:
+        results = [sketch.contains(query) for query in queries]
+    return os.getpid(), results, time.perf_counter() - start
+
+
+class ParallelQueryExecutor:
+
+    def __init__(self, sketch, workers=2, batch_size=1024):
+        """
+        Answers queries against a built sketch with a pool of worker processes
+        that share its tables. Use it as a context manager, or call close().
+
+            batch_size --> number of queries sent to a worker at a time
+            worker_stats --> for every worker pid, [queries answered, seconds spent answering]
+        """
+        self.batch_size = batch_size
+        self.shared = SharedSketch(sketch)
+        self.pool = Pool(workers, initializer=init_query_worker, initargs=(self.shared.descriptor,))
+        self.worker_stats = {}
+        self.num_queries = 0
+        self.elapsed = 0.0
+
+    def query(self, queries):
+        """
+        Returns the result of contains for every query, in input order
+        """
+        queries = list(queries)
+        batches = [queries[i:i + self.batch_size] for i in range(0, len(queries), self.batch_size)]
+        results = []
+        start = time.perf_counter()
+        for pid, batch_results, seconds in self.pool.imap(query_batch, batches):
+            stats = self.worker_stats.setdefault(pid, [0, 0.0])
+            stats[0] += len(batch_results)
+            stats[1] += seconds
+            results.extend(batch_results)
+        self.elapsed += time.perf_counter() - start
+        self.num_queries += len(queries)
+        return results
+
+    def get_throughput(self):
+        """
+        Returns the aggregate throughput, queries answered per second of wall-clock time
+        """
+        return self.num_queries / self.elapsed if self.elapsed > 0 else 0.0
+
+    def get_worker_throughput(self):
+        """
+        Returns the throughput of every worker, queries per second it spent answering
+        """
+        return [queries / seconds if seconds > 0 else 0.0 for queries, seconds in self.worker_stats.values()]
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        self.shared.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -1,10 +1,15 @@
+from array import array
+from kmers import packed_kmers
+
 
 class Read:
     """
     This class represents the sequencing reads parsed from input files.
-    For each read, we store its Id, actual sequence and the qualiry of 
+    For each read, we store its Id, actual sequence and the qualiry of
     the read alongside the filename.
     """
+    __slots__ = ("filename", "id", "read_ptr", "line", "quality")
+
     def __init__(self, filename, read_id, read_ptr, line, quality):
         self.filename = filename
         self.id = read_id
@@ -16,5 +21,91 @@ class Read:
         for i in range(len(self.line) - k + 1):
             yield self.line[i:i+k]
 
+    def packed_kmers(self, k: int):
+        return packed_kmers(self.line, k)
+
     def __repr__(self) -> str:
-        return "{}({}): {}\t {}\n\t\t\t\t{}".format(self.filename, self.read_ptr, self.id, self.line, self.quality)
\ No newline at end of file
+        return "{}({}): {}\t {}\n\t\t\t\t{}".format(self.filename, self.read_ptr, self.id, self.line, self.quality)
+
+
+class StringColumn:
+    """
+    Stores many ASCII strings back to back in one contiguous buffer, with an
+    offsets array marking where each string starts and ends.
+    """
+    __slots__ = ("buffer", "offsets")
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.offsets = array("Q", [0])
+
+    def append(self, value: str) -> None:
+        self.buffer += value.encode("ascii")
+        self.offsets.append(len(self.buffer))
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i: int) -> str:
+        return self.buffer[self.offsets[i]:self.offsets[i + 1]].decode("ascii")
+
+    def get_size(self):
+        return self.buffer.__sizeof__() + self.offsets.__sizeof__()
+
+
+class ReadBatch:
+
+    def __init__(self, filename, keep_ids=False, keep_quality=False):
+        """
+        Columnar container for the reads of one dataset.
+
+            filename --> the dataset the reads were parsed from
+            sequences --> StringColumn holding every read sequence
+            ids --> StringColumn of read ids, None unless keep_ids is set
+            qualities --> StringColumn of quality lines, None unless keep_quality is set
+        """
+        self.filename = filename
+        self.sequences = StringColumn()
+        self.ids = StringColumn() if keep_ids else None
+        self.qualities = StringColumn() if keep_quality else None
+
+    def append(self, line, read_id=None, quality=None) -> None:
+        self.sequences.append(line)
+        if self.ids is not None:
+            self.ids.append(read_id)
+        if self.qualities is not None:
+            self.qualities.append(quality)
+
+    def __len__(self) -> int:
+        return len(self.sequences)
+
+    def __getitem__(self, i: int) -> Read:
+        """
+        Returns a Read view of the i-th record, built on demand
+        """
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("read index out of range")
+        read_id = self.ids[i] if self.ids is not None else None
+        quality = self.qualities[i] if self.qualities is not None else None
+        return Read(self.filename, read_id, i, self.sequences[i], quality)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def iter_sequences(self):
+        for i in range(len(self)):
+            yield self.sequences[i]
+
+    def get_size(self):
+        """
+        Returns the total number of bytes occupied by the batch buffers
+        """
+        size = self.sequences.get_size()
+        if self.ids is not None:
+            size += self.ids.get_size()
+        if self.qualities is not None:
+            size += self.qualities.get_size()
+        return size
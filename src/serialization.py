@@ -0,0 +1,350 @@
+"""
+Description: Contains the versioned binary format used to save and load the sketches
+
+A saved sketch is laid out as
+
+    header --> MAGIC, FORMAT_VERSION, flags and the length of the JSON metadata
+    metadata --> UTF-8 JSON with the sketch class, its parameters and the section layout
+    sections --> raw tables (bit arrays, fingerprint slots, counters), each one
+                 starting on an ALIGNMENT byte boundary of the file
+
+so every table can be read back with a single copy, or mapped in place.
+
+Mapped sketches (mapped=True) are query-only: their tables are read-only views
+of the file, shared by every process through the page cache.
+
+A tree can also be saved as a directory, a JSON manifest with the topology plus one
+sketch file per node filter (save_tree_directory), and loaded lazily: its node filters
+are read when a query first reaches them and held in a bounded LRU cache.
+"""
+import json
+import mmap
+import os
+import struct
+import numpy as np
+from collections import OrderedDict
+from bitarray import bitarray
+
+MAGIC = b"CKSKETCH"
+FORMAT_VERSION = 1
+ALIGNMENT = 64
+HEADER = struct.Struct("<8sHHQ")
+MANIFEST_NAME = "manifest.json"
+NODE_CACHE_SIZE = 64
+
+# Every Serializable subclass, by class name, so a file can be loaded without knowing its kind
+SKETCH_TYPES = {}
+
+
+def align(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def write_sketch(path, kind, params, sections):
+    """
+    Writes one sketch file.
+
+        kind --> class name of the sketch, used to pick the loader
+        params --> JSON-serializable dict of parameters
+        sections --> dict from section name to a NumPy array, written raw
+    """
+    sections = {name: np.ascontiguousarray(array) for name, array in sections.items()}
+    layout, size = get_layout(sections)
+    metadata = json.dumps({"kind": kind, "params": params, "sections": layout}).encode("utf-8")
+    data_start = align(HEADER.size + len(metadata))
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, FORMAT_VERSION, 0, len(metadata)))
+        f.write(metadata)
+        for entry, array in zip(layout, sections.values()):
+            f.seek(data_start + entry["offset"])
+            f.write(array.tobytes())
+        f.truncate(data_start + size)
+
+
+def get_layout(sections):
+    """
+    Places the sections one after the other, each on an ALIGNMENT boundary.
+    Returns the list of section entries (name, offset, dtype, shape) and the total size.
+    """
+    layout = []
+    offset = 0
+    for name, array in sections.items():
+        offset = align(offset)
+        layout.append({"name": name, "offset": offset, "dtype": array.dtype.str, "shape": list(array.shape)})
+        offset += array.nbytes
+    return layout, offset
+
+
+def sections_from_buffer(buffer, layout, start=0):
+    """
+    Returns read-only NumPy views of the sections laid out in a buffer from byte start
+    """
+    sections = {}
+    for entry in layout:
+        dtype = np.dtype(entry["dtype"])
+        count = int(np.prod(entry["shape"], dtype=np.int64))
+        section = np.frombuffer(buffer, dtype=dtype, count=count, offset=start + entry["offset"])
+        section.flags.writeable = False
+        sections[entry["name"]] = section.reshape(entry["shape"])
+    return sections
+
+
+def read_metadata(f):
+    magic, version, _, metadata_size = HEADER.unpack(f.read(HEADER.size))
+    if magic != MAGIC:
+        raise ValueError("{} is not a saved sketch".format(f.name))
+    if version > FORMAT_VERSION:
+        raise ValueError("{} uses format version {}, this code reads up to {}".format(f.name, version, FORMAT_VERSION))
+    metadata = json.loads(f.read(metadata_size).decode("utf-8"))
+    return metadata, align(HEADER.size + metadata_size)
+
+
+def read_sketch(path, mapped=False):
+    """
+    Reads one sketch file. Returns the kind, the parameters and a dict from
+    section name to NumPy array. With mapped set, the arrays are read-only
+    views of a memory map of the file instead of copies.
+    """
+    with open(path, "rb") as f:
+        metadata, data_start = read_metadata(f)
+        if mapped:
+            # The map keeps its own reference to the file, and each view keeps the map alive
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            return metadata["kind"], metadata["params"], sections_from_buffer(buffer, metadata["sections"], data_start)
+        sections = {}
+        for entry in metadata["sections"]:
+            f.seek(data_start + entry["offset"])
+            count = int(np.prod(entry["shape"], dtype=np.int64))
+            sections[entry["name"]] = np.fromfile(f, dtype=entry["dtype"], count=count).reshape(entry["shape"])
+    return metadata["kind"], metadata["params"], sections
+
+
+def load_sketch(path, mapped=False):
+    """
+    Loads a saved sketch of any kind, see read_sketch for mapped
+    """
+    kind, params, sections = read_sketch(path, mapped)
+    if kind not in SKETCH_TYPES:
+        raise ValueError("Unknown sketch kind {} in {}".format(kind, path))
+    return SKETCH_TYPES[kind].from_state(params, sections)
+
+
+def bitarray_section(bits):
+    """
+    Returns the bytes of a bitarray as a uint8 array, without copying
+    """
+    return np.frombuffer(bits, dtype=np.uint8)
+
+
+def bitarray_from_section(section, nbits, endian):
+    """
+    Turns a saved byte section back into a bitarray of nbits. A read-only
+    (mapped) section is wrapped without copying, keeping its padding bits.
+    """
+    if not section.flags.writeable:
+        return bitarray(buffer=section, endian=endian)
+    bits = bitarray(endian=endian)
+    bits.frombytes(section.tobytes())
+    del bits[nbits:]
+    return bits
+
+
+def prefix_sections(prefix, sections):
+    return {prefix + name: array for name, array in sections.items()}
+
+
+def group_sections(sections):
+    """
+    Splits "<group>.<name>" section names, returning a dict of dicts by group
+    """
+    groups = {}
+    for name, array in sections.items():
+        group, _, inner_name = name.partition(".")
+        groups.setdefault(group, {})[inner_name] = array
+    return groups
+
+
+def tree_state(root, params):
+    """
+    Flattens a tree in breadth-first order. Every node is stored as its dataset id,
+    the indices of its children and the parameters of its filter, whose sections
+    are prefixed with "node<index>.".
+    """
+    order = [root] if root is not None else []
+    for node in order:
+        order.extend(node.children)
+    indices = {id(node): i for i, node in enumerate(order)}
+    nodes = []
+    sections = {}
+    for i, node in enumerate(order):
+        filter_params, filter_sections = node.filter.get_state()
+        nodes.append({"dataset_id": node.dataset_id,
+                      "children": [indices[id(child)] for child in node.children],
+                      "filter": filter_params})
+        sections.update(prefix_sections("node{}.".format(i), filter_sections))
+    params = dict(params, nodes=nodes)
+    return params, sections
+
+
+def tree_root_from_state(params, sections, make_node):
+    """
+    Rebuilds the nodes saved by tree_state and links them. make_node(node_params,
+    node_sections) creates one unlinked node. Returns the root, None for an empty tree.
+    """
+    groups = group_sections(sections)
+    nodes = []
+    for i, node_params in enumerate(params["nodes"]):
+        node = make_node(node_params, groups.get("node{}".format(i), {}))
+        node.dataset_id = node_params["dataset_id"]
+        nodes.append(node)
+    for node, node_params in zip(nodes, params["nodes"]):
+        for child in node_params["children"]:
+            nodes[child].parent = node
+            node.children.append(nodes[child])
+    return nodes[0] if nodes else None
+
+
+def save_tree_directory(tree, path):
+    """
+    Saves a tree as a directory: MANIFEST_NAME holds the tree kind, its parameters and
+    the topology of tree_state, and every node filter is a sketch file of its own, so
+    load_tree_directory can read the nodes one at a time.
+    """
+    params, sections = tree.get_state()
+    if "nodes" not in params:
+        raise ValueError("Only trees can be saved as a directory, {} is not one".format(type(tree).__name__))
+    groups = group_sections(sections)
+    os.makedirs(path, exist_ok=True)
+    for i, node_params in enumerate(params["nodes"]):
+        node_params["file"] = "node{}.bin".format(i)
+        write_sketch(os.path.join(path, node_params["file"]), "{}.node".format(type(tree).__name__),
+                     node_params["filter"], groups.get("node{}".format(i), {}))
+    with open(os.path.join(path, MANIFEST_NAME), "w") as f:
+        json.dump({"version": FORMAT_VERSION, "kind": type(tree).__name__, "params": params}, f)
+
+
+def load_tree_directory(path, cache_size=NODE_CACHE_SIZE, mapped=False):
+    """
+    Loads the topology of a tree saved with save_tree_directory. The node filters are
+    read on first use and kept in a NodeCache of cache_size filters (tree.node_cache),
+    so a query only reads the nodes on the paths it explores. The tree is query-only.
+    """
+    with open(os.path.join(path, MANIFEST_NAME)) as f:
+        manifest = json.load(f)
+    if manifest.get("version", 0) > FORMAT_VERSION:
+        raise ValueError("{} uses format version {}, this code reads up to {}".format(path, manifest["version"],
+                                                                                      FORMAT_VERSION))
+    if manifest.get("kind") not in SKETCH_TYPES:
+        raise ValueError("Unknown sketch kind {} in {}".format(manifest.get("kind"), path))
+    params = manifest["params"]
+    tree = SKETCH_TYPES[manifest["kind"]].from_state(dict(params, nodes=[]), {})
+    nodes_by_file = {node_params["file"]: node_params for node_params in params["nodes"]}
+
+    def load_filter(file):
+        _, _, node_sections = read_sketch(os.path.join(path, file), mapped)
+        return tree.load_node(nodes_by_file[file], node_sections).filter
+
+    tree.node_cache = NodeCache(load_filter, cache_size)
+    tree.root = tree_root_from_state(params, {}, lambda node_params, _: tree.new_node(
+        LazyFilter(tree.node_cache, node_params["file"])))
+    return tree
+
+
+class NodeCache:
+
+    def __init__(self, load, capacity):
+        """
+        Least recently used cache of the node filters of a tree loaded with load_tree_directory.
+
+            load --> reads the filter of a node, given its key
+            capacity --> most filters kept in memory at once
+        """
+        if capacity < 1:
+            raise ValueError("The node cache must hold at least one filter")
+        self.load = load
+        self.capacity = capacity
+        self.filters = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        """
+        Returns the filter of a node for one visit, counted as a hit or a miss
+        """
+        if key in self.filters:
+            self.hits += 1
+            self.filters.move_to_end(key)
+            return self.filters[key]
+        self.misses += 1
+        node_filter = self.load(key)
+        self.filters[key] = node_filter
+        if len(self.filters) > self.capacity:
+            self.filters.popitem(last=False)
+        return node_filter
+
+    def peek(self, key):
+        """
+        Returns the filter of a node without counting a visit, loading it only when missing
+        """
+        if key in self.filters:
+            return self.filters[key]
+        return self.get(key)
+
+
+class LazyFilter:
+
+    def __init__(self, cache, key):
+        """
+        Stands in for the filter of a node loaded with load_tree_directory. Traversals
+        fetch the filter once per node visit with get (see resolve_filter), any other
+        attribute is looked up on the filter held by the NodeCache, loading it if needed.
+        """
+        self.cache = cache
+        self.key = key
+
+    def get(self):
+        return self.cache.get(self.key)
+
+    def __getattr__(self, name):
+        if name in ("cache", "key"):
+            # Not set yet, e.g. while copy or pickle rebuild the object
+            raise AttributeError(name)
+        return getattr(self.cache.peek(self.key), name)
+
+
+def resolve_filter(node_filter):
+    """
+    Returns the filter a tree node holds: node_filter itself, or the filter a LazyFilter
+    stands for, fetched once so the probes of a node visit do not go through the cache
+    """
+    return node_filter.get() if isinstance(node_filter, LazyFilter) else node_filter
+
+
+class Serializable:
+    """
+    Adds save and load to a sketch. Subclasses implement get_state, returning a
+    dict of parameters and a dict of NumPy sections, and the from_state classmethod.
+    """
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        SKETCH_TYPES[cls.__name__] = cls
+
+    def save(self, path):
+        params, sections = self.get_state()
+        write_sketch(path, type(self).__name__, params, sections)
+
+    def clone(self):
+        """
+        Returns an independent copy, rebuilt from copies of the get_state tables
+        """
+        params, sections = self.get_state()
+        return type(self).from_state(json.loads(json.dumps(params)),
+                                     {name: np.array(section) for name, section in sections.items()})
+
+    @classmethod
+    def load(cls, path, mapped=False):
+        sketch = load_sketch(path, mapped)
+        if not isinstance(sketch, cls):
+            raise ValueError("{} holds a {}, not a {}".format(path, type(sketch).__name__, cls.__name__))
+        return sketch
@@ -0,0 +1,233 @@
+"""
+Description: Contains the long-running query server (main.py --serve)
+
+The sketch is loaded or built once, then queries arrive over a Unix or TCP socket,
+one per line. Requests of all connections are coalesced into batches, so a sketch
+with a bulk lookup (contains_many, or query_many for trees) answers a whole batch at once.
+A flat filter built with -k gets its k-mer queries encoded like its items, see kmers.encode_query.
+
+One line per request and one line per response, in request order:
+
+    SEQUENCE --> "1" or "0" for a filter, the space separated matching dataset ids for a tree
+    STATS --> the counters of ServerStats as one JSON object
+    QUIT --> closes the connection
+"""
+import asyncio
+import json
+import time
+from collections import deque
+from kmers import KmerItems, encode_queries
+
+MAX_BATCH = 4096
+MAX_DELAY = 0.001
+LATENCY_WINDOW = 10000
+
+
+class ServerStats:
+
+    def __init__(self):
+        """
+        Latency and throughput counters of a QueryServer.
+
+            latencies --> seconds from arrival to answer of the last LATENCY_WINDOW queries
+        """
+        self.start = time.perf_counter()
+        self.num_queries = 0
+        self.num_batches = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def record_batch(self, arrivals, finished):
+        self.num_batches += 1
+        self.num_queries += len(arrivals)
+        for arrival in arrivals:
+            latency = finished - arrival
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+            self.latencies.append(latency)
+
+    def get_stats(self):
+        uptime = time.perf_counter() - self.start
+        recent = sorted(self.latencies)
+        return {
+            "queries": self.num_queries,
+            "batches": self.num_batches,
+            "mean_batch_size": self.num_queries / self.num_batches if self.num_batches else 0.0,
+            "throughput": self.num_queries / uptime if uptime > 0 else 0.0,
+            "mean_latency_ms": 1000 * self.total_latency / self.num_queries if self.num_queries else 0.0,
+            "p50_latency_ms": 1000 * percentile(recent, 0.5),
+            "p99_latency_ms": 1000 * percentile(recent, 0.99),
+            "max_latency_ms": 1000 * self.max_latency,
+            "uptime": uptime
+        }
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+def parse_address(address):
+    """
+    Returns (host, port) for a HOST:PORT address, (path, None) for a Unix socket path
+    """
+    host, _, port = address.rpartition(":")
+    if host and port.isdigit():
+        return host, int(port)
+    return address, None
+
+
+def format_result(result):
+    if isinstance(result, str):
+        return result
+    if isinstance(result, list):
+        return " ".join(result)
+    return "1" if result else "0"
+
+
+class QueryServer:
+
+    def __init__(self, sketch, max_batch=MAX_BATCH, max_delay=MAX_DELAY):
+        """
+        Serves the queries of every connection from one sketch.
+
+            max_batch --> most queries answered by one lookup
+            max_delay --> seconds the first query of a batch waits for others to join it
+        """
+        self.sketch = sketch
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.stats = ServerStats()
+        self.pending = None
+        self.batcher = None
+        self.server = None
+        self.clients = set()
+
+    def lookup(self, queries):
+        if hasattr(self.sketch, "query_many"):
+            return self.sketch.query_many(queries)
+        if isinstance(self.sketch, KmerItems):
+            queries = encode_queries(queries, self.sketch.k, self.sketch.canonical)
+        if hasattr(self.sketch, "contains_many"):
+            return self.sketch.contains_many(queries).tolist()
+        return [self.sketch.contains(query) for query in queries]
+
+    def submit(self, query):
+        """
+        Queues a query for the next batch. Returns the future of its result.
+        """
+        future = asyncio.get_running_loop().create_future()
+        self.pending.put_nowait((query, time.perf_counter(), future))
+        return future
+
+    async def run_batches(self):
+        while True:
+            batch = [await self.pending.get()]
+            if self.pending.qsize() < self.max_batch - 1:
+                await asyncio.sleep(self.max_delay)
+            while len(batch) < self.max_batch and not self.pending.empty():
+                batch.append(self.pending.get_nowait())
+            try:
+                results = self.lookup([query for query, _, _ in batch])
+            except Exception as error:
+                for _, _, future in batch:
+                    future.set_exception(error)
+                continue
+            finished = time.perf_counter()
+            for (_, _, future), result in zip(batch, results):
+                future.set_result(result)
+            self.stats.record_batch([arrival for _, arrival, _ in batch], finished)
+
+    async def handle_client(self, reader, writer):
+        self.clients.add(asyncio.current_task())
+        replies = asyncio.Queue()
+        sender = asyncio.ensure_future(self.send_replies(replies, writer))
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request = line.decode().strip()
+                if request == "QUIT":
+                    break
+                if not request:
+                    continue
+                replies.put_nowait(self.stats.get_stats if request == "STATS" else self.submit(request))
+        except ConnectionError:
+            # The client went away, the queries it already sent are still answered
+            pass
+        finally:
+            replies.put_nowait(None)
+            try:
+                await sender
+            finally:
+                writer.close()
+                try:
+                    await writer.wait_closed()
+                except ConnectionError:
+                    pass
+                self.clients.discard(asyncio.current_task())
+
+    async def send_replies(self, replies, writer):
+        """
+        Writes the replies of one connection in request order. A STATS reply is
+        taken once the queries before it are answered. Once the client is gone,
+        the remaining replies are taken from the queue without being written.
+        """
+        connected = True
+        while True:
+            reply = await replies.get()
+            if reply is None:
+                return
+            try:
+                line = json.dumps(reply()) if callable(reply) else format_result(await reply)
+            except Exception as error:
+                line = "ERROR {}".format(error)
+            if not connected:
+                continue
+            try:
+                if writer.is_closing():
+                    raise ConnectionResetError("The client closed the connection")
+                writer.write(line.encode() + b"\n")
+                if replies.empty():
+                    await writer.drain()
+            except ConnectionError:
+                connected = False
+
+    async def start(self, address):
+        """
+        Starts listening on address, a Unix socket path or HOST:PORT
+        """
+        self.pending = asyncio.Queue()
+        self.batcher = asyncio.ensure_future(self.run_batches())
+        host, port = parse_address(address)
+        if port is None:
+            self.server = await asyncio.start_unix_server(self.handle_client, path=host)
+        else:
+            self.server = await asyncio.start_server(self.handle_client, host, port)
+        return self.server
+
+    async def close(self):
+        self.server.close()
+        await self.server.wait_closed()
+        await asyncio.gather(*self.clients, return_exceptions=True)
+        self.batcher.cancel()
+
+    async def serve_forever(self, address):
+        await self.start(address)
+        try:
+            await self.server.serve_forever()
+        finally:
+            await self.close()
+
+
+def serve(sketch, address):
+    """
+    Serves queries against sketch until interrupted
+    """
+    try:
+        asyncio.run(QueryServer(sketch).serve_forever(address))
+    except KeyboardInterrupt:
+        pass
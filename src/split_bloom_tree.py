@@ -0,0 +1,366 @@
+"""
+Description: Contains the Split Sequence Bloom Tree, a HowDeSBT-style variant of BloomTree
+
+Instead of the union Bloom filter of its datasets, every node keeps two bitvectors
+over the bit positions its parent left undetermined:
+
+    det --> 1 where the position is determined at this node: it is set in every
+            dataset below (present) or in none of them (absent)
+    how --> for every determined position, in det order, 1 when present, 0 when absent
+
+The children of a node only store the positions undetermined at their parent,
+so every position is stored once per path, and a leaf determines all of its
+remaining positions (it has no det). A position of a node maps to its index
+below by subtracting the number of set det bits before it, read from a rank
+directory. Queries follow the positions of each k-mer down the tree and stop
+probing as soon as theta is met by k-mers resolved present in every dataset below.
+"""
+import sys
+from collections import deque
+from typing import List, Optional, Deque
+import numpy as np
+from bitarray import bitarray
+from bloom_filter import get_positions_array
+from bloom_tree import BloomTree
+from kmers import kmerizer
+from read import Read
+import serialization
+
+# Number of set bits of every byte value
+POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.int64)
+RANK_BLOCK_BITS = 64
+
+
+def bits_to_bools(bits):
+    """
+    Returns a bitarray as a NumPy boolean array
+    """
+    data = np.frombuffer(bits, dtype=np.uint8)
+    return np.unpackbits(data, count=len(bits), bitorder=bits.endian).astype(bool)
+
+
+def bools_to_bits(bools, multiple=1):
+    """
+    Returns a NumPy boolean array as a little-endian bitarray, padded with zeros
+    to a multiple of the given number of bits
+    """
+    bits = bitarray(endian="little")
+    bits.frombytes(np.packbits(bools, bitorder="little").tobytes())
+    del bits[len(bools):]
+    bits.extend([0] * (-len(bools) % multiple))
+    return bits
+
+
+def count_word_bits(words):
+    """
+    Returns the number of set bits of every uint64 word
+    """
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(words)
+    return POPCOUNT[words.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def get_rank_directory(bits):
+    """
+    Returns the number of set bits before every RANK_BLOCK_BITS word of a little-endian
+    bitarray holding a whole number of words
+    """
+    block_counts = count_word_bits(np.frombuffer(bits, dtype="<u8"))
+    return np.concatenate([[0], np.cumsum(block_counts)[:-1]]).astype(np.uint32)
+
+
+def get_bits(bits, positions):
+    """
+    Returns the bits of a little-endian bitarray at an array of positions
+    """
+    data = np.frombuffer(bits, dtype=np.uint8)
+    return (data[positions >> 3] >> (positions & 7).astype(np.uint8)) & 1 == 1
+
+
+def get_ranks(bits, directory, positions):
+    """
+    Returns the number of set bits before each position, from the rank directory of get_rank_directory
+    """
+    words = positions // RANK_BLOCK_BITS
+    low_bits = np.left_shift(np.uint64(1), (positions % RANK_BLOCK_BITS).astype(np.uint64)) - np.uint64(1)
+    masked = np.frombuffer(bits, dtype="<u8")[words] & low_bits
+    return directory[words].astype(np.int64) + count_word_bits(masked)
+
+
+class SplitBloomTree(serialization.Serializable):
+
+    def __init__(self, theta, k, expected_num, fp_prob, packed=False, canonical=False):
+        """
+        Split Sequence Bloom Tree. Datasets are inserted into a BloomTree that decides
+        the topology, then build() splits its union filters into det/how bitvectors
+        and drops them. A built tree answers queries but takes no more datasets.
+        :param theta: Parameter to determine strictness of querying
+        :param k: Size of kmer
+        :param expected_num: Bloom Filter parameter
+        :param fp_prob: Bloom Filter parameter
+        :param packed: Use 2-bit packed integer k-mers instead of string slices
+        :param canonical: Treat a k-mer and its reverse complement as the same item
+        """
+        self.root: Optional[Node] = None
+        self.theta: float = theta
+        self.k: int = k
+        self.packed = packed
+        self.canonical = canonical
+        self.kmerize = kmerizer(k, packed, canonical)
+        self.expected_num = expected_num
+        self.fp_prob = fp_prob
+        self.staging: Optional[BloomTree] = BloomTree(theta, k, expected_num, fp_prob, packed, canonical)
+        self.num_hashes = 0
+        self.bloom_size = 0
+        self.aggregate_size = self.get_insternal_size()
+
+    def insert(self, dataset: List[Read]) -> bool:
+        """
+        Adds a dataset to the tree being built
+        :return: None
+        """
+        if self.staging is None:
+            raise ValueError("A built SplitBloomTree takes no more datasets, create a new tree to add them")
+        return self.staging.insert(dataset)
+
+    def build_bulk(self, datasets: List[List[Read]], workers: int = 1) -> None:
+        """
+        Builds the tree from a known batch of datasets at once: the union tree is built
+        bottom-up (see BloomTree.build_bulk), then split as build does
+        :param datasets: The reads of every dataset
+        :param workers: Number of processes building the leaves
+        :return: None
+        """
+        if self.staging is None:
+            raise ValueError("A built SplitBloomTree takes no more datasets, create a new tree to add them")
+        self.staging.build_bulk(datasets, workers)
+        self.build()
+
+    def build(self) -> None:
+        """
+        Splits the union filters of the inserted datasets into the det/how bitvectors
+        of every node. Does nothing once built.
+        """
+        if self.staging is None:
+            return
+        union_root = self.staging.root
+        self.staging = None
+        if union_root is None:
+            return
+        self.bloom_size = union_root.filter.size
+        self.num_hashes = union_root.filter.num_hashes
+
+        order = [union_root]
+        for union_node in order:
+            order.extend(union_node.children)
+
+        # Bits set in every dataset below each node, children first
+        all_bits = {}
+        for union_node in reversed(order):
+            if union_node.num_children() == 0:
+                all_bits[id(union_node)] = union_node.filter.filter
+            else:
+                intersection = bitarray(all_bits[id(union_node.children[0])])
+                for child in union_node.children[1:]:
+                    intersection &= all_bits[id(child)]
+                all_bits[id(union_node)] = intersection
+
+        nodes = {}
+        active = {id(union_root): np.ones(self.bloom_size, dtype=bool)}
+        for union_node in order:
+            node_active = active.pop(id(union_node))
+            some = bits_to_bools(union_node.filter.filter)
+            every = bits_to_bools(all_bits.pop(id(union_node)))
+            if union_node.num_children() == 0:
+                determined = node_active
+                node_filter = SplitFilter(bools_to_bits(every[determined]))
+            else:
+                determined = (~some | every) & node_active
+                node_filter = SplitFilter(bools_to_bits(every[determined]),
+                                          bools_to_bits(determined[node_active], RANK_BLOCK_BITS))
+                for child in union_node.children:
+                    active[id(child)] = node_active & ~determined
+            node = Node(node_filter)
+            node.dataset_id = union_node.dataset_id
+            if union_node.parent is not None:
+                node.parent = nodes[id(union_node.parent)]
+                node.parent.children.append(node)
+            nodes[id(union_node)] = node
+        self.root = nodes[id(union_root)]
+        self.aggregate_size = self.get_insternal_size() + sum(node.get_size() for node in nodes.values())
+
+    def query(self, query: str) -> List[str]:
+        """
+        Perform a BFS of the tree and collects reads that
+        pass similarity test.
+        :param query: The query string to be broken into kmers
+        :return: The list of read_ids that "match"
+        """
+        self.build()
+        if self.root is None:
+            return []
+        positions = get_positions_array(list(self.kmerize(query)), self.bloom_size, self.num_hashes).astype(np.int64)
+        kmers_needed = self.theta * len(positions)
+
+        # Each node gets the positions still undetermined, as indices into its bitvectors,
+        # the k-mer each of them belongs to, the number of k-mers they cover and the
+        # number of k-mers resolved present in every dataset below
+        nodes_to_explore: Deque = deque()
+        nodes_to_explore.append((self.root, positions.ravel(), np.repeat(np.arange(len(positions)), self.num_hashes),
+                                 len(positions), 0))
+
+        out: List[str] = []
+        while nodes_to_explore:
+            current, indices, owners, kmers_open, kmers_present = nodes_to_explore.popleft()
+            if kmers_present < kmers_needed:
+                indices, owners, kmers_open, kmers_present = serialization.resolve_filter(current.filter).resolve(
+                    indices, owners, kmers_open, kmers_present)
+                if kmers_present + kmers_open < kmers_needed:
+                    continue
+            for child in current.children:
+                nodes_to_explore.append((child, indices, owners, kmers_open, kmers_present))
+            if current.num_children() == 0:
+                out.append(current.dataset_id)
+        return out
+
+    def contains(self, query):
+        """
+        A wrapper for backward comptibility with other data structure implementations
+        """
+        return self.query(query)
+
+    def get_state(self):
+        """
+        Returns the tree parameters, the topology and the bitvectors of every node, see serialization.tree_state
+        """
+        self.build()
+        params = {"theta": self.theta, "k": self.k, "packed": self.packed, "canonical": self.canonical,
+                  "expected_num": self.expected_num, "fp_prob": self.fp_prob, "bloom_size": self.bloom_size,
+                  "num_hashes": self.num_hashes, "aggregate_size": self.aggregate_size}
+        return serialization.tree_state(self.root, params)
+
+    @classmethod
+    def from_state(cls, params, sections):
+        tree = cls(params["theta"], params["k"], params["expected_num"], params["fp_prob"], params["packed"],
+                   params["canonical"])
+        tree.staging = None
+        tree.bloom_size = params["bloom_size"]
+        tree.num_hashes = params["num_hashes"]
+        tree.aggregate_size = params["aggregate_size"]
+        tree.root = serialization.tree_root_from_state(params, sections, tree.load_node)
+        return tree
+
+    def new_node(self, node_filter: 'SplitFilter') -> 'Node':
+        return Node(node_filter)
+
+    def load_node(self, node_params, node_sections):
+        return self.new_node(SplitFilter.from_state(node_params["filter"], node_sections))
+
+    def get_insternal_size(self):
+        """
+        Returns the total number of bytes occupied by the filter object
+        """
+        return (
+                sys.getsizeof(self.theta) +
+                sys.getsizeof(self.expected_num) +
+                sys.getsizeof(self.fp_prob) +
+                sys.getsizeof(self.k) +
+                sys.getsizeof(self.root)
+        )
+
+
+class SplitFilter:
+
+    def __init__(self, how, det=None, det_ranks=None):
+        """
+        The bitvectors of one SplitBloomTree node, see the module description.
+
+            how --> little-endian bitarray, the value of every position determined here
+            det --> little-endian bitarray, 1 where a position is determined here, padded to
+                    whole RANK_BLOCK_BITS words; None at a leaf
+            det_ranks --> rank directory of det (see get_rank_directory), computed when not given
+        """
+        self.how = how
+        self.det = det
+        if det is not None and det_ranks is None:
+            det_ranks = get_rank_directory(det)
+        self.det_ranks = det_ranks
+
+    def resolve(self, indices, owners, kmers_open, kmers_present):
+        """
+        Looks up the undetermined positions of the query k-mers in this node.
+        :param indices: Indices into the bitvectors of this node of the positions left undetermined by the parent
+        :param owners: The k-mer of every position, in non-decreasing order
+        :param kmers_open: Number of k-mers with undetermined positions
+        :param kmers_present: Number of k-mers already resolved present in every dataset below
+        :return: The same four values for the children
+        """
+        if self.det is None:
+            determined = np.ones(len(indices), dtype=bool)
+            values = get_bits(self.how, indices)
+            ranks = indices
+        else:
+            determined = get_bits(self.det, indices)
+            ranks = get_ranks(self.det, self.det_ranks, indices)
+            values = determined.copy()
+            values[determined] = get_bits(self.how, ranks[determined])
+        absent = np.zeros(owners[-1] + 1 if len(owners) else 0, dtype=bool)
+        absent[owners[determined & ~values]] = True
+        still_open = ~determined & ~absent[owners]
+        child_owners = owners[still_open]
+        child_kmers_open = int(np.count_nonzero(np.diff(child_owners))) + 1 if len(child_owners) else 0
+        kmers_present += kmers_open - int(np.count_nonzero(absent)) - child_kmers_open
+        return (indices - ranks)[still_open], child_owners, child_kmers_open, kmers_present
+
+    def get_state(self):
+        params = {"how_bits": len(self.how), "det_bits": None if self.det is None else len(self.det)}
+        sections = {"how": serialization.bitarray_section(self.how)}
+        if self.det is not None:
+            sections["det"] = serialization.bitarray_section(self.det)
+            sections["det_ranks"] = self.det_ranks
+        return params, sections
+
+    @classmethod
+    def from_state(cls, params, sections):
+        how = serialization.bitarray_from_section(sections["how"], params["how_bits"], "little")
+        if params["det_bits"] is None:
+            return cls(how)
+        det = serialization.bitarray_from_section(sections["det"], params["det_bits"], "little")
+        return cls(how, det, sections["det_ranks"])
+
+    def get_size(self):
+        """
+        Returns the total number of bytes occupied by the bitvectors
+        """
+        return (
+                sys.getsizeof(self.how) +
+                sys.getsizeof(self.det) +
+                (0 if self.det_ranks is None else self.det_ranks.nbytes)
+        )
+
+
+class Node:
+
+    def __init__(self, node_filter: SplitFilter):
+        """
+        Represents a single node of Split Bloom Tree
+        :param node_filter: The det/how bitvectors of this node
+        """
+        self.children: List[Node] = []
+        self.parent: Optional[Node] = None
+        self.filter = node_filter
+        self.dataset_id: Optional[str] = None
+
+    def num_children(self) -> int:
+        return len(self.children)
+
+    def get_size(self):
+        """
+        Returns the total number of bytes occupied by the node
+        """
+        return (
+                sys.getsizeof(self.children) +
+                sys.getsizeof(self.parent) +
+                sys.getsizeof(self.dataset_id) +
+                self.filter.get_size()
+        )
@@ -0,0 +1,194 @@
+"""
+Description: Contains the implementation of a static XOR filter
+
+A XOR filter (Graf & Lemire) stores one fingerprint per slot of a table of about
+1.23 slots per item, split into three equal segments. An item hashes to one slot
+h0, h1, h2 in each segment and is reported present when
+
+    fingerprint(item) == table[h0] ^ table[h1] ^ table[h2]
+
+The filter is built once from the complete set of items and takes no inserts.
+Construction peels the items: a slot hit by a single item is left to that item,
+which is then removed, possibly leaving other slots with a single item. Every
+round peels all such slots at once. The slots are then assigned in reverse
+peeling order, so each item's equation holds. When some items cannot be peeled
+the construction is retried with another seed.
+"""
+
+import math
+import sys
+import numpy as np
+import hashing
+import serialization
+from kmers import KmerItems
+
+SIZE_FACTOR = 1.23
+SIZE_OFFSET = 32
+MAX_ATTEMPTS = 64
+ROTATIONS = (0, 21, 42)
+
+
+class XorFilter(KmerItems, serialization.Serializable):
+
+    def __init__(self, items, fp_size=8):
+        """
+        Builds a XOR filter holding items (strings or packed k-mers), duplicates allowed.
+
+            fp_size --> bits per fingerprint (1 to 32), the false positive rate is about 2^-fp_size
+            num_items_in_filter --> number of distinct items stored
+            segment_length --> number of slots in each of the three segments of the table
+            slots --> memoryview of the table, faster than NumPy indexing for single items
+        """
+        if not 1 <= fp_size <= 32:
+            raise ValueError("The fingerprint size of a XOR filter must be between 1 and 32 bits")
+        self.fp_size = fp_size
+        self.fp_mask = (1 << fp_size) - 1
+        keys = np.unique(hashing.hash_pair_array(items)[0])
+        self.num_items_in_filter = len(keys)
+        self.segment_length = get_segment_length(len(keys))
+        for attempt in range(MAX_ATTEMPTS):
+            self.seed = hashing.mix64(attempt + 1)
+            self.table = np.zeros(3 * self.segment_length, dtype=get_fingerprint_dtype(fp_size))
+            hashes = hashing.mix64_array(keys ^ np.uint64(self.seed))
+            rounds = self.peel(hashes)
+            if rounds is not None:
+                self.assign(rounds)
+                self.slots = memoryview(self.table)
+                return
+        raise ValueError("Could not build a XOR filter for these items in {} attempts".format(MAX_ATTEMPTS))
+
+    def get_state(self):
+        """
+        Returns the parameters and the fingerprint table, see serialization.Serializable
+        """
+        params = {"fp_size": self.fp_size, "seed": self.seed, "segment_length": self.segment_length,
+                  "num_items_in_filter": self.num_items_in_filter, **self.get_kmer_params()}
+        return params, {"table": self.table}
+
+    @classmethod
+    def from_state(cls, params, sections):
+        xor_filter = cls.__new__(cls)
+        xor_filter.fp_size = params["fp_size"]
+        xor_filter.fp_mask = (1 << xor_filter.fp_size) - 1
+        xor_filter.seed = params["seed"]
+        xor_filter.segment_length = params["segment_length"]
+        xor_filter.num_items_in_filter = params["num_items_in_filter"]
+        xor_filter.table = sections["table"]
+        xor_filter.slots = memoryview(xor_filter.table)
+        xor_filter.set_kmer_params(params)
+        return xor_filter
+
+    def __getstate__(self):
+        # A memoryview cannot be pickled, it is rebuilt from the table
+        state = self.__dict__.copy()
+        state.pop("slots", None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.slots = memoryview(self.table)
+
+    def get_positions(self, hashes):
+        """
+        Returns the (len(hashes), 3) slots of seeded item hashes, one slot in each segment
+        """
+        length = np.uint64(self.segment_length)
+        columns = []
+        for segment, rotation in enumerate(ROTATIONS):
+            rotated = hashes if rotation == 0 else (hashes << np.uint64(rotation)) | (hashes >> np.uint64(64 - rotation))
+            columns.append((((rotated & np.uint64(0xFFFFFFFF)) * length) >> np.uint64(32)) + np.uint64(segment) * length)
+        return np.stack(columns, axis=1).astype(np.intp)
+
+    def get_fingerprints(self, hashes):
+        return ((hashes ^ (hashes >> np.uint64(32))) & np.uint64(self.fp_mask)).astype(self.table.dtype)
+
+    def peel(self, hashes):
+        """
+            Peels the seeded item hashes. Returns, round by round, the hashes peeled and
+            the slot each one was peeled from, or None when some items cannot be peeled.
+        """
+        positions = self.get_positions(hashes).ravel()
+        counts = np.bincount(positions, minlength=len(self.table))
+        xors = np.zeros(len(self.table), dtype=np.uint64)
+        np.bitwise_xor.at(xors, positions, np.repeat(hashes, 3))
+
+        # A slot hit by one item holds that item's hash, an item alone in two slots is peeled once
+        rounds = []
+        peeled = 0
+        slots = np.flatnonzero(counts == 1)
+        while len(slots) > 0:
+            round_hashes, first = np.unique(xors[slots], return_index=True)
+            rounds.append((round_hashes, slots[first]))
+            peeled += len(round_hashes)
+            positions = self.get_positions(round_hashes).ravel()
+            np.subtract.at(counts, positions, 1)
+            np.bitwise_xor.at(xors, positions, np.repeat(round_hashes, 3))
+            slots = np.unique(positions[counts[positions] == 1])
+        return rounds if peeled == len(hashes) else None
+
+    def assign(self, rounds):
+        """
+            Fills the table in reverse peeling order. An item's peeled slot is still zero
+            and is not read by any item of its own round, so a round is assigned at once.
+        """
+        for round_hashes, slots in reversed(rounds):
+            positions = self.get_positions(round_hashes)
+            self.table[slots] = (self.get_fingerprints(round_hashes) ^ self.table[positions[:, 0]] ^
+                                 self.table[positions[:, 1]] ^ self.table[positions[:, 2]])
+
+    def contains(self, item):
+        """
+        Check if item probably is in filter (True), and if definitely not (False)
+        """
+        hash_value = hashing.mix64(hashing.hash_pair(item)[0] ^ self.seed)
+        fingerprint = (hash_value ^ (hash_value >> 32)) & self.fp_mask
+        for segment, rotation in enumerate(ROTATIONS):
+            rotated = ((hash_value << rotation) | (hash_value >> (64 - rotation))) & hashing.MASK64
+            fingerprint ^= self.slots[((rotated & 0xFFFFFFFF) * self.segment_length >> 32) + segment * self.segment_length]
+        return fingerprint == 0
+
+    def contains_many(self, items):
+        """
+        Query a batch of items. Returns a boolean array, True where the item
+        probably is in the filter.
+        """
+        if len(items) == 0:
+            return np.zeros(0, dtype=bool)
+        hashes = hashing.mix64_array(hashing.hash_pair_array(items)[0] ^ np.uint64(self.seed))
+        positions = self.get_positions(hashes)
+        return self.get_fingerprints(hashes) == (self.table[positions[:, 0]] ^ self.table[positions[:, 1]] ^
+                                                 self.table[positions[:, 2]])
+
+    def get_size(self):
+        """
+        Returns the total number of bytes occupied by the filter object
+        """
+        return (
+            sys.getsizeof(self.fp_size) +
+            sys.getsizeof(self.seed) +
+            sys.getsizeof(self.segment_length) +
+            sys.getsizeof(self.num_items_in_filter) +
+            self.table.nbytes
+        )
+
+
+def get_segment_length(num_items):
+    return max(1, math.ceil((SIZE_FACTOR * num_items + SIZE_OFFSET) / 3))
+
+
+def get_fingerprint_dtype(fp_size):
+    """
+    Returns the narrowest unsigned NumPy type holding fp_size bits
+    """
+    for dtype in (np.uint8, np.uint16, np.uint32):
+        if fp_size <= np.iinfo(dtype).bits:
+            return dtype
+
+
+def get_fingerprint_size(fp_prob):
+    """
+    Returns the fingerprint size giving at most the false positive probability fp_prob,
+    rounded up to the width of its table type since those bits are stored anyway
+    """
+    bits = min(32, max(1, math.ceil(math.log2(1 / fp_prob))))
+    return np.iinfo(get_fingerprint_dtype(bits)).bits
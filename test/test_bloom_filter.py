@@ -6,6 +6,7 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../src")
 import bloom_filter
+import numpy as np
 
 def test_construction():
     """ Ensures the bloom filter is constructed as we would expect """
@@ -28,4 +29,30 @@ def test_contains():
     assert bloomFilter.contains("GT") == False
     assert bloomFilter.contains("GTATCGGGT") == False
     assert bloomFilter.contains("GCGTTT") == True
-    assert bloomFilter.contains("AAACTG") == True
\ No newline at end of file
+    assert bloomFilter.contains("AAACTG") == True
+
+def test_packed_kmers():
+    """ Ensures packed integer k-mers can be inserted and queried """
+    bloomFilter = bloom_filter.BloomFilter(100000, 0.03)
+    assert bloomFilter.insert(0b011011) == True
+    assert bloomFilter.contains(0b011011) == True
+    assert bloomFilter.contains(0b111001) == False
+
+
+def test_insert_many_contains_many():
+    """ Ensures bulk operations agree with the single item ones for strings and packed ints """
+    bloomFilter = bloom_filter.BloomFilter(100000, 0.03)
+    assert bloomFilter.insert_many(["GCGTTT", "AAACTG"]) == True
+    assert bloomFilter.insert_many(np.array([7, 2**40], dtype=np.uint64)) == True
+    assert bloomFilter.contains("GCGTTT") == True
+    assert bloomFilter.contains(2**40) == True
+    assert bloomFilter.contains_many(["AAACTG", "GT", "GCGTTT"]).tolist() == [True, False, True]
+    assert bloomFilter.contains_many([7, 8, 2**40]).tolist() == [True, False, True]
+    assert bloomFilter.contains_many([]).tolist() == []
+
+
+def test_bulk_positions_match_scalar():
+    """ Ensures the vectorized bit positions are the ones insert() uses """
+    bloomFilter = bloom_filter.BloomFilter(1000, 0.01)
+    for item in ["GCGTTT", 12345, 2**70]:
+        assert bloomFilter.get_positions_many([item])[0].tolist() == bloomFilter.get_positions(item)
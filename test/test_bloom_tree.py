@@ -5,6 +5,7 @@ Description: Contains the unit tests for BloomTree class
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../src")
+import pytest
 from bloom_tree import BloomTree
 from read import Read
 
@@ -186,3 +187,74 @@ def test_multi_read_dataset_insert():
     assert bloom_tree.root.filter.contains('CGT')
     assert bloom_tree.root.filter.contains('AAA')
     assert bloom_tree.root.filter.contains('AAG')
+
+
+def test_packed_kmer_queries():
+    """ Ensures a tree built from packed k-mers answers the same queries """
+    bloom_tree = BloomTree(0.6, 3, 100000, 0.03, packed=True)
+    bloom_tree.insert([Read('a.fastq', 'a', None, 'GCGTAC', 'IIII')])
+    bloom_tree.insert([Read('b.fastq', 'b', None, 'TTTTTT', 'IIII')])
+    assert bloom_tree.query('GCGTAC') == ['a.fastq']
+    assert bloom_tree.query('TTTT') == ['b.fastq']
+    assert bloom_tree.query('CCCC') == []
+
+
+def test_canonical_queries():
+    """ Ensures a read from the opposite strand hits a canonical tree """
+    bloom_tree = BloomTree(0.9, 3, 100000, 0.03, canonical=True)
+    bloom_tree.insert([Read('a.fastq', 'a', None, 'GGATCA', 'IIII')])
+    assert bloom_tree.query('TGATCC') == ['a.fastq']
+    bloom_tree = BloomTree(0.9, 3, 100000, 0.03, packed=True)
+    bloom_tree.insert([Read('a.fastq', 'a', None, 'GGATCA', 'IIII')])
+    assert bloom_tree.query('TGATCC') == []
+
+
+def test_query_positions_shared_by_nodes():
+    """ Ensures the positions hashed once per query are the positions of every node filter """
+    bloom_tree = BloomTree(0.5, 3, 1000, 0.03)
+    bloom_tree.insert([Read('a.fastq', 'a', None, 'GCGTAC', 'IIII')])
+    bloom_tree.insert([Read('b.fastq', 'b', None, 'TTGCAT', 'IIII')])
+    positions = bloom_tree.get_query_positions('GCGTAT')
+    assert positions.shape == (4, bloom_tree.root.filter.num_hashes)
+    for node in [bloom_tree.root] + bloom_tree.root.children:
+        assert positions.tolist() == [node.filter.get_positions(kmer) for kmer in ['GCG', 'CGT', 'GTA', 'TAT']]
+        assert node.filter.test_positions(positions).tolist() == \
+            [node.filter.contains(kmer) for kmer in ['GCG', 'CGT', 'GTA', 'TAT']]
+
+
+def test_query_many_matches_query():
+    """ Ensures a batch query returns, for every read, what query returns for it """
+    bloom_tree = BloomTree(0.5, 3, 1000, 0.03)
+    bloom_tree.insert([Read('a.fastq', 'a', None, 'ABCDE', 'IIII')])
+    bloom_tree.insert([Read('b.fastq', 'b', None, 'CDEFG', 'IIII')])
+    bloom_tree.insert([Read('c.fastq', 'c', None, 'XYZWV', 'IIII')])
+    queries = ['AAAAA', 'BCDEF', 'CDEFG', 'ABCDE', 'XYZWV', 'AB', '']
+    assert bloom_tree.query_many(queries) == [bloom_tree.query(query) for query in queries]
+    assert bloom_tree.query_many([]) == []
+
+
+def test_build_bulk_pairs_similar_datasets():
+    """ Ensures bulk construction joins the closest datasets first and answers like insert """
+    names = [('a', 'ABCD'), ('b', 'EFGH'), ('c', 'ZABC'), ('d', 'ABCD'), ('e', 'EFGX')]
+    datasets = [[Read(name + '.fastq', name, None, line, 'IIII')] for name, line in names]
+    bulk_tree = BloomTree(0.5, 3, 100, 0.01)
+    bulk_tree.build_bulk(datasets, workers=2)
+    tree = BloomTree(0.5, 3, 100, 0.01)
+    for dataset in datasets:
+        tree.insert(dataset)
+    for query in ['ABCD', 'EFGH', 'ZABC', 'XXXX']:
+        assert sorted(bulk_tree.query(query)) == sorted(tree.query(query))
+
+    leaves, nodes = {}, [(bulk_tree.root, 0)]
+    while nodes:
+        node, depth = nodes.pop()
+        assert depth <= 3
+        if node.num_children() == 0:
+            leaves[node.dataset_id[0]] = node
+        nodes.extend((child, depth + 1) for child in node.children)
+    assert len(leaves) == 5
+    assert leaves['a'].parent is leaves['d'].parent
+    assert leaves['b'].parent is leaves['e'].parent
+    assert leaves['c'].parent is leaves['a'].parent.parent
+    with pytest.raises(ValueError):
+        bulk_tree.build_bulk(datasets)
@@ -7,6 +7,8 @@ import sys
 import os
 sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../src")
 import bucket_classes
+import random
+import numpy as np
 
 
 def test_bucket_creation():
@@ -98,3 +100,93 @@ def test_bucketarray_insert_no_duplicates():
 
     assert test_bucketarray.insert_no_duplicates(3, 0b1111) == True 
     assert test_bucketarray.insert_no_duplicates(3, 0b1100) == False
+
+def test_numpy_bucketarray_insert_contains_remove():
+    test_bucketarray = bucket_classes.numpyBucketArray(10, 2, 4)
+    assert test_bucketarray.table.dtype == np.uint8
+    assert test_bucketarray.insert(3, 0b1011) == True
+    assert test_bucketarray.insert(3, 0b0011) == True
+    assert test_bucketarray.insert(3, 0b0111) == False
+    assert test_bucketarray.isFull(3) == True
+
+    assert test_bucketarray.contains(2, 0b0000) == False
+    assert test_bucketarray.contains(3, 0b1011) == True
+    assert test_bucketarray.contains(3, 0b0111) == False
+
+    assert test_bucketarray.remove(3, 0b1011) == True
+    assert test_bucketarray.contains(3, 0b1011) == False
+    assert test_bucketarray.contains(3, 0b0011) == True
+    assert test_bucketarray.insert_no_duplicates(3, 0b0011) == False
+
+def test_numpy_bucketarray_contains_many():
+    test_bucketarray = bucket_classes.numpyBucketArray(10, 4, 12)
+    assert test_bucketarray.table.dtype == np.uint16
+    test_bucketarray.insert(1, 100)
+    test_bucketarray.insert(5, 200)
+    result = test_bucketarray.contains_many(np.array([1, 5, 5, 2]), np.array([100, 100, 200, 0]))
+    assert result.tolist() == [True, False, True, False]
+
+def test_numpy_bucketarray_swap():
+    test_bucketarray = bucket_classes.numpyBucketArray(10, 2, 4)
+    test_bucketarray.insert(0, 0b0011)
+    test_bucketarray.insert(0, 0b0011)
+    assert test_bucketarray.swap_with_random_entry(0, 0b1100) == 0b0011
+    assert sorted(test_bucketarray.get_bucket_list(0)) == [0b0011, 0b1100]
+
+def test_bucketarray_word_operations_match_list_bucket():
+    """ Ensures the word-packed buckets behave like plain list buckets under random operations """
+    random.seed(7)
+    test_bucketarray = bucket_classes.bitBucketArray(3, 4, 5)
+    reference = [bucket_classes.Bucket(4) for i in range(3)]
+    for n in range(500):
+        bucket_num = random.randrange(3)
+        fp = random.randrange(32)
+        if random.random() < 0.6:
+            assert test_bucketarray.insert(bucket_num, fp) == reference[bucket_num].insert(fp)
+        else:
+            assert test_bucketarray.remove(bucket_num, fp) == reference[bucket_num].remove(fp)
+        for b in range(3):
+            assert sorted(test_bucketarray.get_bucket_list(b)) == sorted(reference[b].bucket)
+            for probe in range(32):
+                assert test_bucketarray.contains(b, probe) == reference[b].contains(probe)
+
+def test_bucketarray_zero_fingerprint_and_swap():
+    test_bucketarray = bucket_classes.bitBucketArray(10, 2, 4)
+    assert test_bucketarray.contains(0, 0b0000) == False
+    assert test_bucketarray.insert(0, 0b0000) == True
+    assert test_bucketarray.contains(0, 0b0000) == True
+    assert test_bucketarray.insert(0, 0b1111) == True
+    assert test_bucketarray.get_size() == bucket_classes.bitBucketArray(10, 2, 4).get_size()
+    chosen = test_bucketarray.swap_with_random_entry(0, 0b0101)
+    assert chosen in (0b0000, 0b1111)
+    assert test_bucketarray.contains(0, 0b0101) == True
+    assert test_bucketarray.contains(0, chosen) == False
+
+def test_semisorted_bucketarray_size():
+    """ Ensures semi-sorting saves one bit per entry and rejects unsupported geometries """
+    test_bucketarray = bucket_classes.semiSortedBucketArray(10, 4, 8)
+    assert test_bucketarray.bucket_bits == 4 * 8 - 4
+    assert len(test_bucketarray.filter) == 10 * 28
+    assert len(bucket_classes.semiSortedBucketArray.prefix_combinations) == 3876
+    for geometry in [(10, 2, 8), (10, 4, 3)]:
+        try:
+            bucket_classes.semiSortedBucketArray(*geometry)
+            assert False
+        except ValueError:
+            pass
+
+def test_semisorted_bucketarray_matches_list_bucket():
+    """ Ensures the semi-sorted buckets behave like plain list buckets under random operations """
+    random.seed(11)
+    test_bucketarray = bucket_classes.semiSortedBucketArray(3, 4, 6)
+    reference = [bucket_classes.Bucket(4) for i in range(3)]
+    for n in range(500):
+        bucket_num = random.randrange(3)
+        fp = random.randrange(64)
+        if random.random() < 0.6:
+            assert test_bucketarray.insert(bucket_num, fp) == reference[bucket_num].insert(fp)
+        else:
+            assert test_bucketarray.remove(bucket_num, fp) == reference[bucket_num].remove(fp)
+        for b in range(3):
+            assert sorted(test_bucketarray.get_bucket_list(b)) == sorted(reference[b].bucket)
+            assert test_bucketarray.contains(b, fp) == reference[b].contains(fp)
@@ -5,6 +5,7 @@ Description: Contains the unit tests for CuckooBitTree class
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../src")
+import pytest
 from cuckoo_bit_tree import CuckooBitTree
 from read import Read
 
@@ -188,3 +189,53 @@ def test_multi_read_dataset_insert():
     assert cuckoo_tree.root.filter.contains('CGT')
     assert cuckoo_tree.root.filter.contains('AAA')
     assert cuckoo_tree.root.filter.contains('AAG')
+
+
+def test_query_many_matches_query():
+    """ Ensures a batch query returns, for every read, what query returns for it """
+    cuckoo_tree = CuckooBitTree(0.5, 3, 16, 8, 4, 500)
+    cuckoo_tree.insert([Read('a.fastq', 'a', None, 'ABCDE', 'IIII')])
+    cuckoo_tree.insert([Read('b.fastq', 'b', None, 'CDEFG', 'IIII')])
+    cuckoo_tree.insert([Read('c.fastq', 'c', None, 'XYZWV', 'IIII')])
+    queries = ['AAAAA', 'BCDEF', 'CDEFG', 'ABCDE', 'XYZWV', 'AB', '']
+    assert cuckoo_tree.query_many(queries) == [cuckoo_tree.query(query) for query in queries]
+    assert cuckoo_tree.query_many([]) == []
+
+
+def test_score_uses_hashed_dataset():
+    """ Ensures the score of a hashed dataset counts the k-mers the node lacks, duplicates included """
+    cuckoo_tree = CuckooBitTree(0.5, 3, 10, 8, 4, 500)
+    cuckoo_tree.insert([Read('a.fastq', 'a', None, 'ABCDE', 'IIII')])
+    node = cuckoo_tree.root
+    dataset = [Read('b.fastq', 'b', None, 'ABCDX', 'IIII'), Read('b.fastq', 'c', None, 'BCD', 'IIII')]
+    dataset_hashes = node.hash_dataset(dataset)
+    assert len(dataset_hashes[0]) == 4
+    assert node.score(dataset_hashes) == 3 - 3
+    assert node.score(node.hash_dataset([Read('c.fastq', 'c', None, 'XYZW', 'IIII')])) == 3
+
+
+def test_build_bulk_pairs_similar_datasets():
+    """ Ensures bulk construction joins the closest datasets first and answers like insert """
+    names = [('a', 'ABCD'), ('b', 'EFGH'), ('c', 'ZABC'), ('d', 'ABCD'), ('e', 'EFGX')]
+    datasets = [[Read(name + '.fastq', name, None, line, 'IIII')] for name, line in names]
+    bulk_tree = CuckooBitTree(0.5, 3, 32, 8, 4, 500)
+    bulk_tree.build_bulk(datasets, workers=2)
+    tree = CuckooBitTree(0.5, 3, 32, 8, 4, 500)
+    for dataset in datasets:
+        tree.insert(dataset)
+    for query in ['ABCD', 'EFGH', 'ZABC', 'XXXX']:
+        assert sorted(bulk_tree.query(query)) == sorted(tree.query(query))
+
+    leaves, nodes = {}, [(bulk_tree.root, 0)]
+    while nodes:
+        node, depth = nodes.pop()
+        assert depth <= 3
+        if node.num_children() == 0:
+            leaves[node.dataset_id[0]] = node
+        nodes.extend((child, depth + 1) for child in node.children)
+    assert len(leaves) == 5
+    assert leaves['a'].parent is leaves['d'].parent
+    assert leaves['b'].parent is leaves['e'].parent
+    assert leaves['c'].parent is leaves['a'].parent.parent
+    with pytest.raises(ValueError):
+        bulk_tree.build_bulk(datasets)
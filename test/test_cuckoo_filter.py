@@ -5,7 +5,9 @@ Description: Contains the unit tests for Cuckoo Filter class
 import sys
 import os
 sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../src")
+import pytest
 import cuckoo_filter
+import hashing
 
 def test_construction():
     """ Ensures the cuckoo filter is constructed as we would expect """
@@ -77,4 +79,179 @@ def test_cuckoobit_insert_no_duplicates():
     """ Ensures the cuckoo filter can insert items we should be able to, when using insert_no_duplicates"""
     cuckooFilter = cuckoo_filter.CuckooFilterBit(10, 8, 2, 500)
     assert cuckooFilter.insert_no_duplicates("GCGTTT") == True
-    assert cuckooFilter.insert_no_duplicates("GCGTTT") == False 
\ No newline at end of file
+    assert cuckooFilter.insert_no_duplicates("GCGTTT") == False
+
+def test_hash_families():
+    """ Ensures both hash families support insert, contains and delete """
+    for family in ["murmur", "sha256"]:
+        cuckooFilter = cuckoo_filter.CuckooFilter(10, 8, 4, 500, family)
+        assert cuckooFilter.insert("GCGTTT") == True
+        assert cuckooFilter.contains("GCGTTT") == True
+        assert cuckooFilter.contains(12345) == False
+        assert cuckooFilter.delete("GCGTTT") == True
+        bitFilter = cuckoo_filter.CuckooFilterBit(10, 8, 4, 500, family)
+        assert bitFilter.insert(12345) == True
+        assert bitFilter.contains(12345) == True
+
+def test_sha256_matches_paper_derivation():
+    """ Ensures the sha256 family derives the same fingerprint and buckets as the original code """
+    cuckooFilter = cuckoo_filter.CuckooFilter(64, 12, 4, 500, "sha256")
+    fingerprint, index_one, index_two = cuckooFilter.get_fp_and_index_positions("GCGTTT")
+    digest = cuckoo_filter.CuckooFilter.get_hash_value("GCGTTT")
+    assert fingerprint == cuckoo_filter.CuckooFilter.get_fingerprint("GCGTTT", 12)
+    assert index_one == digest % 64
+    assert index_two == (index_one ^ cuckoo_filter.CuckooFilter.get_hash_value(fingerprint)) % 64
+
+def test_alt_index_is_symmetric():
+    """ Ensures the alternate bucket of the alternate bucket is the original one for any table size """
+    for num_buckets in [10, 16, 893]:
+        cuckooFilter = cuckoo_filter.CuckooFilter(num_buckets, 8, 4, 500)
+        for item in ["A", "CG", "TTA", 7, 99]:
+            fingerprint, index_one, index_two = cuckooFilter.get_fp_and_index_positions(item)
+            assert cuckooFilter.get_alt_index(index_two, fingerprint) == index_one
+
+def test_stash_contains():
+    """ Ensures items that overflow into the stash are still found """
+    cuckooFilterStash = cuckoo_filter.CuckooFilterStash(1, 8, 1, 5, 4)
+    assert cuckooFilterStash.insert("GCGTTT") == True
+    assert cuckooFilterStash.insert("AAACTG") == True
+    assert cuckooFilterStash.contains("AAACTG") == True
+
+def test_alt_offset_table_matches_hashing():
+    """ Ensures the precomputed offsets give the same alternate buckets as hashing the fingerprint """
+    for family in ["murmur", "sha256"]:
+        for num_buckets in [16, 10]:
+            cuckooFilter = cuckoo_filter.CuckooFilter(num_buckets, 6, 4, 500, family)
+            assert cuckooFilter.alt_offsets is not None
+            for fingerprint in range(64):
+                for index in range(num_buckets):
+                    expected = hashing.alt_index(index, cuckooFilter.hash_family.hash_fingerprint(fingerprint), num_buckets)
+                    assert cuckooFilter.get_alt_index(index, fingerprint) == expected
+
+def test_wide_fingerprints_hash_on_the_fly():
+    """ Ensures fingerprints wider than the table limit still work without a table """
+    cuckooFilter = cuckoo_filter.CuckooFilterBit(10, 32, 4, 500)
+    assert cuckooFilter.alt_offsets is None
+    assert cuckooFilter.insert("GCGTTT") == True
+    assert cuckooFilter.contains("GCGTTT") == True
+
+def test_array_insert_contains_delete():
+    """ Ensures the NumPy table variant behaves like the other variants """
+    cuckooFilter = cuckoo_filter.CuckooFilterArray(10, 8, 4, 500)
+    assert cuckooFilter.insert("GCGTTT") == True
+    assert cuckooFilter.contains("GCGTTT") == True
+    assert cuckooFilter.contains("TTT") == False
+    assert cuckooFilter.insert_no_duplicates("GCGTTT") == False
+    assert cuckooFilter.delete("GCGTTT") == True
+    assert cuckooFilter.contains("GCGTTT") == False
+
+def test_array_contains_many():
+    """ Ensures batched lookups agree with contains for both hash families and table sizes """
+    for family in ["murmur", "sha256"]:
+        for num_buckets in [64, 50]:
+            cuckooFilter = cuckoo_filter.CuckooFilterArray(num_buckets, 12, 4, 500, family)
+            for item in range(0, 300, 3):
+                assert cuckooFilter.insert(item)
+            queries = list(range(300))
+            assert cuckooFilter.contains_many(queries).tolist() == [cuckooFilter.contains(q) for q in queries]
+            assert all(cuckooFilter.contains_many(["A", "GCGT"]) == [cuckooFilter.contains("A"), cuckooFilter.contains("GCGT")])
+
+def test_bit_contains_many():
+    """ Ensures the byte-gathering bulk lookup of bit buckets agrees with contains, deletes included """
+    for variant in [cuckoo_filter.CuckooFilterBit, cuckoo_filter.CuckooFilterSemiSorted]:
+        for fp_size in [7, 13, 33]:
+            cuckooFilter = variant(50, fp_size, 4, 500)
+            for item in range(0, 300, 3):
+                assert cuckooFilter.insert(item)
+            for item in range(0, 300, 9):
+                assert cuckooFilter.delete(item)
+            queries = list(range(300))
+            assert cuckooFilter.contains_many(queries).tolist() == [cuckooFilter.contains(q) for q in queries]
+
+def test_semisorted_filter():
+    """ Ensures the semi-sorted variant stores items and is smaller than the bit variant """
+    cuckooFilter = cuckoo_filter.CuckooFilterSemiSorted(16, 8, 4, 500)
+    bitFilter = cuckoo_filter.CuckooFilterBit(16, 8, 4, 500)
+    for item in range(40):
+        assert cuckooFilter.insert(item) == True
+    assert all(cuckooFilter.contains(item) for item in range(40))
+    assert cuckooFilter.delete(3) == True
+    assert cuckooFilter.insert_no_duplicates(5) == False
+    assert len(cuckooFilter.filter.filter) == len(bitFilter.filter.filter) - 16 * 4
+
+def test_bfs_eviction_keeps_every_item():
+    """ Ensures BFS inserts never lose a stored item, up to the first failure, for every variant """
+    for cls in [cuckoo_filter.CuckooFilter, cuckoo_filter.CuckooFilterBit, cuckoo_filter.CuckooFilterArray,
+                cuckoo_filter.CuckooFilterSemiSorted]:
+        cuckooFilter = cls(64, 12, 4, 500, bfs_depth=4)
+        inserted = []
+        for item in range(300):
+            if not cuckooFilter.insert(item):
+                break
+            inserted.append(item)
+        assert len(inserted) > 200
+        assert all(cuckooFilter.contains(item) for item in inserted)
+        assert sum(cuckooFilter.eviction_path_lengths.values()) == len(inserted)
+        assert max(cuckooFilter.eviction_path_lengths) <= 4
+
+def test_eviction_path_histogram():
+    """ Ensures the histogram counts direct inserts, relocations and failures """
+    cuckooFilter = cuckoo_filter.CuckooFilterBit(2, 8, 1, 10, bfs_depth=2)
+    assert cuckooFilter.insert(1) == True
+    assert cuckooFilter.eviction_path_lengths[0] == 1
+    results = [cuckooFilter.insert(item) for item in range(2, 10)]
+    assert results.count(True) <= 1
+    assert cuckooFilter.failed_inserts == results.count(False)
+    assert sum(cuckooFilter.eviction_path_lengths.values()) == 1 + results.count(True)
+    assert cuckooFilter.find_eviction_path(0, 1) is None
+
+def test_sharded_filter():
+    """ Ensures the sharded filter spreads items over its shards and finds every one of them """
+    for shard_class in [cuckoo_filter.CuckooFilter, cuckoo_filter.CuckooFilterBit, cuckoo_filter.CuckooFilterArray]:
+        cuckooFilter = cuckoo_filter.ShardedCuckooFilter(4, 100, 12, 4, 500, shard_class=shard_class)
+        assert cuckooFilter.num_buckets == 100
+        for item in range(300):
+            assert cuckooFilter.insert(item) == True
+        assert all(cuckooFilter.contains(item) for item in range(300))
+        assert cuckooFilter.num_items_in_filter == 300
+        assert all(shard.num_items_in_filter > 50 for shard in cuckooFilter.shards)
+        assert cuckooFilter.insert_no_duplicates(5) == False
+        assert cuckooFilter.delete(5) == True
+        assert cuckooFilter.num_items_in_filter == 299
+
+def test_insert_fingerprint_matches_insert():
+    """ Ensures inserting a precomputed fingerprint is the same as inserting the item """
+    first = cuckoo_filter.CuckooFilterBit(32, 8, 4, 500)
+    second = cuckoo_filter.CuckooFilterBit(32, 8, 4, 500)
+    for item in range(60):
+        first.insert(item)
+        second.insert_fingerprint(*second.get_fp_and_index_positions(item))
+    assert all(second.contains(item) for item in range(60))
+    assert first.num_items_in_filter == second.num_items_in_filter
+
+def test_clone_is_independent():
+    """ Ensures a clone answers like its filter and later inserts stay apart """
+    for cls in [cuckoo_filter.CuckooFilter, cuckoo_filter.CuckooFilterBit, cuckoo_filter.CuckooFilterArray,
+                cuckoo_filter.CuckooFilterSemiSorted]:
+        cuckooFilter = cls(64, 9, 4, 500)
+        for item in range(0, 100, 2):
+            cuckooFilter.insert(item)
+        copy = cuckooFilter.clone()
+        assert [copy.contains(q) for q in range(100)] == [cuckooFilter.contains(q) for q in range(100)]
+        copy.insert(1001)
+        assert copy.contains(1001) and copy.num_items_in_filter == cuckooFilter.num_items_in_filter + 1
+
+def test_merge_is_union():
+    """ Ensures merging moves every fingerprint of the other filter once and refuses other layouts """
+    for cls in [cuckoo_filter.CuckooFilter, cuckoo_filter.CuckooFilterBit, cuckoo_filter.CuckooFilterArray,
+                cuckoo_filter.CuckooFilterSemiSorted]:
+        first, second = cls(64, 9, 4, 500), cls(64, 9, 4, 500)
+        for item in range(100):
+            first.insert(item)
+        for item in range(50, 150):
+            second.insert(item)
+        assert first.merge(second) == True
+        assert all(first.contains(item) for item in range(150))
+        assert first.num_items_in_filter <= 150
+        with pytest.raises(ValueError):
+            first.merge(cls(32, 9, 4, 500))
@@ -0,0 +1,73 @@
+"""
+Description: Contains the unit tests for the streaming FASTQ parser
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../src")
+import fastq
+from read import Read
+
+RECORDS = [("00000/1", "GCGT"), ("00001/1", "AAAG"), ("00002/1", "TTCA")]
+
+
+def write_fastq(path):
+    with open(path, "w") as f:
+        for read_id, line in RECORDS:
+            f.write(">{}\n{}\n+\n{}\n".format(read_id, line, "!" * len(line)))
+    return str(path)
+
+
+def test_stream_reads(tmp_path):
+    """ Ensures every record is yielded as a Read in file order """
+    filename = write_fastq(tmp_path / "a.fastq")
+    reads = list(fastq.stream_reads(filename))
+    assert [r.line for r in reads] == ["GCGT", "AAAG", "TTCA"]
+    assert [r.id for r in reads] == ["00000/1", "00001/1", "00002/1"]
+    assert reads[2].read_ptr == 2
+    assert reads[0].quality == "!!!!"
+    assert reads[0].filename == filename
+
+
+def test_stream_sequences(tmp_path):
+    """ Ensures only the sequence lines are yielded, across files and with a limit """
+    first = write_fastq(tmp_path / "a.fastq")
+    second = write_fastq(tmp_path / "b.fastq")
+    assert list(fastq.stream_sequences(first)) == ["GCGT", "AAAG", "TTCA"]
+    assert len(list(fastq.stream_sequences([first, second]))) == 6
+    assert list(fastq.stream_sequences(first, limit=2)) == ["GCGT", "AAAG"]
+
+
+def test_dataset_is_reiterable(tmp_path):
+    """ Ensures a FastqDataset can be traversed several times and knows its name """
+    filename = write_fastq(tmp_path / "a.fastq")
+    dataset = fastq.FastqDataset(filename)
+    assert [r.line for r in dataset] == [r.line for r in dataset]
+    assert dataset.num_reads == 3
+    assert len(dataset) == 3
+    assert fastq.dataset_name(dataset) == filename
+    assert fastq.dataset_name([Read("b.fastq", "b", None, "GCGT", "IIII")]) == "b.fastq"
+
+
+def test_read_batches(tmp_path):
+    """ Ensures reads are packed into batches of the requested size with optional columns """
+    filename = write_fastq(tmp_path / "a.fastq")
+    batches = list(fastq.stream_read_batches(filename, batch_size=2, keep_ids=True))
+    assert [len(b) for b in batches] == [2, 1]
+    assert batches[0][1].id == "00001/1"
+    assert batches[0][1].quality is None
+    batch = fastq.load_read_batch(filename)
+    assert len(batch) == 3
+    assert list(batch.iter_sequences()) == ["GCGT", "AAAG", "TTCA"]
+    assert fastq.dataset_name(batch) == filename
+
+
+def test_byte_ranges_cover_every_record(tmp_path):
+    """ Ensures consecutive byte ranges yield every record once, even with '@' and '+' quality lines """
+    path = tmp_path / "a.fastq"
+    path.write_text("".join("@r{}\nACGT{}\n+\n{}\n".format(i, "A" * (i % 5), "@+@!" + "+" * (i % 5)) for i in range(50)))
+    expected = list(fastq.stream_sequences(str(path)))
+    for num_ranges in [1, 2, 7, 64]:
+        ranges = fastq.split_byte_ranges(str(path), num_ranges)
+        assert len(ranges) == num_ranges
+        assert [s for start, end in ranges for s in fastq.stream_sequence_range(str(path), start, end)] == expected
@@ -0,0 +1,81 @@
+"""
+Description: Contains the unit tests for the 2-bit k-mer encoder
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../src")
+import kmers
+import cuckoo_filter
+from bloom_filter import BloomFilter
+
+
+def test_packed_kmers():
+    """ Ensures k-mers are packed 2 bits per base, first base most significant """
+    assert list(kmers.packed_kmers("ACGT", 2)) == [0b0001, 0b0110, 0b1011]
+    assert [kmers.decode_kmer(v, 3) for v in kmers.packed_kmers("GCGTT", 3)] == ["GCG", "CGT", "GTT"]
+
+
+def test_packed_kmers_skip_ambiguous_bases():
+    """ Ensures windows containing an N are skipped """
+    values = list(kmers.packed_kmers("ACNGTA", 2))
+    assert [kmers.decode_kmer(v, 2) for v in values] == ["AC", "GT", "TA"]
+
+
+def test_wide_kmers():
+    """ Ensures k-mers longer than 32 bases are packed into wider integers """
+    sequence = "ACGT" * 10
+    values = list(kmers.packed_kmers(sequence, 36))
+    assert len(values) == 5
+    assert values[0].bit_length() > 64
+    assert kmers.decode_kmer(values[1], 36) == sequence[1:37]
+
+
+def test_packed_kmer_array_matches_generator():
+    """ Ensures the vectorized encoder agrees with the rolling generator """
+    sequence = "GATTACANNGATTACAGGCT"
+    expected = list(kmers.packed_kmers(sequence, 5))
+    assert kmers.packed_kmer_array(sequence, 5).tolist() == expected
+    assert kmers.packed_kmer_array("ACG", 5).tolist() == []
+
+
+def test_kmerizer():
+    """ Ensures the kmerizer returns string or packed k-mers """
+    assert list(kmers.kmerizer(3)("GCGT")) == ["GCG", "CGT"]
+    assert list(kmers.kmerizer(3, packed=True)("GCGT")) == list(kmers.packed_kmers("GCGT", 3))
+
+
+def test_canonical_kmers():
+    """ Ensures a k-mer and its reverse complement map to the same item """
+    forward = list(kmers.packed_kmers("GGATCCTA", 4, canonical=True))
+    reverse = list(kmers.packed_kmers("TAGGATCC", 4, canonical=True))
+    assert sorted(forward) == sorted(reverse)
+    for value, plain in zip(forward, kmers.packed_kmers("GGATCCTA", 4)):
+        assert value == min(plain, kmers.reverse_complement(plain, 4))
+    sequence = "GATTACANNGATTACAGGCT"
+    assert kmers.packed_kmer_array(sequence, 5, canonical=True).tolist() == list(kmers.packed_kmers(sequence, 5, True))
+
+
+def test_encoded_queries_find_inserted_kmers():
+    """ Ensures a k-mer string is found again in flat filters filled the way the -k builds fill them """
+    read = "GCGTAGCTTANAAGTCCGATTTCAGGCATC"
+    bloom = BloomFilter(100, 0.01)
+    bloom.insert_many(kmers.packed_kmer_array(read, 11))
+    cuckoo = cuckoo_filter.CuckooFilterArray(64, 12, 4, 500)
+    for kmer in kmers.packed_kmers(read, 11):
+        cuckoo.insert(kmer)
+    queries = [read[11:22], read[-11:], read[:11]]
+    for sketch in [bloom, cuckoo]:
+        assert sketch.contains(kmers.encode_query(queries[0], 11))
+        assert sketch.contains_many(kmers.encode_queries(queries, 11)).tolist()[:2] == [True, True]
+    assert kmers.encode_query(read[:11], 11) == read[:11]
+    assert kmers.encode_queries(queries, 0) == queries
+
+
+def test_encoded_queries_are_canonical():
+    """ Ensures a canonical query matches a k-mer inserted from the other strand """
+    bloom = BloomFilter(100, 0.01)
+    bloom.insert_many(kmers.packed_kmer_array("GGATCATAAGC", 6, canonical=True))
+    assert bloom.contains(kmers.encode_query("TGATCC", 6, canonical=True))
+    assert kmers.encode_query("GCTTAT", 6, canonical=True) == kmers.encode_query("ATAAGC", 6, canonical=True)
+    assert kmers.encode_query("GCTTAT", 6) != kmers.encode_query("ATAAGC", 6)
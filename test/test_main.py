@@ -0,0 +1,22 @@
+"""
+Description: Contains the unit tests for the command line checks of main.py
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../src")
+import pytest
+import main
+
+
+def parse(monkeypatch, *flags):
+    monkeypatch.setattr(sys, "argv", ["main.py", "--datafiles", "reads.fastq"] + list(flags))
+    return main.arguments()
+
+
+def test_tree_dir_is_rejected_for_filters(monkeypatch):
+    """ Ensures --tree-dir stops before any build unless a tree is created """
+    for create in ["--create-bloom-filter", "--create-xor-filter", "--create-cuckoo-filter-array"]:
+        with pytest.raises(SystemExit):
+            parse(monkeypatch, create, "-k", "11", "--save", "sketch", "--tree-dir")
+    assert parse(monkeypatch, "--create-bloom-tree", "-k", "11", "--save", "tree", "--tree-dir").tree_dir
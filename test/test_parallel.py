@@ -0,0 +1,73 @@
+"""
+Description: Contains the unit tests for the multi-process filter construction and queries
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../src")
+import random
+import parallel
+import cuckoo_filter
+from bloom_filter import BloomFilter
+from fastq import stream_sequences
+from kmers import packed_kmer_array, packed_kmers
+
+
+def write_fastq(path, num_reads=200, read_length=40):
+    random.seed(7)
+    with open(path, "w") as f:
+        for i in range(num_reads):
+            line = "".join(random.choice("ACGT") for _ in range(read_length))
+            f.write(">{}/1\n{}\n+\n{}\n".format(i, line, "!" * read_length))
+    return str(path)
+
+
+def test_parallel_bloom_matches_sequential(tmp_path):
+    """ Ensures the OR-merged parts give exactly the filter a single process builds """
+    filenames = [write_fastq(tmp_path / "a.fastq"), write_fastq(tmp_path / "b.fastq", 50)]
+    bloom = BloomFilter(20000, 0.01)
+    for read_line in stream_sequences(filenames):
+        bloom.insert_many(packed_kmer_array(read_line, 12))
+    merged, items = parallel.build_bloom_filter(filenames, 20000, 0.01, k=12, workers=3)
+    assert merged.filter == bloom.filter
+    assert items == 250 * (40 - 12 + 1)
+
+
+def test_parallel_cuckoo_holds_every_item(tmp_path):
+    """ Ensures every k-mer (or whole read with k=0) lands in the sharded filter """
+    filename = write_fastq(tmp_path / "a.fastq")
+    kmers = [kmer for read_line in stream_sequences(filename) for kmer in packed_kmers(read_line, 12)]
+    cuckooFilter = parallel.build_cuckoo_filter([filename], cuckoo_filter.CuckooFilterArray, 4000, 12, 4, 500,
+                                                "murmur", k=12, workers=3)
+    assert cuckooFilter.num_shards == 3
+    assert cuckooFilter.num_items_in_filter == len(kmers)
+    assert all(cuckooFilter.contains(kmer) for kmer in kmers)
+    reads = parallel.build_cuckoo_filter([filename], cuckoo_filter.CuckooFilter, 200, 12, 4, 500, "murmur", workers=2)
+    assert all(reads.contains(read_line) for read_line in stream_sequences(filename))
+
+
+def test_parallel_queries_match_sequential_in_order(tmp_path):
+    """ Ensures the shared-memory executor answers like contains, in input order """
+    queries = list(stream_sequences(write_fastq(tmp_path / "a.fastq", 100)))
+    for sketch in [BloomFilter(200, 0.01), cuckoo_filter.CuckooFilterArray(64, 12, 4, 500),
+                   cuckoo_filter.CuckooFilterBit(64, 12, 4, 500), cuckoo_filter.CuckooFilter(64, 12, 4, 500)]:
+        for query in queries[::2]:
+            sketch.insert(query)
+        with parallel.ParallelQueryExecutor(sketch, workers=2, batch_size=7) as executor:
+            results = executor.query(queries)
+        assert results == [bool(sketch.contains(query)) for query in queries]
+        assert executor.num_queries == len(queries)
+        assert sum(stats[0] for stats in executor.worker_stats.values()) == len(queries)
+        assert executor.get_throughput() > 0
+
+
+def test_parallel_queries_encode_kmers(tmp_path):
+    """ Ensures the workers encode k-mer queries with the k-mer mode of the filter """
+    read = "GCGTAGCTTAAAAGTCCGATTTCAGGCATC"
+    queries = [read[i:i + 11] for i in range(0, 20, 3)] + ["CCCCCCCCCCC"]
+    sketch = cuckoo_filter.CuckooFilterArray(64, 12, 4, 500)
+    for kmer in packed_kmers(read, 11, canonical=True):
+        sketch.insert(kmer)
+    sketch.set_kmer_mode(11, canonical=True)
+    with parallel.ParallelQueryExecutor(sketch, workers=2, batch_size=3) as executor:
+        assert executor.query(queries) == [True] * 7 + [False]
@@ -0,0 +1,29 @@
+"""
+Description: Contains the unit tests for Read and ReadBatch classes
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../src")
+from read import Read, ReadBatch
+
+
+def test_read_has_no_dict():
+    """ Ensures Read objects use slots instead of a per-object __dict__ """
+    read = Read('a.fastq', 'a', 0, 'GCGT', 'IIII')
+    assert not hasattr(read, '__dict__')
+    assert list(read.kmers(3)) == ['GCG', 'CGT']
+
+
+def test_batch_views():
+    """ Ensures a batch stores sequences contiguously and hands out Read views """
+    batch = ReadBatch('a.fastq', keep_quality=True)
+    batch.append('GCGT', 'a', 'IIII')
+    batch.append('AAAGT', 'b', 'IIIII')
+    assert len(batch) == 2
+    assert bytes(batch.sequences.buffer) == b'GCGTAAAGT'
+    assert list(batch.sequences.offsets) == [0, 4, 9]
+    assert batch[1].line == 'AAAGT'
+    assert batch[-1].quality == 'IIIII'
+    assert batch[0].id is None
+    assert [list(r.kmers(4)) for r in batch] == [['GCGT'], ['AAAG', 'AAGT']]
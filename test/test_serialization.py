@@ -0,0 +1,208 @@
+"""
+Description: Contains the unit tests for saving and loading the sketches
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../src")
+import pytest
+import serialization
+import bloom_filter
+import cuckoo_filter
+from bloom_tree import BloomTree
+from cuckoo_tree import CuckooTree
+from cuckoo_bit_tree import CuckooBitTree
+from split_bloom_tree import SplitBloomTree
+from read import Read
+
+FILTERS = [
+    lambda: bloom_filter.BloomFilter(500, 0.01),
+    lambda: cuckoo_filter.CuckooFilter(64, 12, 4, 500),
+    lambda: cuckoo_filter.CuckooFilterStash(16, 12, 4, 10, 8),
+    lambda: cuckoo_filter.CuckooFilterBit(64, 12, 4, 500, bfs_depth=3),
+    lambda: cuckoo_filter.CuckooFilterArray(64, 12, 4, 500, "sha256"),
+    lambda: cuckoo_filter.CuckooFilterSemiSorted(64, 9, 4, 500),
+]
+
+
+def test_filters_round_trip(tmp_path):
+    """ Ensures every filter answers the same queries after a save and a load """
+    path = str(tmp_path / "filter.bin")
+    for make_filter in FILTERS:
+        sketch = make_filter()
+        for item in range(0, 400, 2):
+            sketch.insert(item)
+        sketch.save(path)
+        loaded = type(sketch).load(path)
+        assert type(loaded) is type(sketch)
+        assert [loaded.contains(q) for q in range(400)] == [sketch.contains(q) for q in range(400)]
+        assert getattr(loaded, "num_items_in_filter", None) == getattr(sketch, "num_items_in_filter", None)
+        assert type(serialization.load_sketch(path)) is type(sketch)
+
+
+def test_loaded_filter_accepts_inserts(tmp_path):
+    """ Ensures a loaded filter is a regular, writable filter """
+    path = str(tmp_path / "filter.bin")
+    cuckooFilter = cuckoo_filter.CuckooFilterArray(16, 8, 4, 500)
+    cuckooFilter.insert("GCGT")
+    cuckooFilter.save(path)
+    loaded = cuckoo_filter.CuckooFilterArray.load(path)
+    assert loaded.insert("AAAG") == True
+    assert loaded.contains("GCGT") and loaded.contains("AAAG")
+    assert loaded.delete("GCGT") == True
+
+
+def test_filters_keep_kmer_mode(tmp_path):
+    """ Ensures the k-mer mode of a -k build is saved, and whole reads are assumed without one """
+    path = str(tmp_path / "filter.bin")
+    sharded = cuckoo_filter.ShardedCuckooFilter(2, 64, 12, 4, 500)
+    for sketch in [make_filter() for make_filter in FILTERS] + [sharded]:
+        sketch.set_kmer_mode(11, canonical=True)
+        sketch.save(path)
+        loaded = serialization.load_sketch(path)
+        assert (loaded.k, loaded.canonical) == (11, True)
+    params, sections = bloom_filter.BloomFilter(500, 0.01).get_state()
+    del params["k"], params["canonical"]
+    assert bloom_filter.BloomFilter.from_state(params, sections).k == 0
+
+
+def test_trees_round_trip(tmp_path):
+    """ Ensures the tree topology, dataset ids and node filters survive a save and a load """
+    path = str(tmp_path / "tree.bin")
+    datasets = [[Read("{}.fastq".format(name), name, 0, line, "")] for name, line in
+                [("a", "GCGTAGCTTA"), ("b", "AAAGTCCGAT"), ("c", "TTCAGGCATC")]]
+    for tree in [BloomTree(0.5, 4, 100, 0.01, packed=True), CuckooTree(0.5, 4, 32, 8, 4, 100),
+                 CuckooBitTree(0.5, 4, 32, 8, 4, 100, canonical=True)]:
+        for dataset in datasets:
+            tree.insert(dataset)
+        tree.save(path)
+        loaded = type(tree).load(path)
+        assert loaded.root.num_children() == tree.root.num_children()
+        assert loaded.root.children[0].parent is loaded.root
+        assert loaded.canonical == tree.canonical
+        for _, line in [("a", "GCGTAGCTTA"), ("b", "AAAGTCCGAT"), ("x", "CCCCCCCCCC")]:
+            assert loaded.query(line) == tree.query(line)
+
+
+def test_rejects_foreign_files(tmp_path):
+    """ Ensures unknown files, newer versions and the wrong sketch kind are refused """
+    path = tmp_path / "filter.bin"
+    path.write_bytes(b"not a sketch at all, just some bytes")
+    with pytest.raises(ValueError):
+        serialization.load_sketch(str(path))
+    cuckoo_filter.CuckooFilterBit(8, 8, 4, 10).save(str(path))
+    with pytest.raises(ValueError):
+        bloom_filter.BloomFilter.load(str(path))
+    data = bytearray(path.read_bytes())
+    data[8] = serialization.FORMAT_VERSION + 1
+    path.write_bytes(bytes(data))
+    with pytest.raises(ValueError):
+        serialization.load_sketch(str(path))
+
+
+def test_sections_are_aligned(tmp_path):
+    """ Ensures every table starts on an ALIGNMENT boundary of the file """
+    path = str(tmp_path / "filter.bin")
+    cuckoo_filter.CuckooFilterStash(16, 12, 4, 10, 8).save(path)
+    with open(path, "rb") as f:
+        metadata, data_start = serialization.read_metadata(f)
+    assert data_start % serialization.ALIGNMENT == 0
+    assert all(entry["offset"] % serialization.ALIGNMENT == 0 for entry in metadata["sections"])
+
+
+def test_mapped_filters_answer_queries(tmp_path):
+    """ Ensures memory-mapped filters answer like the saved ones and refuse writes """
+    path = str(tmp_path / "filter.bin")
+    for make_filter in [FILTERS[0], FILTERS[3], FILTERS[4], FILTERS[5]]:
+        sketch = make_filter()
+        for item in range(0, 400, 2):
+            sketch.insert(item)
+        sketch.save(path)
+        mapped = type(sketch).load(path, mapped=True)
+        assert [mapped.contains(q) for q in range(400)] == [sketch.contains(q) for q in range(400)]
+        with pytest.raises((TypeError, ValueError)):
+            mapped.insert(1001)
+
+
+def test_mapped_list_buckets_are_refused(tmp_path):
+    """ Ensures the list-of-buckets variants cannot be mapped, while trees of bit filters can """
+    path = str(tmp_path / "filter.bin")
+    cuckoo_filter.CuckooFilterStash(8, 8, 4, 10, 4).save(path)
+    with pytest.raises(ValueError):
+        serialization.load_sketch(path, mapped=True)
+    tree = CuckooBitTree(0.5, 4, 32, 8, 4, 100)
+    tree.insert([Read("a.fastq", "a", 0, "GCGTAGCTTA", "")])
+    tree.save(path)
+    assert CuckooBitTree.load(path, mapped=True).query("GCGTAGCTTA") == ["a.fastq"]
+
+
+def test_tree_directory_round_trip(tmp_path):
+    """ Ensures every tree kind answers the same queries after a save to and a lazy load from a directory """
+    datasets = [[Read("{}.fastq".format(name), name, 0, line, "")] for name, line in
+                [("a", "GCGTAGCTTA"), ("b", "AAAGTCCGAT"), ("c", "TTCAGGCATC"), ("d", "GCGTAGCTTC")]]
+    for make_tree in [lambda: BloomTree(0.5, 4, 100, 0.01, packed=True), lambda: CuckooTree(0.5, 4, 32, 8, 4, 100),
+                      lambda: CuckooBitTree(0.5, 4, 32, 8, 4, 100), lambda: SplitBloomTree(0.5, 4, 100, 0.01)]:
+        tree = make_tree()
+        for dataset in datasets:
+            tree.insert(dataset)
+        path = str(tmp_path / type(tree).__name__)
+        serialization.save_tree_directory(tree, path)
+        loaded = serialization.load_tree_directory(path, cache_size=2)
+        assert type(loaded) is type(tree)
+        assert len(os.listdir(path)) == 1 + 7
+        for line in ["GCGTAGCTTA", "AAAGTCCGAT", "TTCAGGCATC", "CCCCCCCCCC"]:
+            assert loaded.query(line) == tree.query(line)
+        assert len(loaded.node_cache.filters) <= 2
+
+
+def test_tree_directory_refuses_filters(tmp_path):
+    """ Ensures only trees are saved as a directory """
+    with pytest.raises(ValueError):
+        serialization.save_tree_directory(bloom_filter.BloomFilter(500, 0.01), str(tmp_path / "filter"))
+    assert not os.path.exists(str(tmp_path / "filter"))
+
+
+def test_tree_directory_loads_nodes_on_demand(tmp_path):
+    """ Ensures a lazily loaded tree reads only the nodes a query reaches, mapped or not """
+    path = str(tmp_path / "tree")
+    tree = BloomTree(0.5, 4, 100, 0.01)
+    for name, line in [("a", "GCGTAGCTTA"), ("b", "AAAGTCCGAT"), ("c", "TTCAGGCATC"), ("d", "CCGGTTAACC")]:
+        tree.insert([Read("{}.fastq".format(name), name, 0, line, "")])
+    serialization.save_tree_directory(tree, path)
+    for mapped in [False, True]:
+        loaded = serialization.load_tree_directory(path, cache_size=8, mapped=mapped)
+        assert loaded.node_cache.misses == 0
+        assert loaded.query("GCGTAGCTTA") == ["a.fastq"]
+        assert loaded.node_cache.misses < 7
+        misses = loaded.node_cache.misses
+        loaded.query("GCGTAGCTTA")
+        assert loaded.node_cache.misses == misses and loaded.node_cache.hits > 0
+
+
+def test_tree_directory_counts_node_visits(tmp_path):
+    """ Ensures the node cache counts one lookup per node visited, however many k-mers are probed """
+    path = str(tmp_path / "tree")
+    line = "GCGTAGCTTAAAAGTCCGATTTCAGGCATC"
+    for tree in [CuckooTree(0.5, 4, 64, 8, 4, 100), CuckooBitTree(0.5, 4, 64, 8, 4, 100)]:
+        for name in ["a", "b"]:
+            tree.insert([Read("{}.fastq".format(name), name, 0, line, "")])
+        serialization.save_tree_directory(tree, path)
+        loaded = serialization.load_tree_directory(path)
+        assert loaded.query(line) == ["a.fastq", "b.fastq"]
+        assert loaded.node_cache.hits + loaded.node_cache.misses == 3
+        assert loaded.query_many([line]) == [["a.fastq", "b.fastq"]]
+        assert loaded.node_cache.hits == 3
+
+
+def test_node_cache_evicts_least_recently_used():
+    """ Ensures the node cache keeps the most recently used filters within its capacity """
+    loads = []
+    cache = serialization.NodeCache(lambda key: loads.append(key) or key.upper(), 2)
+    assert cache.get("a") == "A" and cache.get("b") == "B"
+    cache.get("a")
+    cache.get("c")
+    assert list(cache.filters) == ["a", "c"]
+    cache.get("b")
+    assert loads == ["a", "b", "c", "b"]
+    with pytest.raises(ValueError):
+        serialization.NodeCache(str.upper, 0)
@@ -0,0 +1,115 @@
+"""
+Description: Contains the unit tests for the query server
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../src")
+import asyncio
+import json
+import server
+import cuckoo_filter
+from bloom_filter import BloomFilter
+from kmers import packed_kmers, packed_kmer_array
+
+QUERIES = ["GCGTAGCTTA", "AAAGTCCGAT", "TTCAGGCATC", "CCCCCCCCCC"]
+
+
+async def ask(address, requests):
+    reader, writer = await asyncio.open_unix_connection(address)
+    writer.write("".join(request + "\n" for request in requests).encode())
+    await writer.drain()
+    replies = [(await reader.readline()).decode().strip() for _ in requests]
+    writer.close()
+    await writer.wait_closed()
+    return replies
+
+
+async def run_server(sketch, address, clients):
+    query_server = server.QueryServer(sketch)
+    await query_server.start(address)
+    try:
+        return await asyncio.gather(*[ask(address, requests) for requests in clients])
+    finally:
+        await query_server.close()
+
+
+def test_server_answers_in_request_order(tmp_path):
+    """ Ensures pipelined queries of several connections get their own answers, in order """
+    address = str(tmp_path / "sketch.sock")
+    for sketch in [BloomFilter(100, 0.01), cuckoo_filter.CuckooFilterArray(16, 12, 4, 500),
+                   cuckoo_filter.CuckooFilter(16, 12, 4, 500)]:
+        sketch.insert(QUERIES[0])
+        sketch.insert(QUERIES[2])
+        clients = [QUERIES * 5, list(reversed(QUERIES)) * 5]
+        replies = asyncio.run(run_server(sketch, address, clients))
+        assert replies[0] == ["1", "0", "1", "0"] * 5
+        assert replies[1] == ["0", "1", "0", "1"] * 5
+
+
+def test_server_encodes_kmer_queries(tmp_path):
+    """ Ensures k-mer requests are answered by filters built from packed k-mers, canonical or not """
+    address = str(tmp_path / "sketch.sock")
+    read = "GCGTAGCTTAAAAGTCCGAT"
+    reverse = read[:11].translate(str.maketrans("ACGT", "TGCA"))[::-1]
+    bloom = BloomFilter(100, 0.01)
+    bloom.insert_many(packed_kmer_array(read, 11))
+    bloom.set_kmer_mode(11)
+    cuckoo = cuckoo_filter.CuckooFilterArray(16, 12, 4, 500)
+    for kmer in packed_kmers(read, 11, canonical=True):
+        cuckoo.insert(kmer)
+    cuckoo.set_kmer_mode(11, canonical=True)
+    requests = [read[:11], read[-11:], "CCCCCCCCCCC", reverse]
+    assert asyncio.run(run_server(bloom, address, [requests]))[0] == ["1", "1", "0", "0"]
+    assert asyncio.run(run_server(cuckoo, address, [requests]))[0] == ["1", "1", "0", "1"]
+
+
+def test_server_batches_and_counts(tmp_path):
+    """ Ensures concurrent requests share lookups and STATS reports every answered query """
+    address = str(tmp_path / "sketch.sock")
+    sketch = BloomFilter(100, 0.01)
+    replies = asyncio.run(run_server(sketch, address, [QUERIES * 10, QUERIES * 10 + ["STATS"]]))
+    stats = json.loads(replies[1][-1])
+    assert stats["queries"] >= 40
+    assert stats["batches"] < stats["queries"]
+    assert stats["max_latency_ms"] >= stats["p50_latency_ms"] >= 0
+
+
+async def abort_client(query_server, address, num_queries):
+    reader, writer = await asyncio.open_unix_connection(address)
+    writer.write("".join(QUERIES[i % 4] + "\n" for i in range(num_queries)).encode())
+    await writer.drain()
+    await reader.readline()
+    writer.transport.abort()
+    for _ in range(500):
+        if not query_server.clients:
+            break
+        await asyncio.sleep(0.01)
+    return len(query_server.clients), await ask(address, QUERIES)
+
+
+def test_server_survives_aborted_client(tmp_path, caplog):
+    """ Ensures a client dropping its connection with replies pending is cleaned up quietly """
+    address = str(tmp_path / "sketch.sock")
+    sketch = BloomFilter(100, 0.01)
+    sketch.insert(QUERIES[0])
+
+    async def run():
+        query_server = server.QueryServer(sketch)
+        await query_server.start(address)
+        try:
+            return await abort_client(query_server, address, 200000)
+        finally:
+            await query_server.close()
+
+    with caplog.at_level("WARNING", logger="asyncio"):
+        clients, replies = asyncio.run(run())
+    assert clients == 0
+    assert replies == ["1", "0", "0", "0"]
+    assert not [record for record in caplog.records if record.name == "asyncio"]
+
+
+def test_parse_address():
+    """ Ensures HOST:PORT selects TCP and anything else a Unix socket path """
+    assert server.parse_address("127.0.0.1:7878") == ("127.0.0.1", 7878)
+    assert server.parse_address("/tmp/sketch.sock") == ("/tmp/sketch.sock", None)
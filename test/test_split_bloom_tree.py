@@ -0,0 +1,89 @@
+"""
+Description: Contains the unit tests for SplitBloomTree class
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../src")
+import random
+import numpy as np
+import pytest
+from bloom_tree import BloomTree
+from split_bloom_tree import SplitBloomTree, bools_to_bits, get_rank_directory, get_ranks
+from read import Read
+
+
+def random_datasets(num_datasets, reads_per_dataset=6, read_length=30):
+    random.seed(11)
+    shared = ["".join(random.choice("ACGT") for _ in range(read_length)) for _ in range(3)]
+    datasets = []
+    for i in range(num_datasets):
+        lines = shared[:i % 3] + ["".join(random.choice("ACGT") for _ in range(read_length))
+                                  for _ in range(reads_per_dataset)]
+        datasets.append([Read("{}.fastq".format(i), str(j), None, line, "") for j, line in enumerate(lines)])
+    return datasets
+
+
+def test_rank_directory():
+    """ Ensures ranks count the set bits before every position, across word boundaries """
+    bools = np.random.default_rng(3).random(1000) < 0.4
+    bits = bools_to_bits(bools, 64)
+    assert len(bits) == 1024
+    positions = np.arange(1000)
+    expected = np.concatenate([[0], np.cumsum(bools)[:-1]])
+    assert get_ranks(bits, get_rank_directory(bits), positions).tolist() == expected.tolist()
+
+
+def test_queries_match_bloom_tree():
+    """ Ensures the split tree answers every query like the Bloom tree it was split from, in less space """
+    datasets = random_datasets(9)
+    for theta, packed in [(0.5, False), (0.9, True)]:
+        bloom_tree = BloomTree(theta, 5, 300, 0.05, packed=packed)
+        split_tree = SplitBloomTree(theta, 5, 300, 0.05, packed=packed)
+        for dataset in datasets:
+            bloom_tree.insert(dataset)
+            split_tree.insert(dataset)
+        split_tree.build()
+        queries = [read.line for dataset in datasets for read in dataset] + ["ACGTACGTAC", "ACG", ""]
+        assert [split_tree.query(query) for query in queries] == [bloom_tree.query(query) for query in queries]
+        assert split_tree.aggregate_size < bloom_tree.aggregate_size
+
+
+def test_build_bulk_matches_bloom_tree():
+    """ Ensures a bulk built split tree answers like the Bloom tree bulk built from the same datasets """
+    datasets = random_datasets(7)
+    bloom_tree = BloomTree(0.5, 5, 300, 0.05, packed=True)
+    split_tree = SplitBloomTree(0.5, 5, 300, 0.05, packed=True)
+    bloom_tree.build_bulk(datasets)
+    split_tree.build_bulk(datasets)
+    queries = [read.line for dataset in datasets for read in dataset] + ["ACGTACGTAC"]
+    assert [split_tree.query(query) for query in queries] == [bloom_tree.query(query) for query in queries]
+    with pytest.raises(ValueError):
+        split_tree.build_bulk(datasets)
+
+
+def test_leaves_and_empty_tree():
+    """ Ensures a single dataset tree works, an empty one answers nothing and built trees refuse datasets """
+    split_tree = SplitBloomTree(0.5, 3, 100, 0.03)
+    assert split_tree.query("GCGT") == []
+    split_tree = SplitBloomTree(0.5, 3, 100, 0.03)
+    split_tree.insert([Read('a.fastq', 'a', None, 'GCGT', 'IIII')])
+    assert split_tree.query('GCGT') == ['a.fastq']
+    assert split_tree.query('AAAA') == []
+    assert split_tree.root.filter.det is None
+    with pytest.raises(ValueError):
+        split_tree.insert([Read('b.fastq', 'b', None, 'AAAA', 'IIII')])
+
+
+def test_save_and_map(tmp_path):
+    """ Ensures a saved split tree answers the same queries, also when memory-mapped """
+    path = str(tmp_path / "tree.bin")
+    datasets = random_datasets(5)
+    split_tree = SplitBloomTree(0.6, 5, 300, 0.05, packed=True)
+    for dataset in datasets:
+        split_tree.insert(dataset)
+    split_tree.save(path)
+    queries = [read.line for dataset in datasets for read in dataset]
+    for mapped in [False, True]:
+        loaded = SplitBloomTree.load(path, mapped=mapped)
+        assert [loaded.query(query) for query in queries] == [split_tree.query(query) for query in queries]
@@ -0,0 +1,59 @@
+"""
+Description: Contains the unit tests for XOR Filter class
+"""
+
+import sys
+import os
+sys.path.append(os.path.dirname(os.path.realpath(__file__)) + "/../src")
+import pytest
+import xor_filter
+import numpy as np
+from kmers import packed_kmer_array
+
+
+def test_construction():
+    """ Ensures the filter sizes its table from the distinct items and keeps them all """
+    xorFilter = xor_filter.XorFilter(["GCGT", "AAAG", "GCGT", "TTCA"], 16)
+    assert xorFilter.num_items_in_filter == 3
+    assert len(xorFilter.table) == 3 * xor_filter.get_segment_length(3)
+    assert xorFilter.table.dtype == np.uint16
+    assert xorFilter.contains("GCGT") and xorFilter.contains("AAAG") and xorFilter.contains("TTCA")
+    assert not xorFilter.contains("CCCC")
+
+
+def test_every_item_is_found():
+    """ Ensures no false negatives for packed k-mers, one at a time and in bulk """
+    kmers = packed_kmer_array("GCGTAGCTTAAAAGTCCGATTTCAGGCATCCCGGTTAACCGATCGATC" * 3, 11)
+    xorFilter = xor_filter.XorFilter(kmers, 8)
+    assert xorFilter.contains_many(kmers).all()
+    assert all(xorFilter.contains(int(kmer)) for kmer in kmers)
+    assert len(xorFilter.contains_many([])) == 0
+
+
+def test_false_positive_rate():
+    """ Ensures about 2^-fp_size of absent items are reported, the same in bulk and one at a time """
+    xorFilter = xor_filter.XorFilter(np.arange(20000, dtype=np.uint64), 8)
+    absent = np.arange(20000, 120000, dtype=np.uint64)
+    results = xorFilter.contains_many(absent)
+    assert 0.002 < results.mean() < 0.006
+    assert [xorFilter.contains(int(item)) for item in absent[:2000]] == results[:2000].tolist()
+
+
+def test_empty_filter_and_bad_sizes():
+    """ Ensures an empty item set builds and invalid fingerprint sizes are refused """
+    assert xor_filter.XorFilter([], 8).num_items_in_filter == 0
+    with pytest.raises(ValueError):
+        xor_filter.XorFilter([1, 2], 33)
+    assert xor_filter.get_fingerprint_size(0.01) == 8
+    assert xor_filter.get_fingerprint_size(0.001) == 16
+
+
+def test_save_and_map(tmp_path):
+    """ Ensures a saved filter answers the same queries, loaded or memory-mapped """
+    path = str(tmp_path / "filter.bin")
+    xorFilter = xor_filter.XorFilter(range(0, 400, 2), 12)
+    xorFilter.save(path)
+    for mapped in [False, True]:
+        loaded = xor_filter.XorFilter.load(path, mapped=mapped)
+        assert [loaded.contains(q) for q in range(400)] == [xorFilter.contains(q) for q in range(400)]
+        assert loaded.contains_many(list(range(400))).tolist() == xorFilter.contains_many(list(range(400))).tolist()